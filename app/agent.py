@@ -0,0 +1,218 @@
+"""
+Agent di scansione per la modalità collector (vedi `collector`).
+
+Gira dentro un segmento di rete, chiede al collector gli shard delle
+zone che raggiunge, li scansiona e invia i risultati a lotti compressi
+man mano che le probe terminano. Un thread separato manda gli
+heartbeat con gli shard in lavorazione: se l'agent muore, o lascia uno
+shard perché il collector non risponde, il collector lo riassegna.
+Usa solo la libreria standard più lo stack delle probe (niente FastAPI).
+
+Uso: python -m app.agent --collector http://collector:8000 --name seg-a
+                         [--zone 10.54] [--token T] [--batch 50]
+"""
+import argparse
+import asyncio
+import contextlib
+import gzip
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+DEFAULT_BATCH = 50             # risultati per upload
+DEFAULT_FLUSH_SECONDS = 2.0    # attesa massima prima di inviare un lotto incompleto
+DEFAULT_HEARTBEAT = 10         # finché il collector non indica il suo intervallo
+MAX_UPLOAD_RETRIES = 5
+HTTP_TIMEOUT = 30
+
+
+class CollectorClient:
+    """Chiamate HTTP verso il collector: JSON, con gzip per i risultati."""
+
+    def __init__(self, url, name, zones=(), token=None):
+        self.url = url.rstrip("/")
+        self.name = name
+        self.zones = list(zones)
+        self.token = token
+
+    def _post(self, path, payload, compress=False):
+        body = json.dumps(dict(payload, agent=self.name), default=str).encode()
+        headers = {"Content-Type": "application/json"}
+        if compress:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        if self.token:
+            headers["X-Agent-Token"] = self.token
+        request = urllib.request.Request(self.url + path, data=body, headers=headers, method="POST")
+        with urllib.request.urlopen(request, timeout=HTTP_TIMEOUT) as response:
+            return json.loads(response.read())
+
+    def heartbeat(self, shards=None):
+        return self._post("/agent/heartbeat", {"zones": self.zones, "shards": shards})
+
+    def lease(self, max_shards=None):
+        return self._post("/agent/lease", {"zones": self.zones, "max_shards": max_shards})
+
+    def upload(self, shard_id, results, done=False):
+        """Invia un lotto, ritentando con backoff; ritorna True se lo shard è ancora nostro."""
+        for attempt in range(MAX_UPLOAD_RETRIES + 1):
+            try:
+                reply = self._post("/agent/results",
+                                   {"shard": shard_id, "results": results, "done": done}, compress=True)
+                return reply.get("lease", False)
+            except (OSError, ValueError) as e:
+                # Richiesta rifiutata (token, formato): ritentare non serve
+                if isinstance(e, urllib.error.HTTPError) and e.code < 500:
+                    raise
+                if attempt == MAX_UPLOAD_RETRIES:
+                    raise
+                delay = 2 ** attempt
+                print(f"🔁 Upload di {len(results)} risultati fallito ({e}), nuovo tentativo tra {delay}s",
+                      file=sys.stderr)
+                time.sleep(delay)
+
+
+def _heartbeats(client, interval, active, stop):
+    while not stop.wait(interval[0]):
+        try:
+            # copy(): il set cambia nel loop degli shard, qui si legge da un altro thread
+            client.heartbeat(sorted(active.copy()))
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Heartbeat fallito: {e}", file=sys.stderr)
+
+
+async def scan_shard(client, shard, probe, settings, batch=DEFAULT_BATCH, flush_seconds=DEFAULT_FLUSH_SECONDS):
+    """
+    Scansiona uno shard inviando i risultati a lotti. Se il collector
+    risponde che lo shard non è più nostro (riassegnato), si ferma.
+    Ritorna il numero di risultati inviati.
+    """
+    from .scanner import iter_scan
+
+    pending, sent = [], 0
+    last_flush = time.monotonic()
+
+    async def flush(done=False):
+        """Invia il lotto; False se lo shard non è più nostro o il collector non risponde."""
+        nonlocal pending, sent, last_flush
+        chunk, pending = pending, []
+        last_flush = time.monotonic()
+        try:
+            owned = await asyncio.to_thread(client.upload, shard["id"], chunk, done)
+        except (OSError, ValueError) as e:
+            if isinstance(e, urllib.error.HTTPError) and e.code < 500:
+                raise
+            # Retry esauriti: si lascia lo shard, che il prossimo heartbeat non elenca più
+            # (o che il collector riprende dopo `lease_timeout` senza risultati)
+            print(f"⚠️ Collector non raggiungibile, shard {shard['id']} abbandonato: {e}",
+                  file=sys.stderr)
+            return False
+        sent += len(chunk)
+        if not owned:
+            print(f"ℹ️  Shard {shard['id']} riassegnato, interrotto", file=sys.stderr)
+        return owned
+
+    stream = iter_scan(shard["entries"], probe, settings["concurrency"], settings["per_host"])
+    try:
+        async for result in stream:
+            pending.append(result)
+            if len(pending) >= batch or time.monotonic() - last_flush >= flush_seconds:
+                if not await flush():
+                    return sent
+    finally:
+        await stream.aclose()
+    await flush(done=True)
+    return sent
+
+
+async def run(client, args):
+    from functools import partial
+
+    from .checker import configure_probes, probe_entry
+
+    interval = [DEFAULT_HEARTBEAT]      # aggiornato dalle risposte del collector
+    active = set()                      # id degli shard in lavorazione, inviati con l'heartbeat
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeats, args=(client, interval, active, stop), daemon=True)
+    heartbeat.start()
+    try:
+        while True:
+            try:
+                reply = await asyncio.to_thread(client.lease, args.max_shards)
+            except urllib.error.HTTPError as e:
+                if e.code < 500:
+                    raise
+                print(f"⚠️ Errore del collector: {e}", file=sys.stderr)
+                await asyncio.sleep(DEFAULT_FLUSH_SECONDS * 2)
+                continue
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Collector non raggiungibile: {e}", file=sys.stderr)
+                await asyncio.sleep(DEFAULT_FLUSH_SECONDS * 2)
+                continue
+
+            settings = reply["settings"]
+            interval[0] = settings["heartbeat_seconds"]
+            if args.concurrency:
+                settings["concurrency"] = args.concurrency
+            # DNS, health, trust store e deep scan come le scansioni locali del collector
+            probes = settings["probes"]
+            if args.timeout:
+                probes["health"]["timeout"] = args.timeout
+            configure_probes(probes)
+            probe = partial(probe_entry, default_alert_days=settings["default_alert_days"])
+
+            shards = reply["shards"]
+            if not shards:
+                if args.once:
+                    return
+                await asyncio.sleep(settings["poll_seconds"])
+                continue
+
+            async def scan(shard):
+                try:
+                    return await scan_shard(client, shard, probe, settings, args.batch)
+                finally:
+                    active.discard(shard["id"])
+
+            # Gli shard ricevuti insieme vengono scansionati in parallelo
+            active.update(shard["id"] for shard in shards)
+            counts = await asyncio.gather(*(scan(shard) for shard in shards))
+            print(f"✅ {len(shards)} shard, {sum(counts)} risultati inviati", file=sys.stderr)
+    finally:
+        stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.agent",
+                                     description="Agent di scansione per la modalità collector.")
+    parser.add_argument("--collector", required=True, help="URL del collector, es. http://collector:8000")
+    parser.add_argument("--name", default=socket.gethostname(), help="nome univoco dell'agent")
+    parser.add_argument("--zone", action="append", default=[], help="zona raggiungibile (ripetibile)")
+    parser.add_argument("--token", default=os.environ.get("SSL_MONITOR_AGENT_TOKEN"))
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="risultati per upload")
+    parser.add_argument("--max-shards", type=int, help="shard in carico contemporaneamente")
+    parser.add_argument("--concurrency", type=int, help="probe contemporanee (default: dal collector)")
+    parser.add_argument("--timeout", type=float, help="timeout per probe in secondi")
+    parser.add_argument("--once", action="store_true", help="esce quando non c'è più lavoro")
+    args = parser.parse_args(argv)
+
+    client = CollectorClient(args.collector, args.name, args.zone, args.token)
+    try:
+        # Le stampe diagnostiche delle probe vanno su stderr, come nella CLI di scansione
+        with contextlib.redirect_stdout(sys.stderr):
+            asyncio.run(run(client, args))
+    except KeyboardInterrupt:
+        return 130
+    except urllib.error.HTTPError as e:
+        print(f"❌ Il collector ha rifiutato la richiesta: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import datetime
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from email.utils import format_datetime, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:  # brotli è opzionale: senza, si usa solo gzip
+    brotli = None
+
+BODY_CACHE_SIZE = 32     # corpi JSON e viste tenuti in memoria per generazione
+
+
+def _encode(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    return data
+
+
+def choose_encoding(accept_encoding):
+    """Codifica migliore accettata dal client: br (se disponibile), gzip o nessuna."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def http_date(moment):
+    """datetime locale naive -> data HTTP (GMT)."""
+    return format_datetime(moment.astimezone(datetime.timezone.utc), usegmt=True)
+
+
+def not_modified(etag, last_modified, if_none_match=None, if_modified_since=None):
+    """
+    Valuta le richieste condizionali: If-None-Match ha la precedenza,
+    If-Modified-Since viene considerato solo in sua assenza.
+    """
+    if if_none_match:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return last_modified.astimezone(datetime.timezone.utc).replace(microsecond=0) <= since
+    return False
+
+
+def changed_at(result):
+    value = result.get("changed_at")
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+class ResultsApi:
+    """
+    Corpi JSON di /api/results, preparati una volta per generazione dei
+    risultati (la lista restituita dalla cache, come per la dashboard).
+
+    - l'ETag (debole) dipende solo da endpoint e "changed_at": una nuova
+      scansione che non cambia lo stato di nessun endpoint non lo cambia,
+      così i client in polling continuano a ricevere 304;
+    - Last-Modified è il "changed_at" più recente;
+    - i corpi serializzati e compressi restano in un piccolo LRU, quindi
+      N client che leggono la stessa generazione costano una sola
+      serializzazione e una sola compressione per codifica; anche la
+      selezione per `since` e i validatori vengono calcolati una volta.
+    """
+
+    def __init__(self, sort=None):
+        self.sort = sort
+        self._lock = threading.Lock()
+        self._source = None
+        self._results = []
+        self._bodies = OrderedDict()
+
+    def _current(self, results):
+        with self._lock:
+            if results is self._source:
+                return self._results, self._bodies
+        ordered = self.sort(results) if self.sort is not None else results
+        with self._lock:
+            self._source, self._results, self._bodies = results, ordered, OrderedDict()
+            return ordered, self._bodies
+
+    def view(self, results, since=None):
+        """
+        (risultati selezionati, etag, last_modified): tutti i risultati
+        ordinati o, con `since`, solo quelli cambiati dopo quell'istante.
+        """
+        ordered, bodies = self._current(results)
+        key = ("view", since)
+        with self._lock:
+            cached = bodies.get(key)
+        if cached is not None:
+            return cached
+
+        if since is None:
+            selected = ordered
+        elif hasattr(ordered, "changed_since"):
+            # Risultati indicizzati dalla cache: ricerca binaria su "changed_at"
+            selected = ordered.changed_since(since)
+        else:
+            selected = [r for r in ordered if (changed_at(r) or since) > since]
+        view = (selected, *self.validators(selected, since.isoformat() if since else ""))
+        self._remember(bodies, {key: view})
+        return view
+
+    @staticmethod
+    def validators(selected, extra=""):
+        """(etag, last_modified) di un insieme di risultati."""
+        digest = hashlib.sha1(extra.encode())
+        last_modified = None
+        for r in selected:
+            digest.update(f'{r["domain"]}:{r.get("port")}@{r.get("changed_at")}\n'.encode())
+            moment = changed_at(r)
+            if moment is not None and (last_modified is None or moment > last_modified):
+                last_modified = moment
+        return f'W/"{digest.hexdigest()[:20]}"', last_modified
+
+    def body(self, results, key, payload, encoding):
+        """Corpo JSON (codificato con `encoding`) di `payload()`, dalla cache se presente."""
+        _, bodies = self._current(results)
+        with self._lock:
+            cached = bodies.get((key, encoding))
+            if cached is not None:
+                bodies.move_to_end((key, encoding))
+                return cached
+
+            raw = bodies.get((key, None))
+        if raw is None:
+            raw = json.dumps(payload(), ensure_ascii=False, default=str).encode()
+        data = _encode(raw, encoding)
+
+        self._remember(bodies, {(key, None): raw, (key, encoding): data})
+        return data
+
+    def _remember(self, bodies, items):
+        # Solo se nel frattempo non è arrivata una nuova generazione
+        with self._lock:
+            if bodies is self._bodies:
+                bodies.update(items)
+                while len(bodies) > BODY_CACHE_SIZE:
+                    bodies.popitem(last=False)
+
@@ -0,0 +1,260 @@
+import asyncio
+import datetime
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+from .checker import check_domains, iter_check_domains
+from .config import load_config
+from .index import ExpiryIndex, IndexedResults, endpoint_key
+from .notifier import notify
+from .scheduler import incremental_scan
+
+DEFAULT_TTL = 300  # secondi
+EMPTY = IndexedResults()   # risultati prima della prima scansione
+
+# Campi che cambiano a ogni probe senza che cambi lo stato dell'endpoint
+VOLATILE_FIELDS = ("dns_ms", "days_left", "suppressed_until", "changed_at", "capabilities_at",
+                   "agent")
+
+
+def state_signature(result):
+    """Firma dello stato di un endpoint, per capire se è cambiato tra due probe."""
+    state = {k: v for k, v in result.items() if k not in VOLATILE_FIELDS}
+    return json.dumps(state, sort_keys=True, default=str)
+
+
+class ResultCache:
+    """
+    Cache condivisa dei risultati di `check_domains`.
+
+    - i risultati restano validi per `ttl` secondi;
+    - richieste concorrenti durante una scansione aspettano quella in corso
+      (single-flight) invece di avviarne una propria;
+    - `refresh=True` forza una nuova scansione completa;
+    - con uno store e `scan.incremental` attivo (default), alla scadenza
+      del TTL vengono riprobati solo gli endpoint scaduti secondo lo
+      scheduler (vedi `scheduler.next_check_delay`), gli altri restano
+      all'ultimo stato salvato.
+
+    Ogni risultato porta "changed_at": l'ultima volta in cui lo stato
+    dell'endpoint è cambiato (ignorando i campi in `VOLATILE_FIELDS`).
+
+    L'ultimo stato vive in un `ExpiryIndex` aggiornato a ogni probe: i
+    risultati restituiti sono una `IndexedResults` già nell'ordine della
+    dashboard e interrogabile (in scadenza, in alert, cambiati da T)
+    senza che nessuno debba riordinare l'inventario.
+
+    Se è collegato un refresher in background (vedi `scheduler`), la cache
+    diventa lo store condiviso aggiornato da `update`: `get` non scansiona
+    mai e `refresh=True` chiede solo al refresher di anticipare il giro.
+    Senza refresher le scansioni partono da `get`, che accoda quindi anche
+    le notifiche degli endpoint in alert (vedi `notifier`).
+    """
+
+    def __init__(self, config_path="app/config.json", ttl=None, scan=None, store=None):
+        conf = load_config(config_path) if ttl is None or scan is None else {}
+        if ttl is None:
+            ttl = conf.get("scan", {}).get("cache_ttl_seconds", DEFAULT_TTL)
+        self.config_path = config_path
+        self.ttl = ttl
+        self._scan = scan or (lambda: check_domains(config_path, ordered=False))
+        # Stessa scansione completa, ma in streaming (vedi `iter_refresh`)
+        self._stream = None if scan else (lambda: iter_check_domains(config_path))
+        self._lock = threading.Lock()
+        self._results = None
+        self._scanned_at = None     # datetime dell'ultima scansione
+        self._expires_at = 0.0      # time.monotonic() di scadenza
+        self._inflight = None       # Future della scansione in corso
+        self._index = ExpiryIndex() # ultimo stato per (domain, port), con gli indici
+        self._refresher = None      # callback del refresher in background
+        self.store = store          # storico persistente (vedi `store`)
+        # Scansione incrementale solo con lo scan di default e uno store da cui ripartire
+        self.incremental = (scan is None and store is not None
+                            and conf.get("scan", {}).get("incremental", True))
+
+        if store is not None:
+            self._warm_from_store()
+
+    def _stamp_changes(self, results, now):
+        """
+        Imposta "changed_at" (ISO) su ogni risultato: resta quello
+        precedente se lo stato dell'endpoint non è cambiato. Da chiamare
+        con il lock, prima di aggiornare l'indice.
+        """
+        stamp = now.isoformat(timespec="seconds")
+        for r in results:
+            old = self._index.get(endpoint_key(r))
+            if (old is not None and "changed_at" in old
+                    and state_signature(old) == state_signature(r)):
+                r["changed_at"] = old["changed_at"]
+            else:
+                r["changed_at"] = stamp
+
+    def _warm_from_store(self):
+        """Riparte dall'ultimo stato salvato, senza riscansionare all'avvio."""
+        results, scanned_at = self.store.latest()
+        if not results:
+            return
+        self._index.replace(results)
+        self._results = self._index.view()
+        self._scanned_at = scanned_at
+        age = (datetime.datetime.now() - scanned_at).total_seconds()
+        self._expires_at = time.monotonic() + max(0.0, self.ttl - age)
+
+    def set_refresher(self, refresher):
+        """Collega (o scollega con None) il refresher in background."""
+        with self._lock:
+            self._refresher = refresher
+
+    def get(self, refresh=False):
+        """Ritorna (risultati, scanned_at), scansionando solo se necessario."""
+        with self._lock:
+            refresher = self._refresher
+            if refresher is not None:
+                results, scanned_at = self._current(), self._scanned_at
+        if refresher is not None:
+            if refresh:
+                refresher()
+            return results, scanned_at
+
+        with self._lock:
+            if (not refresh and self._results is not None
+                    and time.monotonic() < self._expires_at):
+                return self._results, self._scanned_at
+
+            inflight = self._inflight
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight = Future()
+
+        if not leader:
+            return inflight.result()
+
+        try:
+            if self.incremental and not refresh:
+                fresh, keys = incremental_scan(self.config_path, self.store)
+                self.update(fresh, keep=keys)
+                with self._lock:
+                    snapshot = (self._results, self._scanned_at)
+                self._notify(snapshot[0])
+                inflight.set_result(snapshot)
+                return snapshot
+
+            snapshot = self._replace(self._scan())
+            inflight.set_result(snapshot)
+            return snapshot
+        except BaseException as e:
+            inflight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight = None
+
+    def _replace(self, scanned):
+        """Sostituisce lo stato con una scansione completa; ritorna (risultati, scanned_at)."""
+        scanned_at = datetime.datetime.now()
+        with self._lock:
+            self._stamp_changes(scanned, scanned_at)
+            self._index.replace(scanned)
+            results = self._results = self._index.view()
+            self._scanned_at = scanned_at
+            self._expires_at = time.monotonic() + self.ttl
+            keep = set(self._index.keys())
+        if self.store is not None:
+            self.store.record(scanned, scanned_at)
+            self.store.forget(keep)
+        self._notify(results)
+        return results, scanned_at
+
+    def has_refresher(self):
+        with self._lock:
+            return self._refresher is not None
+
+    async def iter_refresh(self):
+        """
+        Scansione completa in streaming, dentro lo stesso single-flight di
+        `get`: produce i risultati man mano che le probe terminano e alla
+        fine aggiorna cache e store (in un thread, fuori dal loop). Se una
+        scansione è già in corso la attende e ne produce i risultati.
+        """
+        with self._lock:
+            inflight = self._inflight
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight = Future()
+
+        if not leader:
+            results, _ = await asyncio.wrap_future(inflight)
+            for r in results:
+                yield r
+            return
+
+        completed = False
+        try:
+            scanned = []
+            if self._stream is not None:
+                async for r in self._stream():
+                    scanned.append(r)
+                    yield r
+            else:
+                # Scansione personalizzata (non in streaming): righe a fine giro
+                scanned = await asyncio.to_thread(self._scan)
+                for r in scanned:
+                    yield r
+            inflight.set_result(await asyncio.to_thread(self._replace, scanned))
+            completed = True
+        except BaseException as e:
+            inflight.set_exception(e)
+            raise
+        finally:
+            if not completed and not inflight.done():
+                # Client disconnesso a metà: chi aspettava riceve un errore, la cache resta com'era
+                inflight.set_exception(RuntimeError("scansione interrotta"))
+            with self._lock:
+                self._inflight = None
+
+    def _notify(self, results):
+        # Senza refresher in background è la cache a scansionare: le notifiche
+        # partono da qui (solo accodamento, l'invio gira nel worker del notifier)
+        notify(results.alerts(), self.config_path)
+
+    def update(self, results, keep=None):
+        """
+        Unisce risultati parziali (es. i soli endpoint riscansionati) allo
+        stato corrente. Se `keep` è un insieme di chiavi (domain, port),
+        gli endpoint non più presenti vengono scartati.
+        """
+        scanned_at = datetime.datetime.now()
+        with self._lock:
+            self._stamp_changes(results, scanned_at)
+            self._index.update(results)
+            if keep is not None:
+                self._index.retain(keep)
+            self._results = self._index.view()
+            self._scanned_at = scanned_at
+            self._expires_at = time.monotonic() + self.ttl
+
+        if self.store is not None:
+            self.store.record(results, scanned_at)
+            if keep is not None:
+                self.store.forget(keep)
+
+    def find(self, domain, port):
+        """Ultimo risultato noto di un endpoint (o None), senza scansionare."""
+        with self._lock:
+            return self._index.get((domain, port))
+
+    def snapshot(self):
+        """(risultati, scanned_at) correnti, senza mai avviare una scansione."""
+        with self._lock:
+            return self._current(), self._scanned_at
+
+    def _current(self):
+        return self._results if self._results is not None else EMPTY
+
+    def invalidate(self):
+        """Segna i risultati come scaduti: la prossima `get` riscansiona."""
+        with self._lock:
+            self._expires_at = 0.0
@@ -0,0 +1,294 @@
+import contextlib
+import socket
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .resolver import DNS_CACHE, connect
+from .starttls import StartTLSError, upgrade
+from .store import ResultStore, store_settings
+
+DEFAULT_INTERVAL_HOURS = 168     # una deep scan a settimana se il certificato non cambia
+DEFAULT_CONCURRENCY = 4          # handshake in parallelo verso lo stesso host
+DEFAULT_MAX_HANDSHAKES = 16      # handshake di deep scan in parallelo nel processo
+DEFAULT_TIMEOUT = 5.0
+
+# 🧪 Versioni provate una per una (min = max), con tutti i cifrari permessi
+VERSIONS = (
+    ("tls1_0", ssl.TLSVersion.TLSv1),
+    ("tls1_1", ssl.TLSVersion.TLSv1_1),
+    ("tls1_2", ssl.TLSVersion.TLSv1_2),
+    ("tls1_3", ssl.TLSVersion.TLSv1_3),
+)
+
+# Famiglie di cifrari (TLS1.0-1.2: in TLS1.3 i cifrari non si scelgono così)
+CIPHER_FAMILIES = (
+    ("aead", "AESGCM:CHACHA20:AESCCM"),
+    ("cbc", "AES:CAMELLIA:ARIA:SEED:!AESGCM:!AESCCM:!ARIAGCM"),
+    ("3des", "3DES"),
+    ("rc4", "RC4"),
+    ("rsa_kex", "kRSA"),              # scambio chiavi senza forward secrecy
+    ("null", "eNULL:aNULL"),
+)
+
+CAPABILITIES = tuple(name for name, _ in VERSIONS + CIPHER_FAMILIES)
+CAPABILITY_BITS = {name: 1 << i for i, name in enumerate(CAPABILITIES)}
+
+# Capacità da segnalare come deboli se accettate
+WEAK = ("tls1_0", "tls1_1", "3des", "rc4", "rsa_kex", "null")
+WEAK_MASK = sum(CAPABILITY_BITS[name] for name in WEAK)
+
+# Errori del nostro OpenSSL: la capacità non è offribile, quindi non testata
+_CLIENT_REASONS = ("NO_PROTOCOLS_AVAILABLE", "NO_CIPHERS_AVAILABLE", "NO_CIPHER_MATCH")
+
+
+def capability_settings(config):
+    """Legge la sezione "capabilities" del config (deep scan, disattivata di default)."""
+    conf = config.get("capabilities", {})
+    return {
+        "enabled": conf.get("enabled", False),
+        "interval": conf.get("interval_hours", DEFAULT_INTERVAL_HOURS) * 3600,
+        "concurrency": conf.get("concurrency", DEFAULT_CONCURRENCY),
+        "max_handshakes": conf.get("max_parallel_handshakes", DEFAULT_MAX_HANDSHAKES),
+        "timeout": conf.get("timeout_seconds", DEFAULT_TIMEOUT),
+        # Da qui si riprendono le bitmap precedenti in un processo nuovo
+        "store_path": store_settings(config)["path"],
+    }
+
+
+def decode(bitmap):
+    """Nomi delle capacità presenti nella bitmap."""
+    return [name for name in CAPABILITIES if bitmap & CAPABILITY_BITS[name]]
+
+
+def _context(name):
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    versions = dict(VERSIONS)
+    if name in versions:
+        ctx.minimum_version = ctx.maximum_version = versions[name]
+        ctx.set_ciphers("ALL:COMPLEMENTOFALL:@SECLEVEL=0")
+    else:
+        ctx.minimum_version = ssl.TLSVersion.TLSv1
+        ctx.maximum_version = ssl.TLSVersion.TLSv1_2
+        ctx.set_ciphers(dict(CIPHER_FAMILIES)[name] + ":@SECLEVEL=0")
+    return ctx
+
+
+def _offer(addrs, server_name, timeout, name, starttls=None):
+    """
+    Un handshake che offre solo la versione o la famiglia `name` (dopo
+    l'upgrade `starttls`, per i servizi che passano a TLS in banda).
+    Ritorna True (accettata), False (rifiutata) o None (non testata:
+    il nostro OpenSSL non la supporta oppure errore di rete).
+    """
+    try:
+        ctx = _context(name)
+    except (ssl.SSLError, ValueError):
+        return None
+
+    try:
+        conn, _ = connect(addrs, timeout)
+    except OSError:
+        return None
+    try:
+        if starttls:
+            upgrade(conn, starttls)
+    except (OSError, StartTLSError):
+        conn.close()
+        return None
+    try:
+        with ctx.wrap_socket(conn, server_hostname=server_name):
+            return True
+    except ssl.SSLError as e:
+        return None if e.reason in _CLIENT_REASONS else False
+    except socket.timeout:
+        return None
+    except OSError:
+        # Connessione chiusa durante l'handshake: molti server rifiutano così
+        return False
+    finally:
+        conn.close()
+
+
+class HandshakeLimiter:
+    """
+    Limiti degli handshake di deep scan, condivisi da tutte le probe del
+    processo: la deep scan gira dentro una probe, che ha già i suoi slot
+    nello scanner, quindi i suoi handshake extra non devono moltiplicarsi
+    per il numero di probe. Al massimo `total` nel processo e `per_host`
+    verso lo stesso host (anche da porte diverse).
+    """
+
+    def __init__(self, total=DEFAULT_MAX_HANDSHAKES, per_host=DEFAULT_CONCURRENCY):
+        self._lock = threading.Lock()
+        self._hosts = {}  # host -> [semaforo, utilizzatori]
+        self.limits = None
+        self.configure(total, per_host)
+
+    def configure(self, total=DEFAULT_MAX_HANDSHAKES, per_host=DEFAULT_CONCURRENCY):
+        with self._lock:
+            if self.limits == (total, per_host):
+                return
+            self.limits = (total, per_host)
+            # Gli handshake in corso finiscono con i semafori vecchi
+            self._total = threading.BoundedSemaphore(max(1, total))
+            self._hosts = {}
+
+    @contextlib.contextmanager
+    def hold(self, host):
+        with self._lock:
+            total = self._total
+            slot = self._hosts.get(host)
+            if slot is None:
+                slot = self._hosts[host] = [threading.BoundedSemaphore(max(1, self.limits[1])), 0]
+            slot[1] += 1
+        try:
+            with slot[0], total:
+                yield
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if slot[1] == 0 and self._hosts.get(host) is slot:
+                    del self._hosts[host]
+
+
+HANDSHAKES = HandshakeLimiter()
+
+
+def _limited_offer(host, addrs, server_name, timeout, name, starttls):
+    with HANDSHAKES.hold(host):
+        return name, _offer(addrs, server_name, timeout, name, starttls)
+
+
+def scan_capabilities(host, port, server_name=None, timeout=DEFAULT_TIMEOUT,
+                      concurrency=DEFAULT_CONCURRENCY, starttls=None):
+    """
+    Deep scan di un endpoint: un handshake per ogni versione e famiglia
+    di cifrari, al massimo `concurrency` alla volta e nei limiti di
+    processo e per host di `HANDSHAKES`.
+    Ritorna (bitmap accettate, bitmap testate).
+    """
+    addrs, _ = DNS_CACHE.resolve(host, port)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        outcomes = pool.map(
+            lambda name: _limited_offer(host, addrs, server_name or host, timeout, name, starttls),
+            CAPABILITIES,
+        )
+        accepted = tested = 0
+        for name, outcome in outcomes:
+            if outcome is None:
+                continue
+            tested |= CAPABILITY_BITS[name]
+            if outcome:
+                accepted |= CAPABILITY_BITS[name]
+    return accepted, tested
+
+
+class CapabilityCache:
+    """
+    Ultima deep scan per endpoint: (fingerprint, accettate, testate, istante).
+
+    La deep scan costa una decina di handshake, quindi si ripete solo se
+    il certificato è cambiato (fingerprint diverso) o se è passato
+    `interval`; altrimenti la probe riporta la bitmap precedente. In un
+    processo nuovo (worker di uno shard, riavvio) lo stato viene letto
+    una volta dall'ultimo stato salvato nello store.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seed_lock = threading.Lock()  # lettura dello store, fuori da `_lock`
+        self._entries = {}
+        self._store_path = None
+        self._seeded = False
+        self.configure()
+
+    def configure(self, enabled=False, interval=DEFAULT_INTERVAL_HOURS * 3600,
+                  concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, store_path=None,
+                  max_handshakes=DEFAULT_MAX_HANDSHAKES):
+        with self._lock:
+            self.enabled = enabled
+            self.interval = interval
+            self.concurrency = concurrency
+            self.timeout = timeout
+            if store_path != self._store_path:
+                self._store_path, self._seeded = store_path, False
+        HANDSHAKES.configure(max_handshakes, concurrency)
+
+    def _seed(self):
+        """
+        Legge una volta le bitmap dallo store. Chi arriva nel frattempo
+        aspetta su `_seed_lock`, mentre `_lock` resta libero per le scan.
+        """
+        if self._seeded:
+            return
+        with self._seed_lock:
+            with self._lock:
+                if self._seeded:
+                    return
+                path = self._store_path
+            results = []
+            if path is not None:
+                try:
+                    store = ResultStore(path)
+                    try:
+                        results = [result for result, _ in store.latest_state().values()]
+                    finally:
+                        store.close()
+                except Exception as e:
+                    print(f"⚠️ Stato delle deep scan non leggibile: {e}")
+            with self._lock:
+                if path == self._store_path:
+                    self._seeded = True
+            self.seed(results)
+
+    def seed(self, results):
+        """Riprende le bitmap già presenti in una lista di risultati."""
+        with self._lock:
+            for r in results:
+                if "capabilities" not in r:
+                    continue
+                key = (r["domain"], r.get("port"))
+                self._entries.setdefault(key, (
+                    r.get("fingerprint"), r["capabilities"], r.get("capabilities_tested", 0),
+                    r.get("capabilities_at", 0.0),
+                ))
+
+    def lookup(self, key, fingerprint, now=None):
+        """Bitmap ancora valida per l'endpoint (dict di campi del risultato) oppure None."""
+        now = now or time.time()
+        self._seed()
+        with self._lock:
+            cached = self._entries.get(key)
+        if cached is None or cached[0] != fingerprint or now - cached[3] >= self.interval:
+            return None
+        return _fields(*cached[1:])
+
+    def scan(self, key, fingerprint, server_name=None, starttls=None, now=None):
+        """Deep scan dell'endpoint, se serve; ritorna i campi da aggiungere al risultato."""
+        fields = self.lookup(key, fingerprint, now)
+        if fields is not None:
+            return fields
+        host, port = key
+        accepted, tested = scan_capabilities(host, port, server_name, self.timeout,
+                                             self.concurrency, starttls)
+        scanned_at = time.time()
+        with self._lock:
+            self._entries[key] = (fingerprint, accepted, tested, scanned_at)
+        return _fields(accepted, tested, scanned_at)
+
+
+def _fields(accepted, tested, scanned_at):
+    return {
+        "capabilities": accepted,
+        "capabilities_tested": tested,
+        "capabilities_at": scanned_at,
+        "weak_capabilities": decode(accepted & WEAK_MASK),
+    }
+
+
+# 🧪 Stato delle deep scan di questo processo
+CAPABILITY_CACHE = CapabilityCache()
@@ -0,0 +1,67 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = 4096
+
+
+def fingerprint(der):
+    """SHA-256 del certificato DER, in esadecimale."""
+    return hashlib.sha256(der).hexdigest()
+
+
+class CertCache:
+    """
+    Cache LRU dei campi immutabili dei certificati, indicizzata per
+    fingerprint SHA-256 del DER.
+
+    Tra una scansione e l'altra il certificato di un endpoint quasi
+    sempre non cambia: con la cache il parsing X.509 avviene una sola
+    volta per certificato. È thread-safe (le probe girano in un thread pool).
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get_or_parse(self, der, parse):
+        """
+        Ritorna (fingerprint, campi) per `der`, chiamando `parse(der)` solo
+        se il certificato non è in cache. Le eccezioni di `parse` non
+        vengono messe in cache.
+        """
+        key = fingerprint(der)
+        with self._lock:
+            fields = self._items.get(key)
+            if fields is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return key, fields
+            self.misses += 1
+
+        fields = parse(der)
+
+        with self._lock:
+            self._items[key] = fields
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return key, fields
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,252 @@
+import datetime
+import re
+import ssl
+import threading
+import warnings
+from collections import OrderedDict
+
+from cryptography import x509
+from cryptography.utils import CryptographyDeprecationWarning
+from cryptography.x509.oid import ExtensionOID, NameOID
+
+from .certcache import CertCache
+
+DEFAULT_CACHE_SIZE = 1024    # catene di emittenti validate tenute in memoria
+MAX_DEPTH = 8                # certificati intermedi massimi tra foglia e root
+
+# Alcune root storiche del trust store hanno seriali non conformi: non sono errori nostri
+warnings.filterwarnings("ignore", category=CryptographyDeprecationWarning,
+                        module=re.escape(__name__))
+
+
+def chain_settings(config):
+    """Legge la sezione "chain" del config (trust store e dimensione della cache)."""
+    conf = config.get("chain", {})
+    return {
+        "ca_file": conf.get("ca_file"),
+        "cache_size": conf.get("cache_size", DEFAULT_CACHE_SIZE),
+    }
+
+
+def default_ca_file():
+    paths = ssl.get_default_verify_paths()
+    return paths.cafile or paths.openssl_cafile
+
+
+def chain_to_der(chain):
+    """
+    DER dei certificati presentati dal server. `get_unverified_chain`
+    ritorna DER (Python 3.13+) oppure oggetti `_ssl.Certificate` (3.10-3.12).
+    """
+    return [c if isinstance(c, bytes) else c.public_bytes(ssl._ssl.ENCODING_DER) for c in chain]
+
+
+def presented_chain(sock):
+    """Catena presentata nell'handshake appena concluso (lista di DER, foglia inclusa)."""
+    getter = getattr(sock, "get_unverified_chain", None)
+    if getter is None:
+        sslobj = getattr(sock, "_sslobj", None)
+        getter = getattr(sslobj, "get_unverified_chain", None)
+    if getter is None:
+        return []
+    return chain_to_der(getter() or [])
+
+
+def _common_name(name):
+    attrs = name.get_attributes_for_oid(NameOID.COMMON_NAME)
+    return attrs[0].value if attrs else name.rfc4514_string()
+
+
+def _aki(cert):
+    try:
+        ext = cert.extensions.get_extension_for_oid(ExtensionOID.AUTHORITY_KEY_IDENTIFIER)
+        return ext.value.key_identifier
+    except x509.ExtensionNotFound:
+        return None
+
+
+def _issued_by(cert, issuer):
+    if cert.issuer != issuer.subject:
+        return False
+    try:
+        cert.verify_directly_issued_by(issuer)
+        return True
+    except Exception:
+        return False
+
+
+def _not_after(cert):
+    moment = getattr(cert, "not_valid_after_utc", None)
+    return moment.replace(tzinfo=None) if moment else cert.not_valid_after
+
+
+class ChainValidator:
+    """
+    Validazione della catena presentata dal server contro un trust store
+    (default: quello di sistema, oppure `chain.ca_file` nel config; gli
+    agent remoti ricevono dal collector il contenuto PEM in `ca_data`).
+
+    La catena arriva dallo stesso handshake della probe, nessuna
+    connessione in più. Per la foglia si verifica solo la firma
+    dell'emittente; la costruzione del percorso emittente → root è messa
+    in cache per chiave dell'emittente (subject, authority key id e
+    intermedi presentati), così migliaia di endpoint con la stessa CA la
+    pagano una volta sola.
+
+    `validate` ritorna un dict con:
+      - "chain_status": "valid", "missing_intermediate", "untrusted",
+        "self_signed" o "expired_intermediate";
+      - "chain": descrizione leggibile;
+      - "chain_incomplete": True se manca una CA intermedia.
+    """
+
+    def __init__(self, ca_file=None, cache_size=DEFAULT_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._anchors_lock = threading.Lock()  # un solo thread legge il trust store
+        self._certs = CertCache()   # intermedi presentati: fingerprint -> x509
+        self.hits = 0
+        self.misses = 0
+        self.configure(ca_file, cache_size)
+
+    def configure(self, ca_file=None, cache_size=DEFAULT_CACHE_SIZE, ca_data=None):
+        with self._lock:
+            trust = (ca_file, ca_data)
+            if getattr(self, "_trust", None) != trust:
+                self._anchors = None    # caricati alla prima validazione
+                self._issuers = OrderedDict()
+            self._trust = trust
+            self.ca_file = ca_file
+            self.cache_size = cache_size
+
+    def _load_anchors(self, trust):
+        ca_file, ca_data = trust
+        if ca_data:
+            pem = ca_data.encode() if isinstance(ca_data, str) else ca_data
+        else:
+            path = ca_file or default_ca_file()
+            if not path:
+                return {}
+            with open(path, "rb") as f:
+                pem = f.read()
+        anchors = {}
+        for cert in x509.load_pem_x509_certificates(pem):
+            anchors.setdefault(cert.subject, []).append(cert)
+        return anchors
+
+    def anchors(self):
+        """
+        Root del trust store, caricate una sola volta: i thread delle probe
+        che arrivano durante il caricamento aspettano quello in corso.
+        """
+        anchors = self._anchors
+        if anchors is not None:
+            return anchors
+        with self._anchors_lock:
+            with self._lock:
+                anchors, trust = self._anchors, self._trust
+            if anchors is None:
+                anchors = self._load_anchors(trust)
+                with self._lock:
+                    # Se nel frattempo `configure` ha cambiato trust store, le root restano da ricaricare
+                    if self._trust == trust:
+                        self._anchors = anchors
+        return anchors
+
+    def _parse(self, der):
+        """(fingerprint, certificato), parsando ogni DER una sola volta."""
+        return self._certs.get_or_parse(der, x509.load_der_x509_certificate)
+
+    def validate(self, leaf_der, chain_ders, now=None):
+        now = now or datetime.datetime.utcnow()
+        _, leaf = self._parse(leaf_der)
+        parsed = [self._parse(der) for der in chain_ders if der != leaf_der]
+        presented = [cert for _, cert in parsed]
+        anchors = self.anchors()
+
+        if leaf.issuer == leaf.subject and _issued_by(leaf, leaf):
+            if any(_issued_by(leaf, a) for a in anchors.get(leaf.issuer, ())):
+                return _outcome("valid", "✔ chain valida (certificato nel trust store)")
+            return _outcome("self_signed", "⚠ certificato self-signed")
+
+        # L'emittente diretto della foglia: tra gli intermedi presentati o nel trust store
+        issuer = next((c for c in presented if _issued_by(leaf, c)), None)
+        if issuer is None:
+            if any(_issued_by(leaf, a) for a in anchors.get(leaf.issuer, ())):
+                return _outcome("valid", "✔ chain valida (emessa da una root)")
+            return _outcome(
+                "missing_intermediate",
+                f"⚠ CA intermedia mancante: {_common_name(leaf.issuer)}",
+            )
+
+        key = (leaf.issuer.public_bytes(), _aki(leaf), tuple(fp for fp, _ in parsed))
+        with self._lock:
+            cached = self._issuers.get(key)
+            if cached is not None and (cached[1] is None or now < cached[1]):
+                self._issuers.move_to_end(key)
+                self.hits += 1
+                return dict(cached[0])
+            self.misses += 1
+
+        outcome, valid_until = self._build(issuer, presented, anchors, now)
+        with self._lock:
+            self._issuers[key] = (outcome, valid_until)
+            while len(self._issuers) > self.cache_size:
+                self._issuers.popitem(last=False)
+        return dict(outcome)
+
+    def _build(self, issuer, presented, anchors, now):
+        """
+        Percorso dall'emittente della foglia a una root del trust store.
+        Ritorna (esito, istante fino a cui l'esito resta valido).
+        """
+        path = [issuer]
+        current = issuer
+        valid_until = None
+        for _ in range(MAX_DEPTH):
+            not_after = _not_after(current)
+            if not_after <= now:
+                return _outcome(
+                    "expired_intermediate",
+                    f"⚠ CA intermedia scaduta: {_common_name(current.subject)}",
+                ), None
+            valid_until = not_after if valid_until is None else min(valid_until, not_after)
+
+            if any(current == a for a in anchors.get(current.subject, ())):
+                break
+            anchor = next((a for a in anchors.get(current.issuer, ()) if _issued_by(current, a)), None)
+            if anchor is not None:
+                path.append(anchor)
+                valid_until = min(valid_until, _not_after(anchor))
+                break
+            if current.issuer == current.subject:
+                return _outcome(
+                    "untrusted", f"⚠ root non attendibile: {_common_name(current.subject)}"
+                ), valid_until
+            parent = next((c for c in presented if c not in path and _issued_by(current, c)), None)
+            if parent is None:
+                return _outcome(
+                    "missing_intermediate",
+                    f"⚠ CA intermedia mancante: {_common_name(current.issuer)}",
+                ), valid_until
+            path.append(parent)
+            current = parent
+        else:
+            return _outcome("untrusted", "⚠ catena troppo lunga"), valid_until
+
+        return _outcome("valid", f"✔ chain valida ({len(path) + 1} certificati)"), valid_until
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._issuers), "hits": self.hits, "misses": self.misses}
+
+
+def _outcome(status, text):
+    return {
+        "chain_status": status,
+        "chain": text,
+        "chain_incomplete": status == "missing_intermediate",
+    }
+
+
+# 🔗 Validatore condiviso dalle probe di questo processo
+CHAIN_VALIDATOR = ChainValidator()
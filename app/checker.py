@@ -1,46 +1,117 @@
 import ssl
 import socket
+import time
 from datetime import datetime
-from OpenSSL import crypto
+from functools import partial
 
+from cryptography import x509
+from cryptography.x509.oid import ExtensionOID, NameOID
 
-def _handshake(host, port, context, timeout=5, use_sni=True):
+from .capabilities import CAPABILITY_CACHE, capability_settings
+from .certcache import CertCache
+from .chain import CHAIN_VALIDATOR, chain_settings, presented_chain
+from .config import load_config
+from .health import HEALTH, health_settings
+from .metrics import METRICS
+from .resolver import DNS_CACHE, connect, dns_settings
+from .scanner import iter_scan, run_sharded, scan_settings
+from .starttls import BANNER_WAIT, StartTLSError, detect, read_banner, upgrade
+from .targets import iter_targets
+
+
+def _resolve(host, port):
+    """
+    Risolve host:port una sola volta, passando dalla cache DNS condivisa.
+    Ritorna (lista di addrinfo, latenza ms della risoluzione).
+    """
+    return DNS_CACHE.resolve(host, port)
+
+
+def _connect(addrs, timeout=5):
     """
-    Esegue una connessione TCP e un handshake TLS con il contesto passato.
-    Ritorna (certificato, versione_tls) oppure solleva eccezioni.
+    Apre una connessione TCP provando gli indirizzi già risolti in ordine.
+    Ritorna (connessione, addrinfo che ha risposto).
+    """
+    return connect(addrs, timeout)
+
+
+def _handshake(conn, host, context, use_sni=True):
+    """
+    Esegue l'handshake TLS sulla connessione TCP già aperta.
+    Ritorna (certificato DER, versione_tls, catena presentata in DER)
+    oppure solleva eccezioni. La connessione viene sempre chiusa.
     """
-    conn = socket.create_connection((host, port), timeout=timeout)
     try:
         if use_sni:
             sock = context.wrap_socket(conn, server_hostname=host)
         else:
             sock = context.wrap_socket(conn)
 
-        version = sock.version() or ""  # Es: 'TLSv1.2'
-
-        der = sock.getpeercert(binary_form=True)
-        sock.close()
+        try:
+            version = sock.version() or ""  # Es: 'TLSv1.2'
+            der = sock.getpeercert(binary_form=True)
+            chain = presented_chain(sock)
+        finally:
+            sock.close()
 
         if not der:
             raise ValueError("no_cert")
 
-        cert = crypto.load_certificate(crypto.FILETYPE_ASN1, der)
-        return cert, version
+        return der, version, chain
 
-    except Exception:
-        try:
-            sock.close()
-        except Exception:
-            pass
-        raise
+    finally:
+        conn.close()
+
+
+def _classify_connect_error(exc):
+    """Traduce un errore di connessione TCP in (protocol_state, messaggio)."""
+    if isinstance(exc, socket.timeout):
+        return "timeout", "Timeout di connessione"
+    if isinstance(exc, ConnectionRefusedError):
+        return "refused", "Connessione rifiutata"
+    return "refused", f"Errore di connessione: {exc}"
 
 
-def fetch_tls_info(host, port, timeout=5):
+def _starttls(conn, mode, timeout):
+    """
+    Upgrade STARTTLS sulla connessione appena aperta. Con `mode` "auto" la
+    modalità viene dedotta dal banner, sulla stessa connessione: se il
+    server tace si procede con TLS diretto. Ritorna la modalità usata o None.
+    """
+    banner = b""
+    if mode == "auto":
+        banner = read_banner(conn, min(BANNER_WAIT, timeout))
+        if not banner:
+            return None
+        mode = detect(banner)
+        if mode is None:
+            raise StartTLSError(f"banner non riconosciuto: {banner[:60]!r}")
+    upgrade(conn, mode, banner)
+    return mode
+
+
+def fetch_tls_info(host, port, timeout=5, server_name=None, timings=None, starttls=None):
     """
     Prova a connettersi e fare handshake TLS.
 
+    `server_name` è il nome da inviare come SNI quando `host` è un
+    indirizzo ottenuto da un fan-out DNS (default: `host`).
+    Se `timings` è un dict, vi vengono registrate le latenze delle fasi:
+    "dns_ms", "connect_ms", "handshake_ms" e, se c'è stato il fallback
+    TLS1.0, "legacy_fallback" e "legacy_handshake_ms".
+
+    `starttls` è una modalità di `starttls.STARTTLS_MODES` (o "auto") per
+    i servizi che passano a TLS in banda: il dialogo in chiaro avviene
+    sulla stessa connessione prima dell'handshake ("starttls_ms").
+
+    La classificazione timeout/refused avviene sulla stessa connessione
+    usata per l'handshake; l'eventuale fallback TLS1.0 riusa l'indirizzo
+    già risolto. Un endpoint sano costa quindi una sola connessione.
+
     Ritorna:
-      - ({"cert": cert, "protocol": label}, None, None) se il certificato è stato ottenuto
+      - ({"der": der, "protocol": label, "chain": [der, ...], "starttls": modalità},
+        None, None) se il certificato è stato ottenuto; "chain" è la catena
+        presentata dal server nello stesso handshake (foglia inclusa)
       - (None, protocol_state, error_message) se qualcosa va storto
 
     protocol_state può essere:
@@ -48,24 +119,47 @@ def fetch_tls_info(host, port, timeout=5):
       - "no_tls", "timeout", "refused", "unknown"
     """
 
-    # 1️⃣ Verifica porta raggiungibile (TCP)
+    # 1️⃣ Risoluzione + connessione TCP (una sola volta)
+    if timings is None:
+        timings = {}
     try:
-        conn = socket.create_connection((host, port), timeout=timeout)
-        conn.close()
-    except socket.timeout:
-        return None, "timeout", "Timeout di connessione"
-    except ConnectionRefusedError:
-        return None, "refused", "Connessione rifiutata"
+        addrs, timings["dns_ms"] = _resolve(host, port)
+        start = time.perf_counter()
+        conn, addr = _connect(addrs, timeout=timeout)
+        timings["connect_ms"] = (time.perf_counter() - start) * 1000
     except OSError as e:
-        return None, "refused", f"Errore di connessione: {e}"
+        state, msg = _classify_connect_error(e)
+        return None, state, msg
 
-    # 2️⃣ Primo tentativo: TLS moderno (1.2/1.3 auto)
+    # 2️⃣ STARTTLS: dialogo in chiaro prima dell'handshake, se richiesto
+    mode = None
+    if starttls:
+        start = time.perf_counter()
+        try:
+            mode = _starttls(conn, starttls, timeout)
+        except socket.timeout:
+            conn.close()
+            return None, "timeout", "Timeout durante STARTTLS"
+        except (StartTLSError, ValueError) as e:
+            conn.close()
+            return None, "no_tls", f"STARTTLS non riuscito: {e}"
+        except OSError as e:
+            conn.close()
+            return None, "refused", f"Errore durante STARTTLS: {e}"
+        finally:
+            timings["starttls_ms"] = (time.perf_counter() - start) * 1000
+
+    # 3️⃣ Primo tentativo: TLS moderno (1.2/1.3 auto) sulla stessa connessione
     ctx = ssl._create_unverified_context()
     ctx.check_hostname = False
     ctx.verify_mode = ssl.CERT_NONE
 
+    start = time.perf_counter()
     try:
-        cert, version = _handshake(host, port, ctx, timeout=timeout, use_sni=True)
+        try:
+            der, version, chain = _handshake(conn, server_name or host, ctx, use_sni=True)
+        finally:
+            timings["handshake_ms"] = (time.perf_counter() - start) * 1000
 
         v = (version or "").lower()
         if "tlsv1.3" in v or "tlsv1.2" in v:
@@ -77,7 +171,7 @@ def fetch_tls_info(host, port, timeout=5):
         else:
             proto_label = "unknown"
 
-        return {"cert": cert, "protocol": proto_label}, None, None
+        return {"der": der, "protocol": proto_label, "chain": chain, "starttls": mode}, None, None
 
     except ssl.SSLError as e1:
         msg = str(e1).lower()
@@ -86,7 +180,9 @@ def fetch_tls_info(host, port, timeout=5):
         if "wrong version number" in msg or "unknown protocol" in msg:
             return None, "no_tls", "Servizio non TLS sulla porta specificata"
 
-        # 3️⃣ Fallback: TLS1.0 “vecchio” con ciphers deboli consentiti
+        # 4️⃣ Fallback: TLS1.0 “vecchio” con ciphers deboli consentiti,
+        #    su una nuova connessione verso lo stesso indirizzo risolto
+        timings["legacy_fallback"] = True
         try:
             legacy_ctx = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
             legacy_ctx.check_hostname = False
@@ -101,13 +197,29 @@ def fetch_tls_info(host, port, timeout=5):
                 # Se l’OpenSSL sotto non capisce @SECLEVEL, ignora senza rompere
                 pass
 
-            cert, version = _handshake(
-                host, port, legacy_ctx, timeout=timeout, use_sni=False
-            )
+            try:
+                legacy_conn, _ = _connect([addr], timeout=timeout)
+            except OSError as e:
+                state, msg = _classify_connect_error(e)
+                return None, state, msg
+            if mode is not None:
+                try:
+                    upgrade(legacy_conn, mode)
+                except Exception:
+                    legacy_conn.close()
+                    raise
+
+            start = time.perf_counter()
+            try:
+                der, version, chain = _handshake(legacy_conn, server_name or host, legacy_ctx, use_sni=False)
+            finally:
+                timings["legacy_handshake_ms"] = (time.perf_counter() - start) * 1000
 
             # Se arrivo qui HO il certificato: è TLS legacy
-            return {"cert": cert, "protocol": "tls_legacy"}, None, None
+            return {"der": der, "protocol": "tls_legacy", "chain": chain, "starttls": mode}, None, None
 
+        except StartTLSError as e2:
+            return None, "no_tls", f"STARTTLS non riuscito: {e2}"
         except ssl.SSLError as e2:
             msg2 = str(e2)
             # Porta parla qualcosa tipo SSL/TLS ma non riusciamo a completare
@@ -124,103 +236,277 @@ def fetch_tls_info(host, port, timeout=5):
         return None, "refused", f"Errore handshake: {e}"
 
 
-def parse_certificate(cert):
-    """Estrae dati dal certificato (anche se la chain è incompleta)."""
-    try:
-        expires = datetime.strptime(
-            cert.get_notAfter().decode(), "%Y%m%d%H%M%SZ"
-        )
-        days_left = (expires - datetime.utcnow()).days
+# 🗂️ Campi immutabili dei certificati già visti, per fingerprint SHA-256
+CERT_CACHE = CertCache()
+
+SAN_PREFIXES = {
+    x509.DNSName: "DNS",
+    x509.IPAddress: "IP Address",
+    x509.RFC822Name: "email",
+    x509.UniformResourceIdentifier: "URI",
+}
+
+
+def _format_san(name):
+    """Stesso formato di OpenSSL: "DNS:example.com", "IP Address:10.0.0.1", ..."""
+    prefix = SAN_PREFIXES.get(type(name), "othername")
+    return f"{prefix}:{name.value}"
+
 
-        issuer_parts = dict(cert.get_issuer().get_components())
-        issuer = ", ".join([
-            issuer_parts.get(b"O", b"").decode(),
-            issuer_parts.get(b"CN", b"").decode()
-        ]).strip(", ")
+def _cert_fields(cert):
+    """Campi immutabili di un certificato `cryptography`: scadenza, issuer, SAN."""
+    expires = getattr(cert, "not_valid_after_utc", None)
+    expires = expires.replace(tzinfo=None) if expires else cert.not_valid_after
 
+    def issuer_attr(oid):
+        attrs = cert.issuer.get_attributes_for_oid(oid)
+        return attrs[0].value if attrs else ""
+
+    issuer = ", ".join([
+        issuer_attr(NameOID.ORGANIZATION_NAME),
+        issuer_attr(NameOID.COMMON_NAME),
+    ]).strip(", ")
+
+    try:
+        ext = cert.extensions.get_extension_for_oid(ExtensionOID.SUBJECT_ALTERNATIVE_NAME)
+        san_list = [_format_san(name) for name in ext.value]
+    except x509.ExtensionNotFound:
         san_list = []
-        for i in range(cert.get_extension_count()):
-            ext = cert.get_extension(i)
-            if ext.get_short_name() == b"subjectAltName":
-                san_list = [entry.strip() for entry in str(ext).split(",")]
-                break
-
-        return {
-            "expires": expires.strftime("%Y-%m-%d"),
-            "days_left": days_left,
-            "issuer": issuer if issuer else "Unknown",
-            "san": san_list,
-            "chain": "⚠ chain non validata (possibili CA intermedie mancanti)",
-            "chain_incomplete": True,
-        }
+
+    return {
+        "expires": expires,
+        "issuer": issuer if issuer else "Unknown",
+        "san": tuple(san_list),
+    }
+
+
+def _parse_der(der):
+    return _cert_fields(x509.load_der_x509_certificate(der))
+
+
+def _certificate_result(fields):
+    """Dati del certificato; days_left viene ricalcolato a ogni chiamata."""
+    expires = fields["expires"]
+    return {
+        "expires": expires.strftime("%Y-%m-%d"),
+        "days_left": (expires - datetime.utcnow()).days,
+        "issuer": fields["issuer"],
+        "san": list(fields["san"]),
+        "chain": "⚠ chain non validata (possibili CA intermedie mancanti)",
+        "chain_incomplete": True,
+    }
+
+
+def parse_der(der):
+    """
+    Come `parse_certificate`, ma parte dal DER e usa `CERT_CACHE`:
+    un certificato già visto non viene più parsato.
+    """
+    try:
+        fp, fields = CERT_CACHE.get_or_parse(der, _parse_der)
+    except Exception as e:
+        return {"error": f"Errore lettura certificato: {e}"}
+    parsed = _certificate_result(fields)
+    parsed["fingerprint"] = fp
+    return parsed
+
+
+def parse_certificate(cert):
+    """Estrae dati da un certificato `cryptography` (anche se la chain è incompleta)."""
+    try:
+        return _certificate_result(_cert_fields(cert))
 
     except Exception as e:
         return {"error": f"Errore lettura certificato: {e}"}
 
 
-def check_domains(config_path="app/config.json"):
-    import json
-
-    with open(config_path) as f:
-        config = json.load(f)
-
-    results = []
-
-    for entry in config["domains"]:
-        host = entry.get("url")
-        port = entry.get("port", 443)
-        service = entry.get("service_name")
-        alert_days = entry.get("alert_days", config.get("notify_before_days", 15))
-
-        data, proto_state, err_msg = fetch_tls_info(host, port)
-
-        # ❌ Errore / timeout / no TLS / refused
-        if err_msg is not None:
-            results.append({
-                "service": service,
-                "domain": host,
-                "port": port,
-                "protocol": proto_state,
-                "error": err_msg,
-                "chain_incomplete": True,
-            })
-            continue
-
-        cert = data["cert"]
-        proto_label = data["protocol"]
-
-        parsed = parse_certificate(cert)
-
-        if "error" in parsed:
-            results.append({
-                "service": service,
-                "domain": host,
-                "port": port,
-                "protocol": proto_label,
-                "error": parsed["error"],
-                "chain_incomplete": True,
-            })
-            continue
-
-        # ✅ OK
-        results.append({
+def sort_key(r):
+    """Ordinamento dei risultati: prima i certificati validi per giorni rimasti, poi gli errori."""
+    if "error" in r:
+        return (1, 999999)
+    return (0, r.get("days_left", 999999))
+
+
+def probe_entry(entry, default_alert_days=15):
+    """
+    Esegue la probe di una singola entry del config e ritorna il dict risultato.
+
+    Il timeout si adatta alla latenza osservata dell'endpoint e gli
+    endpoint morti da tempo vengono sospesi (vedi `health`): in quel caso
+    si ritorna l'ultimo stato noto con "suppressed_until", senza rete.
+    """
+    key = (entry.get("url"), entry.get("port", 443))
+    suppressed = HEALTH.suppressed(key)
+    if suppressed is not None:
+        METRICS.record_suppressed()
+        return suppressed
+
+    timings = {}
+    start = time.perf_counter()
+    result = _probe(entry, default_alert_days, HEALTH.timeout_for(key), timings)
+    METRICS.record_probe(result, timings, (time.perf_counter() - start) * 1000)
+
+    latency = None
+    if "handshake_ms" in timings and result.get("protocol") != "timeout":
+        latency = (timings["connect_ms"] + timings["handshake_ms"]) / 1000
+    HEALTH.record(key, result, latency)
+    return result
+
+
+def _probe(entry, default_alert_days, timeout, timings):
+    host = entry.get("url")
+    port = entry.get("port", 443)
+    service = entry.get("service_name")
+    alert_days = entry.get("alert_days", default_alert_days)
+    sni = entry.get("sni")
+
+    data, proto_state, err_msg = fetch_tls_info(
+        host, port, timeout=timeout, server_name=sni, timings=timings,
+        starttls=entry.get("starttls"),
+    )
+
+    # ❌ Errore / timeout / no TLS / refused
+    if err_msg is not None:
+        return _complete_result({
+            "service": service,
+            "domain": host,
+            "port": port,
+            "protocol": proto_state,
+            "error": err_msg,
+            "chain_incomplete": True,
+        }, sni, timings)
+
+    proto_label = data["protocol"]
+
+    start = time.perf_counter()
+    parsed = parse_der(data["der"])
+    timings["parse_ms"] = (time.perf_counter() - start) * 1000
+
+    if "error" not in parsed and data.get("chain"):
+        start = time.perf_counter()
+        try:
+            parsed.update(CHAIN_VALIDATOR.validate(data["der"], data["chain"]))
+        except Exception as e:
+            parsed["chain"] = f"⚠ chain non validata: {e}"
+        timings["chain_ms"] = (time.perf_counter() - start) * 1000
+
+    if "error" in parsed:
+        return _complete_result({
             "service": service,
             "domain": host,
             "port": port,
             "protocol": proto_label,
-            "expires": parsed["expires"],
-            "days_left": parsed["days_left"],
-            "issuer": parsed["issuer"],
-            "san": parsed["san"],
-            "chain": parsed["chain"],
-            "chain_incomplete": parsed["chain_incomplete"],
-            "alert": parsed["days_left"] <= alert_days,
-        })
-
-    def sort_key(r):
-        if "error" in r:
-            return (1, 999999)
-        return (0, r.get("days_left", 999999))
-
-    results.sort(key=sort_key)
+            "error": parsed["error"],
+            "chain_incomplete": True,
+        }, sni, timings)
+
+    result = {
+        "service": service,
+        "domain": host,
+        "port": port,
+        "protocol": proto_label,
+        "expires": parsed["expires"],
+        "days_left": parsed["days_left"],
+        "issuer": parsed["issuer"],
+        "san": parsed["san"],
+        "chain": parsed["chain"],
+        "chain_incomplete": parsed["chain_incomplete"],
+        "chain_status": parsed.get("chain_status", "unknown"),
+        "alert": parsed["days_left"] <= alert_days,
+        "fingerprint": parsed["fingerprint"],
+    }
+    if data.get("starttls"):
+        result["starttls"] = data["starttls"]
+
+    # 🧪 Deep scan di versioni e cifrari (opzionale, solo se il certificato è cambiato o è ora)
+    if entry.get("deep_scan", CAPABILITY_CACHE.enabled):
+        start = time.perf_counter()
+        try:
+            result.update(CAPABILITY_CACHE.scan((host, port), parsed["fingerprint"], sni,
+                                                data.get("starttls")))
+        except Exception as e:
+            print(f"⚠️ Deep scan fallita per {host}:{port}: {e}")
+        timings["capabilities_ms"] = (time.perf_counter() - start) * 1000
+
+    # ✅ OK
+    return _complete_result(result, sni, timings)
+
+
+def _complete_result(result, hostname, timings):
+    """
+    Completa il risultato: per i target da fan-out DNS "domain" è
+    l'indirizzo, quindi aggiunge il nome originale; registra la latenza
+    del resolver separata da quella della probe.
+    """
+    if hostname is not None:
+        result["hostname"] = hostname
+    if "dns_ms" in timings:
+        result["dns_ms"] = round(timings["dns_ms"], 1)
+    return result
+
+
+def probe_settings(config):
+    """Sezioni del config che governano le probe: dns, health, chain e capabilities."""
+    return {
+        "dns": dns_settings(config),
+        "health": health_settings(config),
+        "chain": chain_settings(config),
+        "capabilities": capability_settings(config),
+    }
+
+
+def configure_probes(settings):
+    """Applica `probe_settings` alle cache condivise delle probe di questo processo."""
+    DNS_CACHE.configure(**settings["dns"])
+    HEALTH.configure(**settings["health"])
+    CHAIN_VALIDATOR.configure(**settings["chain"])
+    CAPABILITY_CACHE.configure(**settings["capabilities"])
+
+
+def _scan_plan(config_path, **overrides):
+    """
+    Legge il config (già parsato, vedi `config`) e prepara (entry, probe,
+    impostazioni di scansione). Gli `overrides` non None sostituiscono i
+    valori della sezione "scan".
+    """
+    config = load_config(config_path)
+    settings = scan_settings(config)
+    settings.update({k: v for k, v in overrides.items() if v is not None})
+    configure_probes(probe_settings(config))
+
+    # partial e non closure: deve poter essere inviata ai processi worker
+    probe = partial(probe_entry, default_alert_days=config.get("notify_before_days", 15))
+    # Target espansi pigramente (CIDR, porte, fan-out DNS): vedi `targets`
+    return iter_targets(config.entries()), probe, settings
+
+
+def check_domains(config_path="app/config.json", concurrency=None, per_host=None,
+                  workers=None, shard_size=None, ordered=True):
+    """
+    Controlla tutti i domini del config in parallelo (vedi `scanner`).
+
+    `concurrency`, `per_host`, `workers` e `shard_size` sovrascrivono i
+    valori della sezione "scan"; con più di un worker la lista viene divisa
+    in shard scansionati da processi separati. Con `ordered=False` i
+    risultati restano nell'ordine di completamento (la cache li indicizza
+    da sé, vedi `index`).
+    """
+    entries, probe, settings = _scan_plan(
+        config_path, concurrency=concurrency, per_host=per_host,
+        workers=workers, shard_size=shard_size,
+    )
+    results = run_sharded(
+        entries, probe, settings["workers"], settings["shard_size"],
+        settings["concurrency"], settings["per_host"],
+    )
+
+    if ordered:
+        results.sort(key=sort_key)
     return results
+
+
+async def iter_check_domains(config_path="app/config.json", concurrency=None, per_host=None):
+    """Come `check_domains`, ma produce i risultati man mano che le probe terminano."""
+    entries, probe, settings = _scan_plan(config_path, concurrency=concurrency, per_host=per_host)
+    async for result in iter_scan(entries, probe, settings["concurrency"], settings["per_host"]):
+        yield result
@@ -0,0 +1,307 @@
+import hmac
+import os
+import threading
+import time
+
+from .checker import probe_settings
+from .config import ConfigError, load_config
+from .notifier import notify
+from .scanner import scan_settings
+from .scheduler import entry_key, schedule_settings
+from .targets import iter_targets
+
+DEFAULT_SHARD_SIZE = 100          # endpoint per shard assegnato a un agent
+DEFAULT_AGENT_TIMEOUT = 60        # secondi senza heartbeat prima di considerare morto un agent
+DEFAULT_LEASE_TIMEOUT = 300       # secondi senza risultati prima di riprendere uno shard assegnato
+DEFAULT_HEARTBEAT = 10            # ogni quanto gli agent devono farsi sentire
+DEFAULT_POLL = 5                  # attesa suggerita agli agent senza lavoro
+DEFAULT_MAX_SHARDS = 4            # shard in carico contemporaneamente a un agent
+
+
+def collector_settings(config):
+    """
+    Legge la sezione "collector" del config (modalità disattivata di
+    default). Con la modalità attiva il token è obbligatorio: dal config
+    o dalla variabile d'ambiente SSL_MONITOR_AGENT_TOKEN, come per l'agent.
+    """
+    conf = config.get("collector", {})
+    enabled = conf.get("enabled", False)
+    token = conf.get("token") or os.environ.get("SSL_MONITOR_AGENT_TOKEN")
+    if enabled and not token:
+        # Senza token chiunque potrebbe iniettare risultati in store e notifiche
+        raise ConfigError("collector: \"token\" obbligatorio con la modalità collector attiva")
+    return {
+        "enabled": enabled,
+        "token": token,
+        "shard_size": max(1, int(conf.get("shard_size", DEFAULT_SHARD_SIZE))),
+        "agent_timeout": conf.get("agent_timeout_seconds", DEFAULT_AGENT_TIMEOUT),
+        "lease_timeout": conf.get("lease_timeout_seconds", DEFAULT_LEASE_TIMEOUT),
+        "heartbeat": conf.get("heartbeat_seconds", DEFAULT_HEARTBEAT),
+        "poll": conf.get("poll_seconds", DEFAULT_POLL),
+        "max_shards": conf.get("max_shards_per_agent", DEFAULT_MAX_SHARDS),
+    }
+
+
+class _Shard:
+    __slots__ = ("id", "zone", "entries", "owner", "due", "leased_at", "completed_at")
+
+    def __init__(self, shard_id, zone, entries):
+        self.id = shard_id
+        self.zone = zone
+        self.entries = entries
+        self.owner = None         # agent che ha lo shard in carico
+        self.due = 0.0            # time.monotonic() da cui lo shard va riscansionato
+        self.leased_at = None     # time.monotonic() dell'assegnazione o dell'ultimo lotto ricevuto
+        self.completed_at = None  # time.time() dell'ultimo giro completo
+
+
+class _Agent:
+    __slots__ = ("name", "zones", "last_seen", "results")
+
+    def __init__(self, name, zones):
+        self.name = name
+        self.zones = zones
+        self.last_seen = 0.0
+        self.results = 0
+
+
+def build_shards(entries, shard_size):
+    """
+    Divide i target in shard per zona: la chiave "zone" di una entry dice
+    da quale segmento di rete è raggiungibile (senza zona: da qualunque
+    agent). Ritorna {id: _Shard}; gli id sono stabili finché i target non cambiano.
+    """
+    by_zone = {}
+    for entry in entries:
+        by_zone.setdefault(entry.get("zone"), []).append(entry)
+    shards = {}
+    for zone, targets in sorted(by_zone.items(), key=lambda item: item[0] or ""):
+        targets.sort(key=lambda e: (e.get("url"), str(e.get("port"))))
+        for start in range(0, len(targets), shard_size):
+            shard_id = f"{zone or '*'}/{start // shard_size}"
+            shards[shard_id] = _Shard(shard_id, zone, targets[start:start + shard_size])
+    return shards
+
+
+class Collector:
+    """
+    Modalità collector: l'app non scansiona, distribuisce il lavoro ad
+    agent leggeri (vedi `agent`) sparsi nei segmenti di rete e raccoglie
+    i loro risultati nella cache condivisa.
+
+    - i target del config sono divisi in shard per zona; un agent chiede
+      lavoro dichiarando le zone che raggiunge e riceve shard scaduti;
+    - l'agent invia i risultati a lotti compressi man mano che le probe
+      terminano e segnala la fine dello shard, che torna in coda dopo
+      `scan.interval_seconds`;
+    - ogni richiesta dell'agent vale da heartbeat: senza notizie per
+      `agent_timeout` secondi l'agent è morto e i suoi shard tornano
+      subito assegnabili a un altro agent della stessa zona;
+    - un agent vivo può comunque aver lasciato uno shard (es. collector
+      irraggiungibile durante l'upload): lo shard torna in coda se
+      l'heartbeat dell'agent non lo elenca più tra quelli in lavorazione,
+      oppure dopo `lease_timeout` secondi senza risultati.
+
+    Il config viene ricaricato a caldo: gli shard con gli stessi target
+    mantengono stato e scadenza, gli altri sono da scansionare subito.
+    """
+
+    def __init__(self, cache, config_path="app/config.json"):
+        self.cache = cache
+        self.config_path = config_path
+        self._lock = threading.Lock()
+        self._config = None
+        self._shards = {}
+        self._keys = frozenset()  # chiavi (domain, port) di tutti i target
+        self._agents = {}
+        self._sync_config()
+
+    def _sync_config(self):
+        """Ricostruisce gli shard se il config è cambiato (da chiamare con il lock o in __init__)."""
+        config = load_config(self.config_path)
+        if config is self._config:
+            return
+        self._config = config
+        self.settings = collector_settings(config)
+        self.scan = scan_settings(config)
+        self.schedule = schedule_settings(config)
+        self._probes = self._probe_settings(config)
+
+        entries = list(iter_targets(config.entries()))
+        shards = build_shards(entries, self.settings["shard_size"])
+        for shard_id, shard in shards.items():
+            old = self._shards.get(shard_id)
+            if old is not None and old.entries == shard.entries:
+                shards[shard_id] = old
+        self._shards = shards
+        self._keys = frozenset(entry_key(e) for e in entries)
+
+    def _expire(self, now):
+        """
+        Agent senza heartbeat recenti: i loro shard tornano in coda. Lo
+        stesso per gli shard senza risultati da `lease_timeout` secondi.
+        """
+        limit = now - self.settings["agent_timeout"]
+        dead = {name for name, agent in self._agents.items() if agent.last_seen < limit}
+        stale = now - self.settings["lease_timeout"]
+        for shard in self._shards.values():
+            if shard.owner in dead:
+                self._release(shard, f"agent {shard.owner} non risponde")
+            elif shard.owner is not None and shard.leased_at < stale:
+                self._release(shard, f"nessun risultato da agent {shard.owner}")
+        for name in dead:
+            del self._agents[name]
+
+    @staticmethod
+    def _release(shard, reason):
+        print(f"🔁 Shard {shard.id} riassegnato: {reason}")
+        shard.owner = None
+        shard.due = 0.0
+
+    def _seen(self, name, zones, now):
+        agent = self._agents.get(name)
+        if agent is None:
+            agent = self._agents[name] = _Agent(name, tuple(zones or ()))
+            print(f"🛰️ Agent {name} registrato (zone: {', '.join(agent.zones) or '-'})")
+        elif zones is not None:
+            agent.zones = tuple(zones)
+        agent.last_seen = now
+        return agent
+
+    @staticmethod
+    def _probe_settings(config):
+        """
+        Impostazioni delle probe per gli agent, le stesse delle scansioni
+        locali. Il trust store viaggia come contenuto PEM (il percorso è
+        del collector) e le capacità non hanno store da cui ripartire.
+        """
+        probes = probe_settings(config)
+        probes["capabilities"]["store_path"] = None
+        chain = probes["chain"]
+        if chain["ca_file"]:
+            try:
+                with open(chain["ca_file"]) as f:
+                    chain["ca_data"], chain["ca_file"] = f.read(), None
+            except OSError as e:
+                print(f"❌ chain.ca_file non leggibile, gli agent useranno il percorso così com'è: {e}")
+        return probes
+
+    def _client_settings(self):
+        """Parametri che l'agent usa per le probe (dal config del collector)."""
+        return {
+            "heartbeat_seconds": self.settings["heartbeat"],
+            "poll_seconds": self.settings["poll"],
+            "concurrency": self.scan["concurrency"],
+            "per_host": self.scan["per_host"],
+            "default_alert_days": self.schedule["default_alert_days"],
+            "probes": self._probes,
+        }
+
+    def heartbeat(self, name, zones=None, active=None, now=None):
+        """
+        Heartbeat di un agent; ritorna gli shard che ha ancora in carico.
+        `active` sono gli shard che l'agent sta davvero scansionando: gli
+        altri a suo nome tornano in coda, tranne quelli assegnati da meno
+        di un intervallo di heartbeat (l'agent potrebbe non averli ancora
+        avviati).
+        """
+        now = now or time.monotonic()
+        with self._lock:
+            self._sync_config()
+            self._expire(now)
+            self._seen(name, zones, now)
+            if active is not None:
+                active = set(active)
+                settled = now - self.settings["heartbeat"]
+                for shard in self._shards.values():
+                    if shard.owner == name and shard.id not in active and shard.leased_at < settled:
+                        self._release(shard, f"abbandonato da agent {name}")
+            return [s.id for s in self._shards.values() if s.owner == name]
+
+    def lease(self, name, zones=(), max_shards=None, now=None):
+        """
+        Assegna all'agent fino a `max_shards` shard scaduti delle sue zone
+        (contando quelli che ha già in carico), dai più in ritardo.
+        """
+        now = now or time.monotonic()
+        with self._lock:
+            self._sync_config()
+            self._expire(now)
+            agent = self._seen(name, zones, now)
+            limit = min(max_shards or self.settings["max_shards"], self.settings["max_shards"])
+            held = sum(1 for s in self._shards.values() if s.owner == name)
+            free = sorted(
+                (s for s in self._shards.values()
+                 if s.owner is None and s.due <= now and (s.zone is None or s.zone in agent.zones)),
+                key=lambda s: s.due,
+            )
+            leased = free[:max(0, limit - held)]
+            for shard in leased:
+                shard.owner, shard.leased_at = name, now
+            return {
+                "shards": [{"id": s.id, "zone": s.zone, "entries": s.entries} for s in leased],
+                "settings": self._client_settings(),
+            }
+
+    def receive(self, name, shard_id, results, done=False, now=None):
+        """
+        Risultati inviati da un agent. Vengono sempre accettati (sono
+        osservazioni valide anche se lo shard è stato riassegnato); `done`
+        chiude lo shard solo se è ancora dell'agent. Ritorna True se
+        l'agent ha ancora lo shard in carico.
+        """
+        now = now or time.monotonic()
+        with self._lock:
+            self._sync_config()
+            self._expire(now)
+            agent = self._seen(name, None, now)
+            agent.results += len(results)
+            shard = self._shards.get(shard_id)
+            owned = shard is not None and shard.owner == name
+            if owned and done:
+                shard.owner = None
+                shard.due = now + self.schedule["interval"]
+                shard.completed_at = time.time()
+            elif owned:
+                shard.leased_at = now
+            keep = self._keys
+
+        for r in results:
+            # Chi ha fatto la probe non fa parte dello stato dell'endpoint
+            r["agent"] = name
+        known = [r for r in results if (r.get("domain"), r.get("port")) in keep]
+        if known:
+            self.cache.update(known, keep=keep)
+            snapshot, _ = self.cache.snapshot()
+            notify(snapshot.alerts(), self.config_path)
+        return owned
+
+    def authorized(self, token):
+        """True se `token` è quello degli agent (confronto a tempo costante)."""
+        expected = self.settings["token"]
+        return token is not None and hmac.compare_digest(token.encode(), expected.encode())
+
+    def trigger(self):
+        """Richiesta di aggiornamento immediato: tutti gli shard liberi tornano scaduti."""
+        with self._lock:
+            for shard in self._shards.values():
+                if shard.owner is None:
+                    shard.due = 0.0
+
+    def status(self, now=None):
+        now = now or time.monotonic()
+        with self._lock:
+            self._expire(now)
+            return {
+                "agents": [
+                    {"name": a.name, "zones": list(a.zones), "results": a.results,
+                     "last_seen_seconds": round(now - a.last_seen, 1),
+                     "shards": [s.id for s in self._shards.values() if s.owner == a.name]}
+                    for a in self._agents.values()
+                ],
+                "shards": {
+                    "total": len(self._shards),
+                    "leased": sum(1 for s in self._shards.values() if s.owner is not None),
+                    "due": sum(1 for s in self._shards.values() if s.owner is None and s.due <= now),
+                },
+            }
@@ -0,0 +1,257 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .starttls import STARTTLS_MODES
+from .targets import parse_ports
+
+DEFAULT_CONFIG_PATH = "app/config.json"
+DEFAULT_CHECK_EVERY = 2.0   # secondi minimi tra due controlli di mtime del file
+
+
+class ConfigError(ValueError):
+    """Config non valido: il messaggio indica la entry o il campo sbagliato."""
+
+
+# Chiavi note di una entry di "domains"; le altre finiscono in `extra`
+_ENTRY_FIELDS = ("url", "port", "service_name", "alert_days", "check_interval", "resolve_all",
+                 "starttls", "sni", "zone", "deep_scan")
+
+
+@dataclass(frozen=True, slots=True)
+class DomainEntry:
+    """Una entry di "domains", validata. `ports` è la specifica già espansa."""
+
+    url: str
+    ports: tuple
+    port_spec: object = 443
+    service_name: Optional[str] = None
+    alert_days: Optional[int] = None
+    check_interval: Optional[float] = None
+    resolve_all: bool = False
+    starttls: Optional[str] = None      # modalità STARTTLS o "auto"
+    sni: Optional[str] = None           # nome da presentare nell'handshake
+    zone: Optional[str] = None          # zona degli agent che possono scansionarla
+    deep_scan: Optional[bool] = None    # None: default di "capabilities"
+    extra: tuple = ()   # chiavi sconosciute, come coppie ordinate in JSON (resta hashable)
+
+    @classmethod
+    def from_dict(cls, data, index=0):
+        where = f"domains[{index}]"
+        if not isinstance(data, dict):
+            raise ConfigError(f"{where}: attesa un'entry oggetto")
+        url = data.get("url")
+        if not isinstance(url, str) or not url.strip():
+            raise ConfigError(f"{where}: \"url\" mancante")
+        try:
+            ports = tuple(parse_ports(data.get("port", 443)))
+        except (TypeError, ValueError) as e:
+            raise ConfigError(f"{where} ({url}): porta non valida: {e}") from None
+
+        alert_days = data.get("alert_days")
+        if alert_days is not None and (not isinstance(alert_days, int) or alert_days < 0):
+            raise ConfigError(f"{where} ({url}): \"alert_days\" deve essere un intero >= 0")
+        check_interval = data.get("check_interval")
+        if check_interval is not None and (not isinstance(check_interval, (int, float)) or check_interval <= 0):
+            raise ConfigError(f"{where} ({url}): \"check_interval\" deve essere un numero > 0")
+        starttls = data.get("starttls")
+        if starttls is not None and starttls not in STARTTLS_MODES + ("auto",):
+            raise ConfigError(
+                f"{where} ({url}): \"starttls\" deve essere uno tra {', '.join(STARTTLS_MODES)} o auto"
+            )
+        for name in ("sni", "zone"):
+            value = data.get(name)
+            if value is not None and (not isinstance(value, str) or not value):
+                raise ConfigError(f"{where} ({url}): \"{name}\" deve essere una stringa non vuota")
+        deep_scan = data.get("deep_scan")
+        if deep_scan is not None and not isinstance(deep_scan, bool):
+            raise ConfigError(f"{where} ({url}): \"deep_scan\" deve essere true o false")
+
+        extra = tuple(sorted(
+            (k, json.dumps(v, sort_keys=True)) for k, v in data.items() if k not in _ENTRY_FIELDS
+        ))
+        return cls(
+            url=url.strip(), ports=ports, port_spec=_freeze(data.get("port", 443)),
+            service_name=data.get("service_name"), alert_days=alert_days,
+            check_interval=check_interval, resolve_all=bool(data.get("resolve_all", False)),
+            starttls=starttls, sni=data.get("sni"), zone=data.get("zone"), deep_scan=deep_scan,
+            extra=extra,
+        )
+
+    @property
+    def key(self):
+        """Identità della entry nel diff: stesso host e stesse porte."""
+        return (self.url, self.ports)
+
+    def as_dict(self):
+        """La entry nel formato dict usato da `targets` e dalle probe."""
+        entry = {"url": self.url, "port": _thaw(self.port_spec)}
+        if self.service_name is not None:
+            entry["service_name"] = self.service_name
+        if self.alert_days is not None:
+            entry["alert_days"] = self.alert_days
+        if self.check_interval is not None:
+            entry["check_interval"] = self.check_interval
+        if self.resolve_all:
+            entry["resolve_all"] = True
+        if self.starttls is not None:
+            entry["starttls"] = self.starttls
+        if self.sni is not None:
+            entry["sni"] = self.sni
+        if self.zone is not None:
+            entry["zone"] = self.zone
+        if self.deep_scan is not None:
+            entry["deep_scan"] = self.deep_scan
+        for k, v in self.extra:
+            entry[k] = json.loads(v)
+        return entry
+
+
+def _freeze(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _thaw(value):
+    return list(value) if isinstance(value, tuple) else value
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """
+    Config parsato e validato una sola volta. `data` è il JSON originale,
+    letto dalle funzioni `*_settings` dei vari moduli; `domains` sono le
+    entry tipizzate.
+    """
+
+    path: str
+    mtime_ns: int
+    domains: tuple
+    data: dict = field(repr=False)
+
+    @classmethod
+    def parse(cls, path, text, mtime_ns=0):
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise ConfigError(f"{path}: JSON non valido: {e}") from None
+        if not isinstance(data, dict) or not isinstance(data.get("domains"), list):
+            raise ConfigError(f"{path}: manca la lista \"domains\"")
+        domains = tuple(DomainEntry.from_dict(d, i) for i, d in enumerate(data["domains"]))
+        return cls(path=path, mtime_ns=mtime_ns, domains=domains, data=data)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def entries(self):
+        """Entry di "domains" come dict (nuovi a ogni chiamata: i chiamanti possono modificarli)."""
+        return [d.as_dict() for d in self.domains]
+
+    def settings_without_domains(self):
+        return {k: v for k, v in self.data.items() if k != "domains"}
+
+
+@dataclass(frozen=True, slots=True)
+class ConfigDiff:
+    """Differenze tra due versioni del config, per entry di "domains"."""
+
+    added: tuple
+    changed: tuple
+    removed: tuple
+    settings_changed: bool
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed or self.settings_changed)
+
+
+def diff_configs(old, new):
+    """
+    Confronta due Config: entry aggiunte, modificate (stesso host e porte,
+    altri campi diversi) e rimosse, più un flag per le altre sezioni.
+    """
+    before = {d.key: d for d in (old.domains if old else ())}
+    after = {d.key: d for d in new.domains}
+    return ConfigDiff(
+        added=tuple(d for k, d in after.items() if k not in before),
+        changed=tuple(d for k, d in after.items() if k in before and before[k] != d),
+        removed=tuple(d for k, d in before.items() if k not in after),
+        settings_changed=old is None or old.settings_without_domains() != new.settings_without_domains(),
+    )
+
+
+class ConfigLoader:
+    """
+    Config con hot reload: il file viene riletto solo quando cambiano
+    mtime o dimensione, controllati al massimo ogni `check_every`
+    secondi, quindi `get` costa di norma un confronto di orari.
+
+    Un file modificato ma non valido non sostituisce l'ultimo config buono
+    (l'errore viene stampato); al primo caricamento invece viene sollevato.
+    Chi deve reagire a un reload confronta il Config ricevuto con quello
+    che aveva (vedi `diff_configs`).
+    """
+
+    def __init__(self, path=DEFAULT_CONFIG_PATH, check_every=DEFAULT_CHECK_EVERY):
+        self.path = path
+        self.check_every = check_every
+        self._lock = threading.Lock()
+        self._config = None
+        self._stat = None
+        self._checked_at = 0.0
+
+    def get(self, force=False):
+        """Config corrente, ricaricato se il file è cambiato."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._config is not None and now - self._checked_at < self.check_every:
+                return self._config
+            self._checked_at = now
+            try:
+                st = os.stat(self.path)
+            except OSError as e:
+                if self._config is None:
+                    raise
+                print(f"❌ Config non leggibile, resta il precedente: {e}")
+                return self._config
+            stat = (st.st_mtime_ns, st.st_size)
+            if self._config is not None and stat == self._stat:
+                return self._config
+
+            old = self._config
+            try:
+                with open(self.path) as f:
+                    new = Config.parse(self.path, f.read(), st.st_mtime_ns)
+            except ConfigError as e:
+                if old is None:
+                    raise
+                print(f"❌ Config non ricaricato, resta il precedente: {e}")
+                self._stat = stat
+                return old
+
+            self._config, self._stat = new, stat
+
+        if old is not None:
+            diff = diff_configs(old, new)
+            print(f"🔁 Config ricaricato: {len(diff.added)} aggiunte, "
+                  f"{len(diff.changed)} modificate, {len(diff.removed)} rimosse")
+        return new
+
+
+_LOADERS = {}
+_LOADERS_LOCK = threading.Lock()
+
+
+def config_loader(path=DEFAULT_CONFIG_PATH):
+    """Loader condiviso per `path` (uno per file e per processo)."""
+    with _LOADERS_LOCK:
+        loader = _LOADERS.get(path)
+        if loader is None:
+            loader = _LOADERS[path] = ConfigLoader(path)
+        return loader
+
+
+def load_config(path=DEFAULT_CONFIG_PATH):
+    """Config corrente di `path`, parsato una volta e ricaricato se il file cambia."""
+    return config_loader(path).get()
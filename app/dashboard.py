@@ -0,0 +1,283 @@
+import hashlib
+import html
+import math
+import threading
+from collections import OrderedDict
+from string import Template
+from urllib.parse import urlencode
+
+from .export_xlsx import PROTOCOL_ICONS
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+PAGE_CACHE_SIZE = 64     # pagine renderizzate tenute in memoria per generazione
+
+# 🧩 Template precompilati: la pagina viene assemblata con un solo join
+PAGE = Template("""
+    <html>
+    <head>
+        <title>SSL Monitor</title>
+        <style>
+            body {
+                background-image: url('https://images.unsplash.com/photo-1518770660439-4636190af475?auto=format&fit=crop&w=1400&q=80');
+                background-size: cover; background-position: center;
+                background-attachment: fixed;
+                color: white; font-family: Arial; text-align: center; margin:0;
+            }
+            header { background: rgba(0,0,0,0.65); padding:20px; }
+            header img { max-height:80px; }
+            h1 { font-size:2.7em; margin-top:10px; }
+            .actions button {
+                background:#1976d2; padding:8px 16px; margin:4px; border-radius:6px;
+                border:none; color:white; cursor:pointer; font-size:0.95em;
+            }
+            .actions button:hover { background:#12589a; }
+            .tooltip { position:relative; cursor:help; }
+            .tooltip span {
+                visibility:hidden; opacity:0; width:260px;
+                background:black; color:white; padding:8px;
+                border-radius:5px; text-align:left;
+                position:absolute; left:50%; transform:translateX(-50%);
+                bottom:130%; transition:0.3s;
+            }
+            .tooltip:hover span { visibility:visible; opacity:1; }
+
+            table {
+                width:94%; margin:10px auto 40px auto; border-collapse:collapse;
+                background:rgba(0, 0, 0, 0.7); border-radius:12px; overflow:hidden;
+                box-shadow:0 5px 18px rgba(0,0,0,0.55);
+            }
+            th { background:rgba(255,255,255,0.18); padding:14px; font-size:1.05em; }
+            td { padding:12px; word-break:break-word; }
+            tr:nth-child(even){ background:rgba(255,255,255,0.08); }
+            tr:hover { background:rgba(255,255,255,0.18); }
+
+            .error { color:#ff8080; font-weight:bold; }
+            .issuer { font-size:0.85em; color:#e0e0e0; }
+            .san { font-size:0.75em; color:#ccc; }
+
+            .legend-container {
+                margin-top:5px; margin-bottom:10px; background:rgba(0,0,0,0.55);
+                display:inline-block; padding:8px 18px; border-radius:10px; font-size:1.05em;
+            }
+            .legend-item { margin:0 14px; display:inline-block; }
+            .scanned-at { font-size:0.9em; color:#ddd; margin-top:6px; }
+
+            .filters, .pager {
+                background:rgba(0,0,0,0.55); display:inline-block;
+                padding:8px 18px; border-radius:10px; margin:4px;
+            }
+            .filters select, .filters input { margin:0 6px; }
+            .pager a { color:#90caf9; margin:0 10px; }
+        </style>
+    </head>
+    <body>
+        <header>
+            <img src="https://raw.githubusercontent.com/stefanomagagni/ssl-monitor/main/app/logo_deda.png">
+            <h1>SSL Monitor</h1>
+            <div class="actions">
+                <button onclick="window.location.href='/export'">Esporta CSV</button>
+                <button onclick="window.location.href='/export_xlsx'">Esporta Excel</button>
+                <button onclick="window.location.href='/?refresh=1'">Aggiorna ora</button>
+            </div>
+            <div class="scanned-at">Ultima scansione: $scanned_at</div>
+        </header>
+
+        <div class="legend-container">
+            <span class="legend-item tooltip">🟢 TLS moderno<span>Supporta TLS1.2 / TLS1.3</span></span>
+            <span class="legend-item tooltip">🟠 TLS legacy<span>Protocollo TLS datato</span></span>
+            <span class="legend-item tooltip">🔴 SSL obsoleto<span>SSlv2/3 non sicuro</span></span>
+            <span class="legend-item tooltip">⚫ No TLS<span>Porta aperta ma nessun SSL/TLS</span></span>
+            <span class="legend-item tooltip">🚫 Rifiutata<span>Connessione negata</span></span>
+            <span class="legend-item tooltip">🕓 Timeout<span>Nessuna risposta</span></span>
+        </div>
+
+        <div>
+            <form class="filters" method="get" action="/">
+                Protocollo <select name="protocol">$protocol_options</select>
+                Servizio <input name="service" value="$service">
+                Alert <select name="alert">$alert_options</select>
+                Per pagina <input name="page_size" type="number" min="1" max="$max_page_size" value="$page_size" style="width:5em">
+                <button type="submit">Filtra</button>
+            </form>
+        </div>
+        <div class="pager">$pager</div>
+
+        <table>
+            <tr>
+                <th>Service</th><th>Domain/IP</th><th>Port</th><th>Protocol</th>
+                <th>Expires</th><th>Days Left</th><th>Issuer</th><th>SAN</th><th>Chain</th>
+            </tr>
+$rows
+        </table>
+        <div class="pager">$pager</div>
+        <footer>© 2025 Deda Next – Internal SSL Monitoring Dashboard</footer></body></html>""")
+
+ERROR_ROW = Template("""
+            <tr>
+                <td>$service</td><td>$domain</td><td>$port</td>
+                <td style='font-size:1.4em'>$icon</td>
+                <td colspan="5" class="error">Errore: $error</td>
+            </tr>""")
+
+CERT_ROW = Template("""
+            <tr>
+                <td>$service</td><td>$domain</td><td>$port</td>
+                <td style='font-size:1.4em'>$icon</td>
+                <td>$expires</td>
+                <td style='color:$color; font-weight:bold;'>$days_left</td>
+                <td class='issuer tooltip'>$issuer_preview...<span>$issuer</span></td>
+                <td class='san tooltip'>$san_preview...<span>$san_full</span></td>
+                <td class='tooltip'>$chain_icon<span>$chain</span></td>
+            </tr>""")
+
+ALERT_CHOICES = (("", "Tutti"), ("1", "Solo in alert"), ("0", "Non in alert"))
+
+
+def _e(value):
+    return html.escape(str(value if value is not None else ""))
+
+
+def render_row(r, note=""):
+    """HTML di una riga della tabella (valori già escapati)."""
+    icon = PROTOCOL_ICONS.get(r.get("protocol"))
+    if "error" in r:
+        return ERROR_ROW.substitute(
+            service=_e(r.get("service")), domain=_e(r["domain"]), port=_e(r.get("port", "")),
+            icon=icon, error=_e(r["error"] + note),
+        )
+
+    if r["days_left"] <= 0: color = "#ff4d4d"
+    elif r.get("alert"): color = "#ffcc00"
+    else: color = "lightgreen"
+
+    issuer = r["issuer"]
+    return CERT_ROW.substitute(
+        service=_e(r.get("service")), domain=_e(r["domain"]), port=_e(r["port"]),
+        icon=icon, expires=_e(r["expires"]), color=color, days_left=r["days_left"],
+        issuer_preview=_e(issuer[:40]), issuer=_e(issuer),
+        san_preview=_e(", ".join(r["san"][:2])), san_full=_e(", ".join(r["san"])),
+        chain_icon="✔" if r.get("chain_status") == "valid" else "⚠", chain=_e(r.get("chain")),
+    )
+
+
+def parse_alert(value):
+    """
+    Filtro alert dal form: "" (opzione "Tutti") o assente -> None,
+    "1"/"0" (anche true/false) -> True/False. ValueError per il resto.
+    """
+    value = (value or "").strip().lower()
+    if not value:
+        return None
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"filtro alert non valido: {value}")
+
+
+def matches(r, protocol=None, service=None, alert=None):
+    """Filtri lato server: protocol_state esatto, servizio per sottostringa, alert sì/no."""
+    if protocol and r.get("protocol") != protocol:
+        return False
+    if service and service.lower() not in (r.get("service") or "").lower():
+        return False
+    if alert is not None and bool(r.get("alert")) != alert:
+        return False
+    return True
+
+
+def _options(choices, selected):
+    return "".join(
+        f'<option value="{_e(value)}"{" selected" if value == selected else ""}>{_e(label)}</option>'
+        for value, label in choices
+    )
+
+
+class DashboardRenderer:
+    """
+    Rendering della dashboard una volta per generazione dei risultati.
+
+    Una generazione è la lista di risultati restituita dalla cache: ogni
+    scansione o aggiornamento ne crea una nuova. Alla prima richiesta di
+    una generazione le righe vengono renderizzate una sola volta (nell'ordine
+    della cache, oppure con `sort` se indicato); filtri e paginazione
+    scelgono poi tra righe già pronte e le pagine complete restano in un
+    piccolo LRU con il loro ETag.
+    """
+
+    def __init__(self, sort=None, note=lambda r: ""):
+        self.sort = sort
+        self.note = note
+        self._lock = threading.Lock()
+        self._source = None      # lista della cache renderizzata (generazione corrente)
+        self._rows = []          # (risultato, html riga) nell'ordine della dashboard
+        self._pages = OrderedDict()
+
+    def _rows_for(self, results):
+        # Confronto per identità: la cache crea una nuova lista a ogni generazione
+        with self._lock:
+            if results is self._source:
+                return self._rows, self._pages
+        ordered = self.sort(results) if self.sort is not None else results
+        rows = [(r, render_row(r, self.note(r))) for r in ordered]
+        with self._lock:
+            self._source, self._rows, self._pages = results, rows, OrderedDict()
+            return rows, self._pages
+
+    def render(self, results, scanned_label, protocol=None, service=None, alert=None,
+               page=1, page_size=DEFAULT_PAGE_SIZE):
+        """Ritorna (html, etag) della pagina richiesta."""
+        page_size = min(max(1, page_size), MAX_PAGE_SIZE)
+        rows, pages = self._rows_for(results)
+        key = (scanned_label, protocol, service, alert, page, page_size)
+        with self._lock:
+            cached = pages.get(key)
+            if cached is not None:
+                pages.move_to_end(key)
+                return cached
+
+        selected = [row for r, row in rows if matches(r, protocol, service, alert)]
+        total_pages = max(1, math.ceil(len(selected) / page_size))
+        page = min(max(1, page), total_pages)
+        start = (page - 1) * page_size
+
+        body = PAGE.substitute(
+            scanned_at=_e(scanned_label),
+            protocol_options=_options(
+                [("", "Tutti")] + [(p, f"{PROTOCOL_ICONS[p]} {p}") for p in PROTOCOL_ICONS if p],
+                protocol or "",
+            ),
+            service=_e(service or ""),
+            alert_options=_options(ALERT_CHOICES, "" if alert is None else str(int(alert))),
+            max_page_size=MAX_PAGE_SIZE,
+            page_size=page_size,
+            pager=self._pager(page, total_pages, len(selected), protocol, service, alert, page_size),
+            rows="".join(selected[start:start + page_size]),
+        )
+        etag = '"' + hashlib.sha1(body.encode()).hexdigest()[:20] + '"'
+
+        with self._lock:
+            if pages is self._pages:
+                pages[key] = (body, etag)
+                if len(pages) > PAGE_CACHE_SIZE:
+                    pages.popitem(last=False)
+        return body, etag
+
+    @staticmethod
+    def _pager(page, total_pages, count, protocol, service, alert, page_size):
+        params = {k: v for k, v in (("protocol", protocol), ("service", service)) if v}
+        if alert is not None:
+            params["alert"] = int(alert)
+        params["page_size"] = page_size
+
+        def link(target, label):
+            return f'<a href="/?{_e(urlencode(dict(params, page=target)))}">{label}</a>'
+
+        parts = []
+        if page > 1:
+            parts.append(link(page - 1, "« Precedente"))
+        parts.append(f"Pagina {page} di {total_pages} ({count} endpoint)")
+        if page < total_pages:
+            parts.append(link(page + 1, "Successiva »"))
+        return " ".join(parts)
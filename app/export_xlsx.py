@@ -1,77 +1,145 @@
+import tempfile
+
 import openpyxl
-from openpyxl.styles import PatternFill, Font, Alignment
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle, PatternFill
 from openpyxl.utils import get_column_letter
 
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# 🔥 ICON MAPPING (uguale per web & Excel)
+PROTOCOL_ICONS = {
+    "tls_modern": "🟢",
+    "tls_legacy": "🟠",
+    "ssl_obsolete": "🔴",
+    "tcp_open_not_tls": "⚫",
+    "timeout": "🕓",
+    "refused": "🚫",
+    "no_tls": "⚪",
+    None: "⚪",
+}
+
+# 🔥 EXCEL ROW COLORS (hex)
+ROW_COLORS = {
+    "tls_modern": "C6EFCE",        # green
+    "tls_legacy": "FFF2CC",        # yellow
+    "ssl_obsolete": "F4CCCC",      # red
+    "tcp_open_not_tls": "D9D9D9",  # gray
+    "timeout": "FCE5CD",           # orange
+    "refused": "EA9999",           # dark red
+    "no_tls": "EDEDED",            # light gray
+    None: "FFFFFF",
+}
+
+HEADERS = ["Service", "Domain/IP", "Port", "Protocol", "Expires", "Days Left", "Issuer", "SAN", "Chain"]
+LEGEND = ["Legenda:", "🟢 TLS moderno", "🟠 TLS legacy", "🔴 SSL obsoleto", "⚫ No TLS", "🚫 Rifiutata", "🕓 Timeout"]
+COLUMN_WIDTH = 25
+
 
 def protocol_to_icon(proto):
-    return {
-        "tls_modern": "🟢",
-        "tls_legacy": "🟠",
-        "ssl_obsolete": "🔴",
-        "tcp_open_not_tls": "⚫",
-        "timeout": "🕓",
-        "refused": "🚫",
-        "no_tls": "⚪"
-    }.get(proto, "⚪")
+    return PROTOCOL_ICONS.get(proto, "⚪")
 
 
 def row_color(proto):
-    return {
-        "tls_modern": "C6EFCE",       # green
-        "tls_legacy": "FFF2CC",       # yellow
-        "ssl_obsolete": "F4CCCC",     # red
-        "tcp_open_not_tls": "D9D9D9", # dark gray
-        "timeout": "FCE5CD",          # orange
-        "refused": "EA9999",          # strong red
-        "no_tls": "EDEDED"            # light gray
-    }.get(proto, "FFFFFF")            # default white
-
-
-def generate_xlsx(results, file_path="/tmp/ssl_report.xlsx"):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "SSL Report"
-
-    headers = ["Service", "Domain/IP", "Port", "Protocol", "Expires", "Days Left", "Issuer", "SAN", "Chain"]
-    ws.append(headers)
-
-    # header formatting
-    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True)
-
-    for col_num, _ in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.fill = header_fill
-        cell.font = header_font
-        ws.column_dimensions[get_column_letter(col_num)].width = 25
-
-    # rows
-    for row in results:
-        proto = row.get("protocol", "no_tls")
-        icon = protocol_to_icon(proto)
-        san_text = "; ".join(row.get("san") or []) if "san" in row else ""
-
-        line = [
-            row.get("service", ""),
-            row.get("domain", ""),
-            row.get("port", ""),
-            f"{icon} {proto}",
-            row.get("expires", "") if "error" not in row else "",
-            row.get("days_left", "") if "error" not in row else "",
-            row.get("issuer", "") if "error" not in row else "",
-            san_text,
-            row.get("chain", "") if "error" not in row else "ERROR: " + row.get("error", "")
+    return ROW_COLORS.get(proto, "FFFFFF")
+
+
+def _row_style_name(proto):
+    return f"row_{proto or 'none'}"
+
+
+def _build_styles():
+    """
+    Stili nominati del report, creati una volta per workbook: ogni cella
+    riferisce lo stile per nome invece di creare nuovi oggetti Fill/Alignment.
+    (Non sono condivisi tra workbook perché `add_named_style` li lega al
+    workbook a cui vengono aggiunti.)
+    """
+    header = NamedStyle(name="header")
+    header.fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
+    header.font = Font(color="FFFFFF", bold=True)
+    header.alignment = Alignment(horizontal="center")
+
+    styles = [header]
+    for proto, color in ROW_COLORS.items():
+        style = NamedStyle(name=_row_style_name(proto))
+        style.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+        style.alignment = Alignment(wrap_text=True, vertical="center")
+        styles.append(style)
+    return styles
+
+
+def _report_row(row):
+    """Valori di una riga del report a partire dal dict risultato."""
+    proto = row.get("protocol")
+    san_text = "; ".join(row.get("san") or [])
+    if "error" in row:
+        suspended = ""
+        if row.get("suppressed_until"):
+            suspended = f" (ultimo stato noto, nuovo controllo dopo {row['suppressed_until']})"
+        return [
+            row.get("service", ""), row.get("domain", ""), row.get("port", ""),
+            protocol_to_icon(proto), "", "", "", san_text, "ERROR: " + row.get("error", "") + suspended,
         ]
+    return [
+        row.get("service", ""), row.get("domain", ""), row.get("port", ""),
+        protocol_to_icon(proto), row.get("expires", ""), row.get("days_left", ""),
+        row.get("issuer", ""), san_text, row.get("chain", ""),
+    ]
+
+
+def write_xlsx(results, output, scanned_at=None):
+    """
+    Scrive il report su `output` (path o file-like) in modalità write-only:
+    le righe vengono serializzate man mano, senza tenere il foglio in memoria.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    for style in _build_styles():
+        wb.add_named_style(style)
+
+    ws = wb.create_sheet("SSL Report")
+    ws.freeze_panes = "A4"
+    for col_num in range(1, len(HEADERS) + 1):
+        ws.column_dimensions[get_column_letter(col_num)].width = COLUMN_WIDTH
+
+    ws.append(LEGEND)
+    if scanned_at is not None:
+        ws.append(["Ultima scansione:", scanned_at.strftime("%Y-%m-%d %H:%M:%S")])
+    else:
+        ws.append([])
+
+    header_cells = []
+    for title in HEADERS:
+        cell = WriteOnlyCell(ws, value=title)
+        cell.style = "header"
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    for row in results:
+        style_name = _row_style_name(row.get("protocol") if row.get("protocol") in ROW_COLORS else None)
+        cells = []
+        for value in _report_row(row):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = style_name
+            cells.append(cell)
+        ws.append(cells)
+
+    wb.save(output)
+    return output
 
-        ws.append(line)
 
-        # apply row background
-        fill = PatternFill(start_color=row_color(proto), end_color=row_color(proto), fill_type="solid")
+def generate_xlsx(results, file_path=None, scanned_at=None):
+    """
+    Genera il report XLSX.
 
-        for col in range(1, len(headers)+1):
-            cell = ws.cell(row=ws.max_row, column=col)
-            cell.fill = fill
-            cell.alignment = Alignment(wrap_text=True, vertical="center")
+    Con `file_path` salva su disco e ritorna il path; altrimenti ritorna un
+    buffer temporaneo (in memoria, su disco oltre qualche MB) già
+    riavvolto, privato della singola richiesta.
+    """
+    if file_path is not None:
+        return write_xlsx(results, file_path, scanned_at=scanned_at)
 
-    wb.save(file_path)
-    return file_path
+    buffer = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    write_xlsx(results, buffer, scanned_at=scanned_at)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,156 @@
+import datetime
+import math
+import threading
+import time
+from collections import deque
+
+DEFAULT_TIMEOUT = 5.0           # secondi, usato finché non ci sono abbastanza campioni
+DEFAULT_MIN_TIMEOUT = 1.0       # limite inferiore del timeout adattivo
+DEFAULT_PERCENTILE = 95         # percentile della latenza osservata
+DEFAULT_MULTIPLIER = 3.0        # margine applicato al percentile
+DEFAULT_MIN_SAMPLES = 5         # campioni necessari prima di adattare il timeout
+DEFAULT_FAILURE_THRESHOLD = 3   # fallimenti consecutivi prima di sospendere
+DEFAULT_BASE_BACKOFF = 300      # secondi della prima sospensione
+DEFAULT_MAX_BACKOFF = 86400     # sospensione massima
+
+SAMPLES = 20                    # latenze conservate per endpoint
+
+# Stati che indicano un endpoint irraggiungibile (non un servizio non TLS)
+DEAD_STATES = ("timeout", "refused")
+
+
+def health_settings(config):
+    """Legge la sezione "health" del config."""
+    conf = config.get("health", {})
+    return {
+        "timeout": conf.get("timeout_seconds", DEFAULT_TIMEOUT),
+        "min_timeout": conf.get("min_timeout_seconds", DEFAULT_MIN_TIMEOUT),
+        "percentile": conf.get("latency_percentile", DEFAULT_PERCENTILE),
+        "multiplier": conf.get("latency_multiplier", DEFAULT_MULTIPLIER),
+        "failure_threshold": conf.get("failure_threshold", DEFAULT_FAILURE_THRESHOLD),
+        "base_backoff": conf.get("base_backoff_seconds", DEFAULT_BASE_BACKOFF),
+        "max_backoff": conf.get("max_backoff_seconds", DEFAULT_MAX_BACKOFF),
+    }
+
+
+def percentile(values, pct):
+    """Percentile nearest-rank di una sequenza non vuota."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class _Endpoint:
+    __slots__ = ("latencies", "failures", "suppressed_until", "last_result")
+
+    def __init__(self):
+        self.latencies = deque(maxlen=SAMPLES)  # secondi connect + handshake
+        self.failures = 0
+        self.suppressed_until = 0.0             # time.time()
+        self.last_result = None
+
+
+class EndpointHealth:
+    """
+    Stato di salute per endpoint (domain, port):
+
+    - timeout adattivo: percentile della latenza connect+handshake
+      osservata, moltiplicato per un margine e limitato tra
+      `min_timeout` e `timeout`. Un timeout con il valore appreso azzera
+      i campioni: la probe successiva usa di nuovo `timeout` pieno, così
+      un endpoint diventato più lento non resta in timeout per sempre;
+    - circuit breaker: dopo `failure_threshold` timeout/refused
+      consecutivi l'endpoint viene sospeso con backoff esponenziale
+      (base_backoff, 2x, 4x... fino a max_backoff). Durante la sospensione
+      non viene probato: si riporta l'ultimo stato noto con "suppressed_until".
+    """
+
+    def __init__(self, **settings):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.configure(**settings)
+
+    def configure(self, timeout=DEFAULT_TIMEOUT, min_timeout=DEFAULT_MIN_TIMEOUT,
+                  percentile=DEFAULT_PERCENTILE, multiplier=DEFAULT_MULTIPLIER,
+                  failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                  base_backoff=DEFAULT_BASE_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.timeout = timeout
+        self.min_timeout = min(min_timeout, timeout)
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    def _get(self, key):
+        endpoint = self._endpoints.get(key)
+        if endpoint is None:
+            endpoint = self._endpoints[key] = _Endpoint()
+        return endpoint
+
+    def _learned(self, endpoint):
+        """Timeout adattivo dell'endpoint, o None finché non ci sono abbastanza campioni."""
+        if endpoint is None or len(endpoint.latencies) < DEFAULT_MIN_SAMPLES:
+            return None
+        observed = percentile(endpoint.latencies, self.percentile) * self.multiplier
+        return min(self.timeout, max(self.min_timeout, observed))
+
+    def timeout_for(self, key):
+        """Timeout (secondi) da usare per la prossima probe dell'endpoint."""
+        with self._lock:
+            learned = self._learned(self._endpoints.get(key))
+        return self.timeout if learned is None else learned
+
+    def suppressed(self, key, now=None):
+        """
+        Se l'endpoint è sospeso ritorna l'ultimo risultato noto con il
+        campo "suppressed_until", altrimenti None.
+        """
+        now = now or time.time()
+        with self._lock:
+            endpoint = self._endpoints.get(key)
+            if endpoint is None or endpoint.suppressed_until <= now or endpoint.last_result is None:
+                return None
+            result = dict(endpoint.last_result)
+            until = endpoint.suppressed_until
+        result["suppressed_until"] = datetime.datetime.fromtimestamp(until).isoformat(timespec="seconds")
+        return result
+
+    def record(self, key, result, latency=None, now=None):
+        """
+        Registra l'esito di una probe. `latency` (secondi) è il tempo di
+        connect + handshake quando la connessione è riuscita.
+        """
+        now = now or time.time()
+        with self._lock:
+            endpoint = self._get(key)
+            endpoint.last_result = result
+            if latency is not None:
+                endpoint.latencies.append(latency)
+
+            learned = self._learned(endpoint)
+            if result.get("protocol") == "timeout" and learned is not None and learned < self.timeout:
+                # Scaduto il timeout appreso: forse la latenza è salita. Si
+                # dimenticano i campioni e si riprova con il timeout pieno
+                # prima di contare il fallimento per il circuit breaker
+                endpoint.latencies.clear()
+                return
+
+            if result.get("protocol") not in DEAD_STATES:
+                endpoint.failures = 0
+                endpoint.suppressed_until = 0.0
+                return
+
+            endpoint.failures += 1
+            over = endpoint.failures - self.failure_threshold
+            if over >= 0:
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** min(over, 32))
+                endpoint.suppressed_until = now + backoff
+
+    def forget(self, key):
+        with self._lock:
+            self._endpoints.pop(key, None)
+
+
+# 🩺 Stato di salute condiviso dalle probe di questo processo
+HEALTH = EndpointHealth()
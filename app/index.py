@@ -0,0 +1,170 @@
+import datetime
+from bisect import bisect_left, bisect_right, insort
+
+# Oltre 1/REBUILD_RATIO dell'inventario in un lotto, l'indice si ricostruisce
+REBUILD_RATIO = 8
+
+
+def endpoint_key(result):
+    return (result["domain"], result.get("port"))
+
+
+def expiry_key(result):
+    """
+    Posizione del risultato nell'ordine della dashboard: prima i
+    certificati per data di scadenza, poi gli errori. La data di scadenza
+    non invecchia come "days_left", quindi l'ordine resta valido nel tempo.
+    """
+    domain, port = endpoint_key(result)
+    port = -1 if port is None else port
+    if "error" in result or not result.get("expires"):
+        return (1, "", domain, port)
+    return (0, result["expires"], domain, port)
+
+
+def _alerting(result):
+    return bool(result.get("alert")) and "error" not in result
+
+
+def _entry(result):
+    """Voce dell'indice di scadenza: la chiave dell'endpoint in coda risolve i pareggi."""
+    return (*expiry_key(result), endpoint_key(result))
+
+
+def _changed_entry(result):
+    value = result.get("changed_at")
+    if not value:
+        return None
+    return (datetime.datetime.fromisoformat(value), *expiry_key(result)[2:], endpoint_key(result))
+
+
+class IndexedResults(list):
+    """
+    Una generazione di risultati, già nell'ordine della dashboard e
+    interrogabile senza riordinare: è una lista normale (dashboard, API
+    ed export la usano così) più le interrogazioni dell'indice, in tempo
+    logaritmico o proporzionale a ciò che ritornano.
+    """
+
+    def __init__(self, ordered=(), expires=(), changes=(), alerts=()):
+        super().__init__(ordered)
+        self._expires = expires     # date di scadenza dei soli certificati, in ordine
+        self._changes = changes     # (changed_at, domain, porta, risultato) in ordine
+        self._alerts = alerts       # risultati in alert, in ordine di scadenza
+
+    def expiring_within(self, days, now=None):
+        """Certificati che scadono entro `days` giorni, dal più vicino."""
+        now = now or datetime.datetime.utcnow()
+        cutoff = (now + datetime.timedelta(days=days)).strftime("%Y-%m-%d")
+        return self[:bisect_right(self._expires, cutoff)]
+
+    def soonest(self, k):
+        """I `k` certificati più vicini alla scadenza."""
+        return self[:min(k, len(self._expires))]
+
+    def changed_since(self, since):
+        """Risultati il cui stato è cambiato dopo `since` (datetime locale), dal meno recente."""
+        start = bisect_right(self._changes, (since, chr(0x10FFFF)))
+        return [item[-1] for item in self._changes[start:]]
+
+    def alerts(self):
+        """Risultati in alert, dal più vicino alla scadenza."""
+        return list(self._alerts)
+
+
+class ExpiryIndex:
+    """
+    Ultimo stato per endpoint con gli indici mantenuti a ogni probe:
+
+    - ordine di scadenza (quello della dashboard), per "scade entro N
+      giorni" e "i K più vicini";
+    - ordine di "changed_at", per "cambiati da T";
+    - i soli endpoint in alert, per le notifiche.
+
+    Gli indici sono liste ordinate aggiornate con bisect: un risultato
+    nuovo costa una ricerca logaritmica e uno spostamento in memoria,
+    mai un riordino dell'inventario. `view` fotografa lo stato in una
+    `IndexedResults` (copia lineare, senza ordinamento) per ogni generazione.
+    Non è thread-safe: la protegge il lock di chi la possiede.
+    """
+
+    def __init__(self, results=()):
+        self.replace(results)
+
+    def replace(self, results):
+        """Ricostruisce l'indice da zero (avvio, scansione completa)."""
+        self._by_key = {endpoint_key(r): r for r in results}
+        values = self._by_key.values()
+        self._order = sorted(_entry(r) for r in values)
+        self._alerts = [item for item in self._order if _alerting(self._by_key[item[-1]])]
+        self._changes = sorted(filter(None, (_changed_entry(r) for r in values)))
+
+    def update(self, results):
+        """
+        Inserisce o sostituisce i risultati. Un lotto grande rispetto
+        all'inventario conviene ricostruirlo, uno piccolo (il caso normale
+        dello scheduler) si inserisce voce per voce.
+        """
+        if len(results) * REBUILD_RATIO > len(self._by_key):
+            merged = dict(self._by_key)
+            merged.update((endpoint_key(r), r) for r in results)
+            self.replace(merged.values())
+            return
+        for r in results:
+            self.upsert(r)
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def __contains__(self, key):
+        return key in self._by_key
+
+    def get(self, key):
+        return self._by_key.get(key)
+
+    def keys(self):
+        return self._by_key.keys()
+
+    @staticmethod
+    def _discard(items, item):
+        if item is None:
+            return
+        i = bisect_left(items, item)
+        if i < len(items) and items[i] == item:
+            del items[i]
+
+    def upsert(self, result):
+        key = endpoint_key(result)
+        self.remove(key)
+        self._by_key[key] = result
+        order = _entry(result)
+        insort(self._order, order)
+        if _alerting(result):
+            insort(self._alerts, order)
+        changed = _changed_entry(result)
+        if changed is not None:
+            insort(self._changes, changed)
+
+    def remove(self, key):
+        old = self._by_key.pop(key, None)
+        if old is None:
+            return
+        order = _entry(old)
+        self._discard(self._order, order)
+        self._discard(self._alerts, order)
+        self._discard(self._changes, _changed_entry(old))
+
+    def retain(self, keep):
+        """Toglie gli endpoint le cui chiavi (domain, port) non sono in `keep`."""
+        for key in [k for k in self._by_key if k not in keep]:
+            self.remove(key)
+
+    def view(self):
+        """Fotografia ordinata dello stato corrente (nuova lista: una nuova generazione)."""
+        by_key = self._by_key
+        return IndexedResults(
+            [by_key[item[-1]] for item in self._order],
+            [item[1] for item in self._order if item[0] == 0],
+            [(*item[:-1], by_key[item[-1]]) for item in self._changes],
+            [by_key[item[-1]] for item in self._alerts],
+        )
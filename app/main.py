@@ -1,165 +1,333 @@
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse, PlainTextResponse, FileResponse
-from .checker import check_domains
-from .notifier import notify
-import io
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
+from typing import Optional
+from .cache import ResultCache
+from .api import ResultsApi, choose_encoding, http_date, not_modified
+from .collector import Collector, collector_settings
+from .config import load_config
+from .dashboard import DEFAULT_PAGE_SIZE, DashboardRenderer, parse_alert
+from .export_xlsx import PROTOCOL_ICONS, XLSX_MEDIA_TYPE, generate_xlsx
+from .notifier import NOTIFICATIONS
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, METRICS, render_endpoints
+from .scanner import shutdown_workers
+from .scheduler import RefreshScheduler
+from .store import ResultStore
+import asyncio
 import csv
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font, Alignment
 import datetime
+import gzip
+import json
 import os
 
-app = FastAPI()
-
-# 🔥 ICON MAPPING (uguale per web & Excel)
-PROTOCOL_ICONS = {
-    "tls_modern": "🟢",
-    "tls_legacy": "🟠",
-    "ssl_obsolete": "🔴",
-    "tcp_open_not_tls": "⚫",
-    "timeout": "🕓",
-    "refused": "🚫",
-    "no_tls": "⚪",
-    None: "⚪",
-}
-
-# 🔥 EXCEL ROW COLORS (hex)
-ROW_COLORS = {
-    "tls_modern": "C6EFCE",        # green
-    "tls_legacy": "FFF2CC",        # yellow
-    "ssl_obsolete": "F4CCCC",      # red
-    "tcp_open_not_tls": "D9D9D9",  # gray
-    "timeout": "FCE5CD",           # orange
-    "refused": "EA9999",           # dark red
-    "no_tls": "EDEDED",            # light gray
-    None: "FFFFFF"
-}
-
-def sort_results(results):
-    def key_fn(r):
-        if "error" in r:
-            return (1, 999999)
-        return (0, r.get("days_left", 999999))
-    return sorted(results, key=key_fn)
+CONFIG_PATH = os.environ.get("SSL_MONITOR_CONFIG", "app/config.json")
+
+
+def background_enabled(config_path=CONFIG_PATH):
+    return load_config(config_path).get("scan", {}).get("background", True)
+
+
+# 🗄️ Storico persistente + cache condivisa: dashboard ed export leggono
+# l'ultimo stato salvato, anche subito dopo un riavvio
+result_store = ResultStore.from_config(load_config(CONFIG_PATH))
+result_cache = ResultCache(CONFIG_PATH, store=result_store)
+
+# 🛰️ Modalità collector: la scansione la fanno gli agent remoti (vedi `collector`)
+collector = None
+if collector_settings(load_config(CONFIG_PATH))["enabled"]:
+    collector = Collector(result_cache, CONFIG_PATH)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # 🔄 Refresh in background: le richieste HTTP leggono solo dalla cache
+    task = None
+    if collector is not None:
+        # Niente scansioni locali: "Aggiorna ora" rimette in coda gli shard per gli agent
+        result_cache.set_refresher(collector.trigger)
+    elif background_enabled():
+        scheduler = RefreshScheduler(result_cache, CONFIG_PATH)
+        result_cache.set_refresher(scheduler.trigger)
+        task = asyncio.create_task(scheduler.run())
+    yield
+    NOTIFICATIONS.close(timeout=5)
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    shutdown_workers()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def scanned_at_label(scanned_at):
+    if scanned_at is None:
+        return "in corso..."
+    return scanned_at.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def scanned_at_headers(scanned_at):
+    if scanned_at is None:
+        return {}
+    return {"X-Scanned-At": scanned_at.isoformat(timespec="seconds")}
+
+
+def suppressed_note(r):
+    """Nota per gli endpoint sospesi dal circuit breaker (ultimo stato noto)."""
+    if not r.get("suppressed_until"):
+        return ""
+    return f" (ultimo stato noto, nuovo controllo dopo {r['suppressed_until']})"
+
+
+# I risultati della cache sono già in ordine di scadenza (vedi `index`)
+dashboard_renderer = DashboardRenderer(note=suppressed_note)
 
 
 @app.get("/", response_class=HTMLResponse)
-def dashboard():
-    results = sort_results(check_domains())
-    notify(results)
-
-    html = """
-    <html>
-    <head>
-        <title>SSL Monitor</title>
-        <style>
-            body {
-                background-image: url('https://images.unsplash.com/photo-1518770660439-4636190af475?auto=format&fit=crop&w=1400&q=80');
-                background-size: cover; background-position: center;
-                background-attachment: fixed;
-                color: white; font-family: Arial; text-align: center; margin:0;
-            }
-            header { background: rgba(0,0,0,0.65); padding:20px; }
-            header img { max-height:80px; }
-            h1 { font-size:2.7em; margin-top:10px; }
-            .actions button {
-                background:#1976d2; padding:8px 16px; margin:4px; border-radius:6px;
-                border:none; color:white; cursor:pointer; font-size:0.95em;
-            }
-            .actions button:hover { background:#12589a; }
-            .tooltip { position:relative; cursor:help; }
-            .tooltip span {
-                visibility:hidden; opacity:0; width:260px;
-                background:black; color:white; padding:8px;
-                border-radius:5px; text-align:left;
-                position:absolute; left:50%; transform:translateX(-50%);
-                bottom:130%; transition:0.3s;
-            }
-            .tooltip:hover span { visibility:visible; opacity:1; }
-
-            table {
-                width:94%; margin:10px auto 40px auto; border-collapse:collapse;
-                background:rgba(0, 0, 0, 0.7); border-radius:12px; overflow:hidden;
-                box-shadow:0 5px 18px rgba(0,0,0,0.55);
-            }
-            th { background:rgba(255,255,255,0.18); padding:14px; font-size:1.05em; }
-            td { padding:12px; word-break:break-word; }
-            tr:nth-child(even){ background:rgba(255,255,255,0.08); }
-            tr:hover { background:rgba(255,255,255,0.18); }
-
-            .error { color:#ff8080; font-weight:bold; }
-            .issuer { font-size:0.85em; color:#e0e0e0; }
-            .san { font-size:0.75em; color:#ccc; }
-
-            .legend-container {
-                margin-top:5px; margin-bottom:10px; background:rgba(0,0,0,0.55);
-                display:inline-block; padding:8px 18px; border-radius:10px; font-size:1.05em;
-            }
-            .legend-item { margin:0 14px; display:inline-block; }
-        </style>
-    </head>
-    <body>
-        <header>
-            <img src="https://raw.githubusercontent.com/stefanomagagni/ssl-monitor/main/app/logo_deda.png">
-            <h1>SSL Monitor</h1>
-            <div class="actions">
-                <button onclick="window.location.href='/export'">Esporta CSV</button>
-                <button onclick="window.location.href='/export_xlsx'">Esporta Excel</button>
-            </div>
-        </header>
-
-        <div class="legend-container">
-            <span class="legend-item tooltip">🟢 TLS moderno<span>Supporta TLS1.2 / TLS1.3</span></span>
-            <span class="legend-item tooltip">🟠 TLS legacy<span>Protocollo TLS datato</span></span>
-            <span class="legend-item tooltip">🔴 SSL obsoleto<span>SSlv2/3 non sicuro</span></span>
-            <span class="legend-item tooltip">⚫ No TLS<span>Porta aperta ma nessun SSL/TLS</span></span>
-            <span class="legend-item tooltip">🚫 Rifiutata<span>Connessione negata</span></span>
-            <span class="legend-item tooltip">🕓 Timeout<span>Nessuna risposta</span></span>
-        </div>
-
-        <table>
-            <tr>
-                <th>Service</th><th>Domain/IP</th><th>Port</th><th>Protocol</th>
-                <th>Expires</th><th>Days Left</th><th>Issuer</th><th>SAN</th><th>Chain</th>
-            </tr>
+def dashboard(
+    refresh: bool = False,
+    protocol: Optional[str] = None,
+    service: Optional[str] = None,
+    alert: Optional[str] = None,
+    page: int = 1,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Dashboard con filtri (protocol, service, alert) e paginazione lato
+    server. La pagina è renderizzata una volta per generazione dei
+    risultati; con If-None-Match uguale all'ETag si risponde 304.
     """
+    try:
+        # Stringa e non bool: l'opzione "Tutti" del form invia "alert="
+        alert_filter = parse_alert(alert)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    results, scanned_at = result_cache.get(refresh=refresh)
+    body, etag = dashboard_renderer.render(
+        results, scanned_at_label(scanned_at), protocol=protocol or None,
+        service=service or None, alert=alert_filter, page=page, page_size=page_size,
+    )
+    headers = {"ETag": etag, "Cache-Control": "no-cache", **scanned_at_headers(scanned_at)}
+    if not_modified(etag, None, if_none_match):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, headers=headers)
+
+
+# ----------------------------------------------------------------------
+#       API STATO / STORICO
+# ----------------------------------------------------------------------
+
+def parse_target(target):
+    """Divide "dominio:porta" in (dominio, porta)."""
+    domain, _, port = target.rpartition(":")
+    if not domain or not port.isdigit():
+        raise HTTPException(status_code=400, detail="Formato atteso: dominio:porta")
+    return domain, int(port)
+
+
+def api_snapshot(refresh=False):
+    """
+    Stato corrente per le API JSON: le richieste di polling leggono solo
+    la cache, una scansione parte soltanto con `refresh` esplicito.
+    """
+    if refresh:
+        return result_cache.get(refresh=True)
+    return result_cache.snapshot()
+
+
+@app.get("/api/latest")
+def api_latest(refresh: bool = False):
+    results, scanned_at = api_snapshot(refresh)
+    return {
+        "scanned_at": scanned_at.isoformat(timespec="seconds") if scanned_at else None,
+        "results": results,
+    }
 
-    for r in results:
-        if "error" in r:
-            icon = PROTOCOL_ICONS.get(r.get("protocol"))
-            html += f"""
-            <tr>
-                <td>{r.get('service')}</td><td>{r['domain']}</td><td>{r.get('port','')}</td>
-                <td style='font-size:1.4em'>{icon}</td>
-                <td colspan="5" class="error">Errore: {r['error']}</td>
-            </tr>"""
-        else:
-            icon = PROTOCOL_ICONS.get(r.get("protocol"))
-
-            if r["days_left"] <= 0: color="#ff4d4d"
-            elif r.get("alert"): color="#ffcc00"
-            else: color="lightgreen"
-
-            issuer = r["issuer"]
-            san_preview = ", ".join(r["san"][:2])
-            san_full = ", ".join(r["san"])
-            chain_icon = "⚠" if r.get("chain_incomplete") else "✔"
-
-            html += f"""
-            <tr>
-                <td>{r.get('service')}</td><td>{r['domain']}</td><td>{r['port']}</td>
-                <td style='font-size:1.4em'>{icon}</td>
-                <td>{r['expires']}</td>
-                <td style='color:{color}; font-weight:bold;'>{r['days_left']}</td>
-                <td class='issuer tooltip'>{issuer[:40]}...<span>{issuer}</span></td>
-                <td class='san tooltip'>{san_preview}...<span>{san_full}</span></td>
-                <td>{chain_icon}</td>
-            </tr>
-            """
-
-    html += """
-        </table><footer>© 2025 Deda Next – Internal SSL Monitoring Dashboard</footer></body></html>"""
-    return html
+
+results_api = ResultsApi()
+
+
+def api_response(results, key, payload, etag, last_modified, request):
+    """
+    Risposta JSON condizionale e compressa: 304 se il client ha già questa
+    versione, altrimenti il corpo (br/gzip secondo Accept-Encoding).
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    if not_modified(etag, last_modified, request.headers.get("if-none-match"),
+                    request.headers.get("if-modified-since")):
+        return Response(status_code=304, headers=headers)
+
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    body = results_api.body(results, key, payload, encoding)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/results")
+def api_results(request: Request, since: Optional[datetime.datetime] = None,
+                refresh: bool = False):
+    """
+    Ultimo stato di tutti gli endpoint, dalla cache. Con `since` (ISO)
+    solo gli endpoint il cui stato è cambiato dopo quell'istante.
+    """
+    results, scanned_at = api_snapshot(refresh)
+    if since is not None and since.tzinfo is not None:
+        # "changed_at" è in ora locale naive, come scanned_at
+        since = since.astimezone().replace(tzinfo=None)
+    selected, etag, last_modified = results_api.view(results, since)
+    key = since.isoformat() if since else ""
+
+    def payload():
+        return {
+            "scanned_at": scanned_at.isoformat(timespec="seconds") if scanned_at else None,
+            "since": since.isoformat(timespec="seconds") if since else None,
+            "results": selected,
+        }
+
+    return api_response(results, key, payload, etag, last_modified, request)
+
+
+@app.get("/api/results/{target}")
+def api_result(request: Request, target: str):
+    """Ultimo stato di un singolo endpoint ("dominio:porta"), dalla cache."""
+    domain, port = parse_target(target)
+    results, _ = api_snapshot()
+    result = result_cache.find(domain, port)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Endpoint non monitorato")
+    etag, last_modified = results_api.validators([result], target)
+    return api_response(results, target, lambda: result, etag, last_modified, request)
+
+
+# Oltre un secolo la data limite non è più rappresentabile (anno 9999)
+MAX_EXPIRING_DAYS = 36500
+
+
+@app.get("/api/expiring")
+def api_expiring(
+    days: Optional[int] = Query(None, ge=-MAX_EXPIRING_DAYS, le=MAX_EXPIRING_DAYS),
+    limit: Optional[int] = Query(None, ge=0),
+    refresh: bool = False,
+):
+    """
+    Certificati in scadenza dall'indice della cache: entro `days` giorni
+    e/o i primi `limit` per data di scadenza (senza parametri: quelli in alert).
+    """
+    results, scanned_at = api_snapshot(refresh)
+    if days is None and limit is None:
+        selected = results.alerts()
+    else:
+        selected = results.expiring_within(days) if days is not None else results.soonest(limit)
+        if limit is not None:
+            selected = selected[:limit]
+    return {
+        "scanned_at": scanned_at.isoformat(timespec="seconds") if scanned_at else None,
+        "results": selected,
+    }
+
+
+@app.get("/api/history/{target}")
+def api_history(target: str, limit: int = 100, since: Optional[datetime.datetime] = None):
+    domain, port = parse_target(target)
+    return {
+        "domain": domain,
+        "port": port,
+        "history": result_store.history(domain, port, since=since, limit=limit),
+    }
+
+
+# ----------------------------------------------------------------------
+#       COLLECTOR (AGENT REMOTI)
+# ----------------------------------------------------------------------
+
+def _agent_collector(token):
+    """Collector attivo e token dell'agent valido, altrimenti 404/401."""
+    if collector is None:
+        raise HTTPException(status_code=404, detail="Modalità collector non attiva")
+    if not collector.authorized(token):
+        raise HTTPException(status_code=401, detail="Token agent non valido")
+    return collector
+
+
+async def _agent_payload(request):
+    """Corpo JSON di una richiesta agent, eventualmente compresso con gzip."""
+    body = await request.body()
+    try:
+        if request.headers.get("content-encoding", "").lower() == "gzip":
+            body = gzip.decompress(body)
+        payload = json.loads(body)
+    except (OSError, ValueError):
+        raise HTTPException(status_code=400, detail="Corpo non valido")
+    if not isinstance(payload, dict) or not payload.get("agent"):
+        raise HTTPException(status_code=400, detail="Campo \"agent\" mancante")
+    return payload
+
+
+@app.post("/agent/heartbeat")
+async def agent_heartbeat(request: Request, x_agent_token: Optional[str] = Header(None)):
+    """
+    Heartbeat dell'agent. "shards" (opzionale) sono gli shard che sta
+    scansionando: quelli a suo nome non elencati tornano in coda.
+    """
+    target = _agent_collector(x_agent_token)
+    payload = await _agent_payload(request)
+    active = payload.get("shards")
+    if active is not None and not (isinstance(active, list) and all(isinstance(i, str) for i in active)):
+        raise HTTPException(status_code=400, detail="\"shards\" deve essere una lista di id")
+    return {"shards": target.heartbeat(payload["agent"], payload.get("zones"), active)}
+
+
+@app.post("/agent/lease")
+async def agent_lease(request: Request, x_agent_token: Optional[str] = Header(None)):
+    """Shard scaduti da scansionare, per le zone dichiarate dall'agent."""
+    target = _agent_collector(x_agent_token)
+    payload = await _agent_payload(request)
+    return target.lease(payload["agent"], payload.get("zones") or (), payload.get("max_shards"))
+
+
+@app.post("/agent/results")
+async def agent_results(request: Request, x_agent_token: Optional[str] = Header(None)):
+    """
+    Lotto di risultati di uno shard (JSON, di norma gzip). "done" chiude
+    lo shard; "lease": false dice all'agent che lo shard non è più suo.
+    """
+    target = _agent_collector(x_agent_token)
+    payload = await _agent_payload(request)
+    results = payload.get("results") or []
+    if not isinstance(results, list) or not all(isinstance(r, dict) and "domain" in r for r in results):
+        raise HTTPException(status_code=400, detail="\"results\" deve essere una lista di risultati")
+    owned = await asyncio.to_thread(
+        target.receive, payload["agent"], payload.get("shard"), results, bool(payload.get("done")),
+    )
+    return {"accepted": len(results), "lease": owned}
+
+
+@app.get("/agent/status")
+def agent_status(x_agent_token: Optional[str] = Header(None)):
+    return _agent_collector(x_agent_token).status()
+
+
+# ----------------------------------------------------------------------
+#       METRICHE PROMETHEUS
+# ----------------------------------------------------------------------
+
+@app.get("/metrics")
+def metrics():
+    """
+    Metriche in formato Prometheus: latenze per fase e contatori delle
+    probe di questo processo, più lo stato degli endpoint (days_left,
+    up, alert) letto dalla cache. Lo scrape non avvia mai una scansione.
+    """
+    results, scanned_at = result_cache.snapshot()
+    lines = METRICS.render() + render_endpoints(results, scanned_at)
+    return PlainTextResponse("\n".join(lines) + "\n", media_type=METRICS_CONTENT_TYPE)
 
 
 # ----------------------------------------------------------------------
@@ -167,72 +335,88 @@ def dashboard():
 # ----------------------------------------------------------------------
 
 @app.get("/export_xlsx")
-def export_xlsx():
-    results = sort_results(check_domains())
+def export_xlsx(refresh: bool = False):
+    results, scanned_at = result_cache.get(refresh=refresh)
 
-    filename = f"ssl_report_{datetime.datetime.now().strftime('%Y-%m-%d')}.xlsx"
-    filepath = f"/tmp/{filename}"
+    stamp = (scanned_at or datetime.datetime.now()).strftime('%Y-%m-%d')
+    filename = f"ssl_report_{stamp}.xlsx"
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "SSL Report"
+    # Buffer privato della richiesta: download concorrenti non si sovrascrivono
+    buffer = generate_xlsx(results, scanned_at=scanned_at)
+    return StreamingResponse(
+        iter_file(buffer), media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"',
+                 **scanned_at_headers(scanned_at)},
+    )
 
-    # Freeze header
-    ws.freeze_panes = "A4"
 
-    # Legend
-    ws.append(["Legenda:", "🟢 TLS moderno", "🟠 TLS legacy", "🔴 SSL obsoleto", "⚫ No TLS", "🚫 Rifiutata", "🕓 Timeout"])
-    ws.append([])
-    headers = ["Service", "Domain", "Port", "Protocol", "Expires", "Days Left", "Issuer", "SAN", "Chain"]
-    ws.append(headers)
+def iter_file(buffer, chunk_size=64 * 1024):
+    with buffer:
+        while chunk := buffer.read(chunk_size):
+            yield chunk
 
-    # Style header
-    for cell in ws[3]:
-        cell.fill = PatternFill(start_color="4F81BD", fill_type="solid")
-        cell.font = Font(color="FFFFFF", bold=True)
-        cell.alignment = Alignment(horizontal="center")
 
-    # Data rows
-    for r in results:
-        proto = r.get("protocol")
-        icon = PROTOCOL_ICONS.get(proto)
-        san = "; ".join(r.get("san") or [])
-        chain = r.get("chain", f"ERROR: {r['error']}") if "error" in r else r["chain"]
-
-        row = [
-            r.get("service",""), r.get("domain",""), r.get("port",""),
-            f"{icon}", r.get("expires",""), r.get("days_left",""),
-            r.get("issuer",""), san, chain
-        ]
-        ws.append(row)
-
-        fill = PatternFill(start_color=ROW_COLORS.get(proto), fill_type="solid")
-        for cell in ws[ws.max_row]:
-            cell.fill = fill
-            cell.alignment = Alignment(wrap_text=True)
-
-    wb.save(filepath)
-    return FileResponse(filepath, filename=filename,
-                        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-
-
-# CSV EXPORT unchanged
-@app.get("/export", response_class=PlainTextResponse)
-def export_csv():
-    results = sort_results(check_domains())
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Service", "Domain", "Port", "Protocol", "Expires", "Days Left", "Issuer", "SAN", "Chain/Error"])
+# ----------------------------------------------------------------------
+#       EXPORT CSV (STREAMING)
+# ----------------------------------------------------------------------
+
+CSV_HEADERS = ["Service", "Domain", "Port", "Protocol", "Expires", "Days Left", "Issuer", "SAN", "Chain/Error"]
+
+
+class _LineBuffer:
+    """Pseudo-file per csv.writer: `write` ritorna la riga invece di accumularla."""
+
+    def write(self, value):
+        return value
+
+
+def csv_row(r):
+    icon = PROTOCOL_ICONS.get(r.get("protocol"))
+    if "error" in r:
+        return [r.get("service"), r["domain"], r.get("port"), icon, "", "", "", "", f"ERROR: {r['error']}{suppressed_note(r)}"]
+    return [
+        r.get("service"), r["domain"], r["port"], icon,
+        r["expires"], r["days_left"], r["issuer"], "; ".join(r["san"]), r["chain"]
+    ]
 
+
+def iter_csv(results):
+    """Righe CSV dai risultati già in cache (ordinati)."""
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(CSV_HEADERS)
     for r in results:
-        icon = PROTOCOL_ICONS.get(r.get("protocol"))
-        if "error" in r:
-            writer.writerow([r.get("service"), r["domain"], r.get("port"), icon, "", "", "", "", f"ERROR: {r['error']}"])
-        else:
-            writer.writerow([
-                r.get("service"), r["domain"], r["port"], icon,
-                r["expires"], r["days_left"], r["issuer"], "; ".join(r["san"]), r["chain"]
-            ])
-
-    return PlainTextResponse(output.getvalue(), media_type="text/csv",
-            headers={"Content-Disposition": 'attachment; filename="ssl_report.csv"'})
+        yield writer.writerow(csv_row(r))
+
+
+async def iter_csv_live():
+    """
+    Righe CSV prodotte man mano che le probe di una nuova scansione
+    terminano. La scansione è quella della cache (single-flight): download
+    concorrenti non riscansionano, la cache viene aggiornata alla fine.
+    """
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(CSV_HEADERS)
+    async for r in result_cache.iter_refresh():
+        yield writer.writerow(csv_row(r))
+
+
+@app.get("/export")
+def export_csv(refresh: bool = False):
+    """
+    CSV in streaming: dalla cache, oppure con `?refresh=1` da una nuova
+    scansione le cui righe arrivano nell'ordine in cui le probe terminano.
+    Con il refresh in background `?refresh=1` anticipa solo il giro dello
+    scheduler e il CSV arriva dalla cache, come per la dashboard.
+    """
+    if refresh and not result_cache.has_refresher():
+        scanned_at = datetime.datetime.now()
+        rows = iter_csv_live()
+    else:
+        results, scanned_at = result_cache.get(refresh=refresh)
+        rows = iter_csv(results)
+
+    stamp = (scanned_at or datetime.datetime.now()).strftime('%Y-%m-%d_%H%M%S')
+    filename = f"ssl_report_{stamp}.csv"
+    return StreamingResponse(rows, media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"',
+                     **scanned_at_headers(scanned_at)})
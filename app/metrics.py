@@ -0,0 +1,179 @@
+import threading
+
+# Bucket (millisecondi) degli istogrammi delle fasi di probe
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Fasi misurate da `fetch_tls_info` / `probe_entry` (chiave di `timings`)
+PHASES = ("dns", "connect", "starttls", "handshake", "legacy_handshake", "parse", "chain", "capabilities", "total")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class ProbeMetrics:
+    """
+    Metriche delle probe di questo processo, senza dipendenze esterne:
+
+    - un istogramma di latenza per fase (dns, connect, handshake,
+      legacy_handshake, parse, chain, total);
+    - un contatore di probe per protocol_state, uno dei fallback TLS1.0
+      e uno delle probe saltate dal circuit breaker.
+
+    Nei worker di `run_sharded` le metriche vengono raccolte con `drain`
+    alla fine di ogni shard e unite a quelle del processo padre con `merge`.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # fase -> [conteggi per bucket..., +Inf], somma, conteggio
+        self._histograms = {phase: [[0] * (len(self.buckets) + 1), 0.0, 0] for phase in PHASES}
+        self._states = {}           # protocol_state -> probe
+        self._legacy_fallbacks = 0
+        self._suppressed = 0
+
+    def observe(self, phase, ms):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if ms <= bound:
+                index = i
+                break
+        with self._lock:
+            histogram = self._histograms[phase]
+            histogram[0][index] += 1
+            histogram[1] += ms
+            histogram[2] += 1
+
+    def record_probe(self, result, timings, total_ms):
+        """Registra una probe completata: fasi da `timings` e stato del risultato."""
+        for phase in PHASES[:-1]:
+            ms = timings.get(f"{phase}_ms")
+            if ms is not None:
+                self.observe(phase, ms)
+        self.observe("total", total_ms)
+
+        state = result.get("protocol") or "unknown"
+        with self._lock:
+            self._states[state] = self._states.get(state, 0) + 1
+            if timings.get("legacy_fallback"):
+                self._legacy_fallbacks += 1
+
+    def record_suppressed(self):
+        with self._lock:
+            self._suppressed += 1
+
+    def drain(self):
+        """Ritorna lo stato corrente (picklable) e azzera le metriche."""
+        with self._lock:
+            snapshot = {
+                "histograms": self._histograms,
+                "states": self._states,
+                "legacy_fallbacks": self._legacy_fallbacks,
+                "suppressed": self._suppressed,
+            }
+            self._reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        """Somma alle proprie le metriche raccolte da `drain` in un altro processo."""
+        with self._lock:
+            for phase, (counts, total, count) in snapshot["histograms"].items():
+                histogram = self._histograms[phase]
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+                histogram[2] += count
+            for state, count in snapshot["states"].items():
+                self._states[state] = self._states.get(state, 0) + count
+            self._legacy_fallbacks += snapshot["legacy_fallbacks"]
+            self._suppressed += snapshot["suppressed"]
+
+    def render(self):
+        """Righe in formato testo Prometheus delle metriche di probe."""
+        with self._lock:
+            histograms = {phase: (list(h[0]), h[1], h[2]) for phase, h in self._histograms.items()}
+            states = dict(self._states)
+            legacy_fallbacks = self._legacy_fallbacks
+            suppressed = self._suppressed
+
+        lines = [
+            "# HELP ssl_monitor_probe_phase_seconds Latenza delle fasi di probe.",
+            "# TYPE ssl_monitor_probe_phase_seconds histogram",
+        ]
+        for phase, (counts, total, count) in histograms.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = bound / 1000
+                lines.append(f"ssl_monitor_probe_phase_seconds_bucket{_labels(phase=phase, le=le)} {cumulative}")
+            lines.append(f"ssl_monitor_probe_phase_seconds_bucket{_labels(phase=phase, le='+Inf')} {count}")
+            lines.append(f"ssl_monitor_probe_phase_seconds_sum{_labels(phase=phase)} {total / 1000}")
+            lines.append(f"ssl_monitor_probe_phase_seconds_count{_labels(phase=phase)} {count}")
+
+        lines += [
+            "# HELP ssl_monitor_probes_total Probe eseguite per protocol_state.",
+            "# TYPE ssl_monitor_probes_total counter",
+        ]
+        for state, count in sorted(states.items()):
+            lines.append(f"ssl_monitor_probes_total{_labels(protocol_state=state)} {count}")
+
+        lines += [
+            "# HELP ssl_monitor_legacy_fallback_total Probe che hanno richiesto il fallback TLS1.0.",
+            "# TYPE ssl_monitor_legacy_fallback_total counter",
+            f"ssl_monitor_legacy_fallback_total {legacy_fallbacks}",
+            "# HELP ssl_monitor_probes_suppressed_total Probe saltate dal circuit breaker.",
+            "# TYPE ssl_monitor_probes_suppressed_total counter",
+            f"ssl_monitor_probes_suppressed_total {suppressed}",
+        ]
+        return lines
+
+
+def render_endpoints(results, scanned_at=None):
+    """
+    Righe Prometheus dello stato degli endpoint, dai risultati in cache:
+    giorni alla scadenza, alert ed errore per endpoint.
+    """
+    lines = [
+        "# HELP ssl_monitor_days_left Giorni alla scadenza del certificato.",
+        "# TYPE ssl_monitor_days_left gauge",
+    ]
+    up, alert = [], []
+    for r in results:
+        labels = _labels(domain=r["domain"], port=r.get("port"), service=r.get("service") or "",
+                         protocol_state=r.get("protocol") or "unknown")
+        if "days_left" in r:
+            lines.append(f"ssl_monitor_days_left{labels} {r['days_left']}")
+        up.append(f"ssl_monitor_endpoint_up{labels} {0 if 'error' in r else 1}")
+        alert.append(f"ssl_monitor_endpoint_alert{labels} {1 if r.get('alert') else 0}")
+
+    lines += [
+        "# HELP ssl_monitor_endpoint_up 1 se l'ultimo controllo ha ottenuto il certificato.",
+        "# TYPE ssl_monitor_endpoint_up gauge",
+        *up,
+        "# HELP ssl_monitor_endpoint_alert 1 se il certificato è in finestra di alert.",
+        "# TYPE ssl_monitor_endpoint_alert gauge",
+        *alert,
+    ]
+
+    lines += [
+        "# HELP ssl_monitor_last_scan_timestamp_seconds Ora dell'ultima scansione (epoch).",
+        "# TYPE ssl_monitor_last_scan_timestamp_seconds gauge",
+    ]
+    if scanned_at is not None:
+        lines.append(f"ssl_monitor_last_scan_timestamp_seconds {scanned_at.timestamp()}")
+    return lines
+
+
+# 📈 Metriche condivise dalle probe di questo processo
+METRICS = ProbeMetrics()
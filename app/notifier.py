@@ -1,41 +1,56 @@
 import smtplib
 from email.mime.text import MIMEText
+import html
 import json
 import os
-import datetime
+import queue
+import threading
+import time
 
-LAST_SENT_FILE = "/tmp/ssl_monitor_last_sent.txt"  # file per gestire invio giornaliero
+from .config import load_config
 
-def notify(results, config_path="app/config.json"):
-    with open(config_path) as f:
-        conf = json.load(f)
+DEFAULT_BATCH_SECONDS = 5        # attesa per raggruppare più giri in una sola email
+DEFAULT_REPEAT_HOURS = 24        # dopo quanto si ripete l'avviso per lo stesso endpoint e livello
+DEFAULT_CRITICAL_DAYS = 7        # sotto questa soglia l'alert diventa "critical"
+DEFAULT_MAX_RETRIES = 5          # tentativi di invio dopo il primo
+DEFAULT_RETRY_BACKOFF = 30       # secondi del primo retry, poi raddoppia
+DEFAULT_SMTP_TIMEOUT = 10
+DEFAULT_STATE_FILE = "/tmp/ssl_monitor_notified.json"  # ultimi invii per endpoint e livello
+
+def notification_settings(config):
+    """
+    Legge la sezione "notification" del config. I parametri SMTP stanno in
+    "notification.email" (per compatibilità anche in "email" alla radice).
+    """
+    conf = config.get("notification", {})
+    return {
+        "email": conf.get("email") or config.get("email", {}),
+        "batch_seconds": conf.get("batch_seconds", DEFAULT_BATCH_SECONDS),
+        "repeat_hours": conf.get("repeat_hours", DEFAULT_REPEAT_HOURS),
+        "critical_days": conf.get("critical_days", DEFAULT_CRITICAL_DAYS),
+        "max_retries": conf.get("max_retries", DEFAULT_MAX_RETRIES),
+        "retry_backoff": conf.get("retry_backoff_seconds", DEFAULT_RETRY_BACKOFF),
+        "state_file": conf.get("state_file", DEFAULT_STATE_FILE),
+    }
 
-    email_conf = conf.get("email", {})
-    if not email_conf.get("enabled", False):
-        print("ℹ️  Email notifications are disabled.")
-        return
 
-    smtp_server = email_conf["smtp_server"]
-    smtp_port = email_conf.get("smtp_port", 25)
-    use_tls = email_conf.get("use_tls", False)
-    sender = email_conf["from"]
-    recipients = email_conf["to"]
-
-    alerts = [r for r in results if r.get("alert")]
-    if not alerts:
-        print("✅ Nessun certificato in scadenza.")
-        return
-
-    # 📅 Controlla se è già stata inviata oggi
-    today = datetime.date.today().isoformat()
-    if os.path.exists(LAST_SENT_FILE):
-        with open(LAST_SENT_FILE) as f:
-            last_sent = f.read().strip()
-        if last_sent == today:
-            print("📧 Email già inviata oggi, salto l'invio.")
-            return
-
-    # 💄 Crea corpo HTML
+def alert_level(result, critical_days=DEFAULT_CRITICAL_DAYS):
+    """Livello di alert di un risultato ("expired", "critical", "warning") o None."""
+    if "error" in result or not result.get("alert"):
+        return None
+    if result["days_left"] <= 0:
+        return "expired"
+    if result["days_left"] <= critical_days:
+        return "critical"
+    return "warning"
+
+
+def dedup_key(result, level, recipient):
+    return f"{recipient}|{result['domain']}:{result.get('port')}:{level}"
+
+
+def render_email(alerts):
+    """Corpo HTML dell'email per una lista di (risultato, livello)."""
     html_body = """
     <html>
     <head>
@@ -54,33 +69,241 @@ def notify(results, config_path="app/config.json"):
         <h2>⚠️ Avviso scadenza certificati SSL</h2>
         <p>I seguenti certificati stanno per scadere:</p>
         <table>
-            <tr><th>Dominio</th><th>Data Scadenza</th><th>Giorni Rimasti</th></tr>
+            <tr><th>Dominio</th><th>Porta</th><th>Servizio</th><th>Data Scadenza</th><th>Giorni Rimasti</th><th>Livello</th></tr>
     """
 
-    for r in alerts:
+    rows = []
+    for r, level in sorted(alerts, key=lambda item: item[0]["days_left"]):
         clean_domain = r['domain'].replace("https://", "").replace("http://", "")
-        color_class = "danger" if r["days_left"] <= 15 else "ok"
-        html_body += f"<tr><td>{clean_domain}</td><td>{r['expires']}</td><td class='{color_class}'>{r['days_left']}</td></tr>"
+        color_class = "ok" if level == "warning" else "danger"
+        rows.append(
+            f"<tr><td>{html.escape(clean_domain)}</td><td>{r.get('port', '')}</td>"
+            f"<td>{html.escape(str(r.get('service') or ''))}</td><td>{r['expires']}</td>"
+            f"<td class='{color_class}'>{r['days_left']}</td><td>{level}</td></tr>"
+        )
 
-    html_body += """
+    return html_body + "".join(rows) + """
         </table>
         <p style="margin-top:20px;">Email generata automaticamente da <b>SSL Monitor</b>.</p>
     </body>
     </html>
     """
 
-    msg = MIMEText(html_body, "html")
-    msg["Subject"] = "⚠️ Avviso scadenza certificati SSL"
-    msg["From"] = sender
-    msg["To"] = ", ".join(recipients)
 
+def send_batch(email_conf, body, recipients):
+    """
+    Invia la stessa email a ogni destinatario su un'unica connessione SMTP.
+    Ritorna i destinatari per cui l'invio è fallito.
+    """
+    sender = email_conf["from"]
+    failed = []
     try:
-        with smtplib.SMTP(smtp_server, smtp_port, timeout=10) as server:
-            if use_tls:
+        with smtplib.SMTP(email_conf["smtp_server"], email_conf.get("smtp_port", 25),
+                          timeout=email_conf.get("timeout", DEFAULT_SMTP_TIMEOUT)) as server:
+            if email_conf.get("use_tls", False):
                 server.starttls()
-            server.sendmail(sender, recipients, msg.as_string())
-        with open(LAST_SENT_FILE, "w") as f:
-            f.write(today)
-        print("✅ Email HTML inviata con successo!")
-    except Exception as e:
-        print(f"❌ Errore nell'invio dell'email: {e}")
+            for i, recipient in enumerate(recipients):
+                msg = MIMEText(body, "html")
+                msg["Subject"] = "⚠️ Avviso scadenza certificati SSL"
+                msg["From"] = sender
+                msg["To"] = recipient
+                try:
+                    server.sendmail(sender, [recipient], msg.as_string())
+                except smtplib.SMTPRecipientsRefused as e:
+                    code = e.recipients.get(recipient, (550,))[0]
+                    print(f"❌ Destinatario rifiutato ({code}): {recipient}")
+                    if 400 <= code < 500:
+                        # Rifiuto temporaneo (es. greylisting): da ritentare
+                        failed.append(recipient)
+                except smtplib.SMTPServerDisconnected as e:
+                    # Connessione persa: tutti i destinatari rimanenti vanno ritentati
+                    print(f"❌ Connessione SMTP persa inviando a {recipient}: {e}")
+                    failed += recipients[i:]
+                    break
+                except smtplib.SMTPException as e:
+                    print(f"❌ Errore nell'invio dell'email a {recipient}: {e}")
+                    failed.append(recipient)
+                except OSError as e:
+                    print(f"❌ Connessione SMTP persa inviando a {recipient}: {e}")
+                    failed += recipients[i:]
+                    break
+    except (smtplib.SMTPException, OSError) as e:
+        print(f"❌ Errore di connessione SMTP: {e}")
+        return list(recipients)
+    return failed
+
+
+class NotificationQueue:
+    """
+    Notifiche in background, fuori dal percorso delle richieste HTTP e
+    dal loop di scansione:
+
+    - `submit` accoda i risultati e ritorna subito;
+    - un thread worker raggruppa ciò che arriva in `batch_seconds` e
+      invia una sola email; ogni giro accodato è lo stato completo (di
+      norma i soli endpoint in alert), quindi conta l'ultimo: un endpoint
+      rientrato nel frattempo non viene notificato;
+    - la deduplicazione è per destinatario, endpoint e livello di alert
+      (warning, critical, expired): lo stesso avviso si ripete solo dopo
+      `repeat_hours`, mentre un peggioramento di livello viene inviato
+      subito. Chi ha ricevuto l'email è segnato anche se altri no;
+    - una sola connessione SMTP per batch, riusata per tutti i
+      destinatari con gli stessi avvisi; gli invii falliti vengono
+      ritentati con backoff esponenziale, solo verso i destinatari
+      mancanti. L'attesa del retry non blocca la coda: un nuovo giro
+      accodato nel frattempo viene gestito subito (e sostituisce il retry).
+    """
+
+    def __init__(self, send=send_batch):
+        self.send = send
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def submit(self, results, config_path="app/config.json"):
+        """Accoda un giro di risultati da valutare (non bloccante)."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="ssl-monitor-notifier", daemon=True)
+                self._thread.start()
+            self._queue.put((list(results), config_path))
+
+    def join(self):
+        """Attende che tutto ciò che è stato accodato sia stato gestito."""
+        self._queue.join()
+
+    def close(self, timeout=None):
+        """Ferma il worker (interrompe anche l'attesa dei retry)."""
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return
+            self._stop.set()
+            self._queue.put(None)
+        thread.join(timeout)
+
+    def _run(self):
+        retry = None  # (risultati, config_path, tentativi già fatti, scadenza monotonic)
+        while not self._stop.is_set():
+            timeout = None if retry is None else max(0.0, retry[3] - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # Scaduto il backoff: si ritenta l'ultimo giro verso chi manca
+                latest, config_path, attempt, _ = retry
+                taken = 0
+            else:
+                if item is None:
+                    self._queue.task_done()
+                    break
+                (latest, config_path), attempt, taken = item, 0, 1
+            retry = None
+
+            try:
+                settings = self._settings(config_path)
+                # ⏳ Raccoglie quanto arriva nella finestra di batch
+                deadline = time.monotonic() + (settings["batch_seconds"] if taken else 0)
+                while (remaining := deadline - time.monotonic()) > 0:
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    taken += 1
+                    if item is None:
+                        self._stop.set()
+                        break
+                    latest = item[0]
+
+                if self._process(latest, settings):
+                    if attempt < settings["max_retries"]:
+                        delay = settings["retry_backoff"] * 2 ** attempt
+                        print(f"🔁 Nuovo tentativo di invio tra {delay}s")
+                        retry = (latest, config_path, attempt + 1, time.monotonic() + delay)
+                    else:
+                        print("❌ Tentativi esauriti: gli avvisi verranno ripresentati al prossimo giro")
+            except Exception as e:
+                print(f"❌ Errore nelle notifiche: {e}")
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+    @staticmethod
+    def _settings(config_path):
+        return notification_settings(load_config(config_path))
+
+    def _process(self, results, settings):
+        """
+        Invia a ogni destinatario gli avvisi che non ha ancora ricevuto.
+        Ritorna i destinatari per cui l'invio è fallito (da ritentare).
+        """
+        email_conf = settings["email"]
+        if not email_conf.get("enabled", False):
+            print("ℹ️  Email notifications are disabled.")
+            return []
+
+        sent = _load_state(settings["state_file"])
+        now = time.time()
+        repeat = settings["repeat_hours"] * 3600
+
+        due = {}  # destinatario -> [(risultato, livello)] ancora da inviargli
+        for r in results:
+            level = alert_level(r, settings["critical_days"])
+            if level is None:
+                continue
+            for recipient in email_conf["to"]:
+                if now - sent.get(dedup_key(r, level, recipient), 0) >= repeat:
+                    due.setdefault(recipient, []).append((r, level))
+
+        if not due:
+            print("✅ Nessun nuovo certificato in scadenza da notificare.")
+            return []
+
+        # Destinatari con gli stessi avvisi: stessa email, stessa connessione
+        groups = {}
+        for recipient, alerts in due.items():
+            signature = tuple(dedup_key(r, level, "") for r, level in alerts)
+            groups.setdefault(signature, (alerts, []))[1].append(recipient)
+
+        failed = []
+        for alerts, recipients in groups.values():
+            missed = self.send(email_conf, render_email(alerts), recipients)
+            failed += missed
+            for recipient in recipients:
+                if recipient not in missed:
+                    for r, level in alerts:
+                        sent[dedup_key(r, level, recipient)] = now
+        _save_state(settings["state_file"], sent, now - repeat)
+
+        if failed:
+            print(f"❌ Email non consegnata a: {', '.join(failed)}")
+        else:
+            print(f"✅ Email HTML inviata con successo! ({len(due)} destinatari)")
+        return failed
+
+
+def _load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(path, sent, oldest):
+    # Le voci oltre la finestra di ripetizione non servono più
+    sent = {key: ts for key, ts in sent.items() if ts >= oldest}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(sent, f)
+    os.replace(tmp_path, path)
+
+
+# 📬 Coda condivisa dal processo
+NOTIFICATIONS = NotificationQueue()
+
+
+def notify(results, config_path="app/config.json"):
+    """Accoda i risultati per le notifiche; l'invio avviene in background."""
+    NOTIFICATIONS.submit(results, config_path)
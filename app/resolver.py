@@ -0,0 +1,193 @@
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+from concurrent.futures import Future
+
+DEFAULT_TTL = 300           # secondi di validità di una risposta DNS
+DEFAULT_NEGATIVE_TTL = 30   # secondi di validità di un errore DNS (negative caching)
+PURGE_THRESHOLD = 10000     # oltre questa dimensione si eliminano le voci scadute
+
+
+def dns_settings(config):
+    """Legge la sezione "dns" del config."""
+    dns_conf = config.get("dns", {})
+    return {
+        "ttl": dns_conf.get("ttl_seconds", DEFAULT_TTL),
+        "negative_ttl": dns_conf.get("negative_ttl_seconds", DEFAULT_NEGATIVE_TTL),
+    }
+
+
+def system_resolver(host):
+    """Resolver di sistema: addrinfo di `host` senza porta."""
+    return socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+
+
+def _literal_addrinfo(host):
+    """addrinfo di un indirizzo IP letterale, oppure None se `host` è un nome."""
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    if address.version == 6:
+        return [(socket.AF_INET6, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (host, 0, 0, 0))]
+    return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (host, 0))]
+
+
+def _with_port(info, port):
+    family, socktype, proto, canonname, sockaddr = info
+    return family, socktype, proto, canonname, (sockaddr[0], port) + tuple(sockaddr[2:])
+
+
+def connect(infos, timeout):
+    """
+    Come `socket.create_connection`, ma sugli addrinfo già risolti: prova
+    gli indirizzi in ordine (es. IPv6 irraggiungibile e poi IPv4) e
+    rilancia l'errore dell'ultimo. Ritorna (connessione, addrinfo usato).
+    """
+    error = None
+    for info in infos:
+        family, socktype, proto, _, sockaddr = info
+        conn = socket.socket(family, socktype, proto)
+        conn.settimeout(timeout)
+        try:
+            conn.connect(sockaddr)
+            return conn, info
+        except OSError as e:
+            conn.close()
+            error = e
+    raise error or socket.gaierror(socket.EAI_NONAME, "Nessun indirizzo")
+
+
+class DnsCache:
+    """
+    Cache DNS in-process con TTL e negative caching.
+
+    Le risposte sono indicizzate per nome host (senza porta), quindi tutte
+    le porte dello stesso host condividono una sola risoluzione. Richieste
+    concorrenti per lo stesso host aspettano la risoluzione già in corso.
+    Gli indirizzi IP letterali non passano dal resolver né dalla cache.
+
+    `resolver(host)` ritorna una lista di addrinfo (default: getaddrinfo).
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, resolver=None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.resolver = resolver or system_resolver
+        self.lookups = 0    # risoluzioni effettive
+        self.hits = 0       # risposte servite dalla cache (anche negative)
+        self._lock = threading.Lock()
+        self._entries = {}  # host -> (scadenza monotonic, addrinfo | None, errore | None)
+        self._inflight = {}  # host -> Future della risoluzione in corso
+
+    def configure(self, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def _cached(self, host, now, count=True):
+        entry = self._entries.get(host)
+        if entry is not None and entry[0] > now:
+            if count:
+                self.hits += 1
+            return entry
+        return None
+
+    def lookup(self, host):
+        """
+        Ritorna (lista addrinfo, ms effettivamente attesi dal chiamante):
+        la durata della risoluzione per chi la esegue o la aspetta, circa
+        zero per una risposta già in cache.
+        Solleva OSError (anche da cache negativa) se il nome non si risolve.
+        """
+        literal = _literal_addrinfo(host)
+        if literal is not None:
+            return literal, 0.0
+
+        start = time.perf_counter()
+        with self._lock:
+            entry = self._cached(host, time.monotonic())
+            if entry is None:
+                future = self._inflight.get(host)
+                leader = future is None
+                if leader:
+                    future = self._inflight[host] = Future()
+
+        if entry is None:
+            if not leader:
+                entry = future.result()
+            else:
+                entry = self._resolve(host, future)
+
+        _, infos, error = entry
+        if error is not None:
+            # Copia: rilanciare sempre la stessa istanza allungherebbe il suo traceback
+            raise type(error)(*error.args)
+        return infos, (time.perf_counter() - start) * 1000
+
+    def _resolve(self, host, future):
+        try:
+            infos, error = self.resolver(host), None
+            ttl = self.ttl
+        except Exception as e:
+            # Qualsiasi errore del resolver diventa un errore DNS in cache negativa
+            infos = None
+            error = e if isinstance(e, OSError) else socket.gaierror(socket.EAI_FAIL, str(e))
+            ttl = self.negative_ttl
+
+        entry = (time.monotonic() + ttl, infos, error)
+        with self._lock:
+            self.lookups += 1
+            self._entries[host] = entry
+            del self._inflight[host]
+            if len(self._entries) > PURGE_THRESHOLD:
+                now = time.monotonic()
+                self._entries = {h: e for h, e in self._entries.items() if e[0] > now}
+        future.set_result(entry)
+        return entry
+
+    def resolve(self, host, port):
+        """
+        Tutti gli addrinfo di host:port (nell'ordine del resolver, da
+        provare uno dopo l'altro con `connect`) e ms attesi per la risoluzione.
+        """
+        infos, elapsed_ms = self.lookup(host)
+        if not infos:
+            raise socket.gaierror(socket.EAI_NONAME, f"Nessun indirizzo per {host}")
+        return [_with_port(info, port) for info in dict.fromkeys(infos)], elapsed_ms
+
+    def addresses(self, host):
+        """Tutti gli indirizzi (senza duplicati) di `host`."""
+        infos, _ = self.lookup(host)
+        return list(dict.fromkeys(info[4][0] for info in infos))
+
+    async def aresolve(self, host):
+        """
+        Versione non bloccante per lo scanner: se la risposta è in cache non
+        lascia l'event loop, altrimenti risolve in un thread. Gli errori
+        restano in cache negativa e vengono riportati dalla probe.
+        """
+        if _literal_addrinfo(host) is not None:
+            return
+        with self._lock:
+            if self._cached(host, time.monotonic(), count=False) is not None:
+                return
+        try:
+            await asyncio.to_thread(self.lookup, host)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "lookups": self.lookups, "hits": self.hits}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.lookups = 0
+            self.hits = 0
+
+
+# 🌐 Cache condivisa da probe, scanner ed espansione dei target
+DNS_CACHE = DnsCache()
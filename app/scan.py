@@ -0,0 +1,174 @@
+"""
+Scansione da riga di comando, senza FastAPI né openpyxl.
+
+Legge i target dal config oppure da stdin e scrive un risultato per
+endpoint appena la sua probe termina (ordine di completamento).
+
+Uso: python -m app.scan [--config app/config.json] [-] [--format ndjson|csv|text]
+                        [--concurrency N] [--per-host N] [--timeout S]
+                        [--fail-on alert|error]
+
+Con `-` i target arrivano da stdin, uno per riga: "host", "host:porta"
+(anche liste e range, es. "host:443,8443") oppure un oggetto JSON con
+le stesse chiavi delle entry di "domains". Le righe vuote e quelle che
+iniziano con "#" vengono ignorate. Le impostazioni (timeout, DNS, chain...)
+vengono comunque dal config, se esiste.
+
+Codice di uscita: 0, oppure 1 se `--fail-on` trova endpoint in alert o
+in errore, 2 per argomenti o target non validi.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+
+# Import leggeri qui; checker e compagnia solo dopo il parsing degli argomenti
+FORMATS = ("ndjson", "csv", "text")
+CSV_FIELDS = ("service", "domain", "port", "protocol", "expires", "days_left",
+              "alert", "issuer", "chain_status", "starttls", "error")
+
+
+def parse_target(line, index=0):
+    """Una riga di stdin come entry di "domains" (dict validato)."""
+    from .config import DomainEntry
+
+    line = line.strip()
+    if line.startswith("{"):
+        data = json.loads(line)
+    else:
+        host, sep, ports = line.rpartition(":")
+        if not sep or host.endswith(":"):
+            # Nessuna porta (o IPv6 senza parentesi): porta di default
+            data = {"url": line}
+        else:
+            data = {"url": host.strip("[]"), "port": int(ports) if ports.isdigit() else ports}
+    return DomainEntry.from_dict(data, index).as_dict()
+
+
+def read_targets(stream):
+    entries = []
+    for index, line in enumerate(stream):
+        if line.strip() and not line.lstrip().startswith("#"):
+            entries.append(parse_target(line, index))
+    return entries
+
+
+def _load(config_path):
+    from .config import Config, load_config
+
+    if os.path.exists(config_path):
+        return load_config(config_path)
+    # Senza config (target da stdin): valori di default ovunque
+    return Config.parse(config_path, '{"domains": []}')
+
+
+def _formatter(fmt, out):
+    if fmt == "ndjson":
+        def write(r):
+            out.write(json.dumps(r, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+        return write
+
+    if fmt == "csv":
+        import csv
+
+        writer = csv.DictWriter(out, CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+
+        def write(r):
+            writer.writerow(r)
+            out.flush()
+        return write
+
+    def write(r):
+        where = f"{r['domain']}:{r.get('port')}"
+        if "error" in r:
+            out.write(f"❌ {where:<40} {r.get('protocol')}: {r['error']}\n")
+        else:
+            mark = "⚠️ " if r.get("alert") else "✅"
+            out.write(f"{mark} {where:<40} {r['protocol']} scade {r['expires']} ({r['days_left']} giorni)\n")
+        out.flush()
+    return write
+
+
+async def run(entries, probe, settings, write):
+    """Scrive i risultati man mano che arrivano; ritorna (in alert, in errore)."""
+    from .scanner import iter_scan
+
+    alerts = errors = 0
+    async for r in iter_scan(entries, probe, settings["concurrency"], settings["per_host"]):
+        write(r)
+        if "error" in r:
+            errors += 1
+        elif r.get("alert"):
+            alerts += 1
+    return alerts, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.scan",
+                                     description="Scansione dei certificati con output in streaming.")
+    parser.add_argument("targets", nargs="?", help="'-' per leggere i target da stdin")
+    parser.add_argument("--config", default=os.environ.get("SSL_MONITOR_CONFIG", "app/config.json"))
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--concurrency", type=int, help="probe contemporanee (default: dal config)")
+    parser.add_argument("--per-host", type=int, help="probe contemporanee per host (default: dal config)")
+    parser.add_argument("--timeout", type=float, help="timeout per probe in secondi (default: dal config)")
+    parser.add_argument("--fail-on", choices=("alert", "error"),
+                        help="esce con 1 se ci sono endpoint in alert (o anche solo in errore)")
+    args = parser.parse_args(argv)
+    if args.targets not in (None, "-"):
+        parser.error("l'unico argomento posizionale ammesso è '-' (target da stdin)")
+
+    from functools import partial
+
+    from .checker import configure_probes, probe_entry, probe_settings
+    from .scanner import scan_settings
+    from .targets import iter_targets
+
+    try:
+        config = _load(args.config)
+        entries = read_targets(sys.stdin) if args.targets == "-" else config.entries()
+    except (OSError, ValueError) as e:
+        # ConfigError e JSON non valido sono entrambi ValueError
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+
+    settings = scan_settings(config)
+    if args.concurrency:
+        settings["concurrency"] = max(1, args.concurrency)
+    if args.per_host:
+        settings["per_host"] = max(1, args.per_host)
+    probes = probe_settings(config)
+    if args.timeout:
+        probes["health"]["timeout"] = args.timeout
+    configure_probes(probes)
+    probe = partial(probe_entry, default_alert_days=config.get("notify_before_days", 15))
+
+    out = sys.stdout
+    write = _formatter(args.format, out)
+    try:
+        # I messaggi diagnostici delle probe vanno su stderr: stdout resta solo dati
+        with contextlib.redirect_stdout(sys.stderr):
+            alerts, errors = asyncio.run(run(iter_targets(entries), probe, settings, write))
+    except ValueError as e:
+        # Target non espandibili (porte o reti non valide)
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+    except (KeyboardInterrupt, BrokenPipeError):
+        return 1
+    finally:
+        with contextlib.suppress(BrokenPipeError):
+            out.flush()
+
+    if args.fail_on == "error" and (alerts or errors):
+        return 1
+    if args.fail_on == "alert" and alerts:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+import asyncio
+import collections
+import itertools
+import multiprocessing
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .metrics import METRICS
+from .resolver import DNS_CACHE
+
+DEFAULT_CONCURRENCY = 50       # probe contemporanee in totale (per processo)
+DEFAULT_PER_HOST = 4           # probe contemporanee verso lo stesso host
+DEFAULT_WORKERS = 1            # processi di scansione (1 = nessun process pool)
+DEFAULT_SHARD_SIZE = 256       # entry per shard in modalità multi-processo
+LOOKAHEAD = 4                  # entry in volo per slot di concorrenza (oltre il limite per host)
+
+_DONE = object()
+
+
+def scan_settings(config):
+    """Legge i limiti di concorrenza dalla sezione "scan" del config."""
+    scan_conf = config.get("scan", {})
+    return {
+        "concurrency": max(1, int(scan_conf.get("concurrency", DEFAULT_CONCURRENCY))),
+        "per_host": max(1, int(scan_conf.get("per_host_concurrency", DEFAULT_PER_HOST))),
+        "workers": max(1, int(scan_conf.get("workers", DEFAULT_WORKERS))),
+        "shard_size": max(1, int(scan_conf.get("shard_size", DEFAULT_SHARD_SIZE))),
+    }
+
+
+class _HostLimiter:
+    """
+    Slot per host senza attese: un worker che trova l'host già al limite
+    parcheggia la entry e passa alla successiva, invece di restare fermo
+    occupando uno dei `concurrency` slot (head-of-line blocking sulle porte
+    dello stesso host, che `targets` espande una dopo l'altra). La entry
+    parcheggiata la riprende chi libera lo slot di quell'host.
+
+    Lo stato per host esiste solo finché l'host ha probe in corso, così
+    una sweep su una /16 non accumula 65k voci.
+    """
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self._slots = {}  # host -> [probe in corso, deque di entry parcheggiate]
+
+    def acquire(self, host, item):
+        """True se c'è uno slot libero per `host`, altrimenti parcheggia `item`."""
+        slot = self._slots.get(host)
+        if slot is None:
+            slot = self._slots[host] = [0, collections.deque()]
+        if slot[0] < self.per_host:
+            slot[0] += 1
+            return True
+        slot[1].append(item)
+        return False
+
+    def release(self, host):
+        """Libera lo slot, oppure lo passa alla prossima entry parcheggiata (che ritorna)."""
+        slot = self._slots[host]
+        if slot[1]:
+            return slot[1].popleft()
+        slot[0] -= 1
+        if slot[0] == 0:
+            del self._slots[host]
+        return None
+
+
+def _take(iterator, count):
+    return list(itertools.islice(iterator, count))
+
+
+async def _pump(entries, probe, concurrency, per_host, emit):
+    """
+    Motore comune: `concurrency` worker prelevano le entry da una coda
+    limitata, alimentata a blocchi dall'iteratore `entries`.
+
+    Le entry non vengono mai materializzate tutte: l'iteratore (che può
+    espandere CIDR o fare DNS, vedi `targets`) avanza nel thread pool di
+    default solo quando c'è posto, e al massimo `concurrency * LOOKAHEAD`
+    entry sono in volo (in coda, parcheggiate per il limite per host o in
+    probe). Per ogni probe terminata viene atteso `emit(indice, risultato)`.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    window = asyncio.Semaphore(concurrency * LOOKAHEAD)
+    hosts = _HostLimiter(per_host)
+    iterator = iter(entries)
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def produce():
+        index = 0
+        while True:
+            batch = await loop.run_in_executor(None, _take, iterator, concurrency)
+            if not batch:
+                break
+            for entry in batch:
+                await window.acquire()
+                await queue.put((index, entry))
+                index += 1
+        for _ in range(concurrency):
+            await queue.put(_DONE)
+
+    async def work():
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            host = item[1].get("url")
+            # Risoluzione non bloccante e deduplicata tra le porte dello
+            # stesso host: la probe troverà la risposta in cache
+            await DNS_CACHE.aresolve(host)
+            # Host al limite: la entry resta a chi ha lo slot, il worker va avanti
+            if not hosts.acquire(host, item):
+                continue
+            while item is not None:
+                index, entry = item
+                try:
+                    result = await loop.run_in_executor(pool, probe, entry)
+                finally:
+                    window.release()
+                await emit(index, result)
+                item = hosts.release(host)
+
+    tasks = [asyncio.ensure_future(produce())]
+    tasks += [asyncio.ensure_future(work()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # Su errore o annullamento nessun worker deve restare appeso alla coda
+        for task in tasks:
+            task.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def scan_entries(entries, probe, concurrency=DEFAULT_CONCURRENCY,
+                       per_host=DEFAULT_PER_HOST):
+    """
+    Esegue `probe(entry)` su tutte le entry in parallelo.
+
+    Le probe sono bloccanti (socket + handshake), quindi girano in un
+    thread pool dimensionato su `concurrency`; un limite per host evita
+    di martellare lo stesso server. `entries` può essere un generatore.
+    Ritorna i risultati nello stesso ordine delle entry.
+    """
+    results = {}
+
+    async def collect(index, result):
+        results[index] = result
+
+    await _pump(entries, probe, concurrency, per_host, collect)
+    return [results[i] for i in range(len(results))]
+
+
+async def iter_scan(entries, probe, concurrency=DEFAULT_CONCURRENCY,
+                    per_host=DEFAULT_PER_HOST):
+    """
+    Come `scan_entries`, ma produce ogni risultato appena la sua probe
+    termina (ordine di completamento, non delle entry).
+
+    La coda di uscita è limitata: se il consumer è lento la scansione
+    rallenta invece di accumulare risultati (memoria costante anche su
+    sweep molto grandi). Se il consumer smette di leggere, la scansione
+    viene annullata.
+    """
+    out = asyncio.Queue(maxsize=concurrency)
+
+    async def emit(index, result):
+        await out.put(result)
+
+    async def run():
+        try:
+            await _pump(entries, probe, concurrency, per_host, emit)
+        except BaseException:
+            # Il consumer deve comunque uscire dal loop: se la coda è piena
+            # si sacrifica un risultato (la scansione è fallita comunque)
+            if out.full():
+                out.get_nowait()
+            out.put_nowait(_DONE)
+            raise
+        await out.put(_DONE)
+
+    task = asyncio.ensure_future(run())
+    try:
+        while True:
+            result = await out.get()
+            if result is _DONE:
+                break
+            yield result
+        await task  # propaga eventuali errori della scansione
+    finally:
+        task.cancel()
+
+
+def run_scan(entries, probe, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST):
+    """Wrapper sincrono di `scan_entries` per chi non gira in un event loop."""
+    return asyncio.run(scan_entries(entries, probe, concurrency, per_host))
+
+
+def host_worker(host, workers):
+    """Worker che scansiona sempre `host`: hash stabile, non randomizzato per processo."""
+    return zlib.crc32(str(host).encode()) % workers
+
+
+def make_shards(entries, workers, shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Divide le entry in shard per worker secondo l'hash dell'host, senza
+    materializzare l'intero iteratore: tutte le porte di un host vanno
+    sempre allo stesso processo, che applica da solo il limite per host
+    e ne conserva lo stato (health, DNS, certificati) tra una scansione
+    e l'altra. Produce (worker, lista di coppie (indice originale, entry)).
+    """
+    buckets = [[] for _ in range(workers)]
+    for index, entry in enumerate(entries):
+        worker = host_worker(entry.get("url"), workers)
+        buckets[worker].append((index, entry))
+        if len(buckets[worker]) >= shard_size:
+            yield worker, buckets[worker]
+            buckets[worker] = []
+    for worker, shard in enumerate(buckets):
+        if shard:
+            yield worker, shard
+
+
+def _run_shard(shard, probe, concurrency, per_host):
+    """
+    Eseguito nel processo worker: loop di probe concorrente sul proprio
+    shard. Ritorna anche le metriche delle probe, da unire nel padre.
+    """
+    indexes = [index for index, _ in shard]
+    results = run_scan([entry for _, entry in shard], probe, concurrency, per_host)
+    return list(zip(indexes, results)), METRICS.drain()
+
+
+def _collect(results, future):
+    shard_results, metrics = future.result()
+    results.update(shard_results)
+    METRICS.merge(metrics)
+
+
+_pools = []                     # un executor a processo singolo per worker
+_pools_lock = threading.Lock()
+
+
+def _worker_pools(workers):
+    """
+    Executor dei worker, creati una volta e riusati da tutte le scansioni:
+    un processo per worker, così `host_worker` manda ogni host sempre
+    nello stesso processo. Cambiando `workers` vengono ricreati.
+    """
+    global _pools
+    with _pools_lock:
+        if len(_pools) != workers:
+            old, _pools = _pools, []
+            for pool in old:
+                pool.shutdown(wait=False, cancel_futures=True)
+            # spawn: i worker non ereditano thread e socket del processo padre (es. l'app web)
+            ctx = multiprocessing.get_context("spawn")
+            _pools = [ProcessPoolExecutor(max_workers=1, mp_context=ctx) for _ in range(workers)]
+        return list(_pools)
+
+
+def shutdown_workers():
+    """Chiude i processi worker (all'uscita dell'app)."""
+    global _pools
+    with _pools_lock:
+        old, _pools = _pools, []
+    for pool in old:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_sharded(entries, probe, workers=DEFAULT_WORKERS, shard_size=DEFAULT_SHARD_SIZE,
+                concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST):
+    """
+    Scansione multi-processo: gli shard vengono distribuiti su `workers`
+    processi a vita lunga, ognuno con il proprio loop concorrente
+    (`concurrency` e `per_host` valgono per processo). Al massimo
+    `2 * workers` shard sono in attesa alla volta, così l'iteratore delle
+    entry avanza solo quando serve. `probe` deve essere picklable
+    (funzione di modulo o functools.partial).
+    Ritorna i risultati nello stesso ordine delle entry.
+    """
+    if workers <= 1:
+        return run_scan(entries, probe, concurrency, per_host)
+
+    pools = _worker_pools(workers)
+    results = {}
+    try:
+        pending = []
+        for worker, shard in make_shards(entries, workers, shard_size):
+            pending.append(pools[worker].submit(_run_shard, shard, probe, concurrency, per_host))
+            if len(pending) >= 2 * workers:
+                _collect(results, pending.pop(0))
+        for future in pending:
+            _collect(results, future)
+    except BrokenProcessPool:
+        # Un worker è morto: i processi vengono ricreati alla prossima scansione
+        shutdown_workers()
+        raise
+    return [results[i] for i in range(len(results))]
@@ -1,21 +1,329 @@
-import time
+import asyncio
 import datetime
-from .checker import check_domains
+import heapq
+import random
+import time
+from functools import partial
+
+from .checker import configure_probes, probe_entry, probe_settings
+from .config import diff_configs, load_config
 from .notifier import notify
+from .scanner import run_sharded, scan_entries, scan_settings
+from .targets import iter_endpoints, iter_targets, make_target
+
+DEFAULT_INTERVAL = 3600          # intervallo minimo tra due controlli dello stesso endpoint
+DEFAULT_MAX_INTERVAL = 86400     # intervallo massimo per certificati lontani dalla scadenza
+DEFAULT_ALERT_INTERVAL = 1800    # certificati già in finestra di alert
+DEFAULT_ERROR_INTERVAL = 900     # endpoint in errore (non sospesi)
+DEFAULT_JITTER = 60              # ritardo casuale massimo aggiunto a ogni intervallo
+RELOAD_CHECK = 5                 # secondi massimi tra due controlli del config
+
+
+def entry_key(entry):
+    return (entry.get("url"), entry.get("port", 443))
+
+
+def schedule_settings(config):
+    """Legge dalla sezione "scan" gli intervalli della scansione incrementale."""
+    scan_conf = config.get("scan", {})
+    return {
+        "interval": scan_conf.get("interval_seconds", DEFAULT_INTERVAL),
+        "max_interval": scan_conf.get("max_interval_seconds", DEFAULT_MAX_INTERVAL),
+        "alert_interval": scan_conf.get("alert_interval_seconds", DEFAULT_ALERT_INTERVAL),
+        "error_interval": scan_conf.get("error_interval_seconds", DEFAULT_ERROR_INTERVAL),
+        "jitter": scan_conf.get("jitter_seconds", DEFAULT_JITTER),
+        "default_alert_days": config.get("notify_before_days", 15),
+    }
+
+
+def next_check_delay(result, entry, settings, now=None):
+    """
+    Secondi da attendere prima di ricontrollare un endpoint, dato il suo
+    ultimo risultato:
+    - `check_interval` nella entry vince sempre;
+    - endpoint sospesi dal circuit breaker: alla fine della sospensione;
+    - endpoint in errore: `error_interval`;
+    - certificati in finestra di alert: `alert_interval`;
+    - altrimenti metà del tempo che manca all'ingresso nella finestra di
+      alert, tra `interval` e `max_interval`: un certificato a 300 giorni
+      si controlla di rado, uno a 20 giorni quasi ogni ora.
+    """
+    if "check_interval" in entry:
+        return entry["check_interval"]
+
+    if result is None:
+        return settings["error_interval"]
+
+    if result.get("suppressed_until"):
+        until = datetime.datetime.fromisoformat(result["suppressed_until"]).timestamp()
+        return max(0.0, until - (now or time.time()))
+
+    if "error" in result:
+        return settings["error_interval"]
+
+    if result.get("alert"):
+        return settings["alert_interval"]
+
+    alert_days = entry.get("alert_days", settings["default_alert_days"])
+    until_alert = (result.get("days_left", 0) - alert_days) * 86400
+    return min(settings["max_interval"], max(settings["interval"], until_alert / 2))
+
+
+def due_entries(entries, state, settings, now=None):
+    """
+    Entry da controllare adesso: mai controllate, oppure il cui ultimo
+    controllo (`state`: chiave -> (risultato, timestamp)) è scaduto.
+    """
+    now = now or time.time()
+    for entry in entries:
+        last = state.get(entry_key(entry))
+        if last is None:
+            yield entry
+            continue
+        result, checked_at = last
+        if checked_at + next_check_delay(result, entry, settings, now) <= now:
+            yield entry
+
+
+def incremental_scan(config_path, store):
+    """
+    Scansione incrementale sincrona: controlla solo gli endpoint scaduti
+    secondo `next_check_delay`, partendo dall'ultimo stato nello store.
+    Ritorna (risultati nuovi, chiavi di tutti i target del config).
+
+    I target vengono espansi pigramente mentre lo scanner avanza: in
+    memoria restano solo le chiavi (domain, port), non le entry.
+    """
+    config = load_config(config_path)
+    settings = scan_settings(config)
+    schedule = schedule_settings(config)
+    configure_probes(probe_settings(config))
+
+    keys = set()
+
+    def expand():
+        for target in iter_targets(config.entries()):
+            keys.add(entry_key(target))
+            yield target
+
+    due = due_entries(expand(), store.latest_state(), schedule)
+    probe = partial(probe_entry, default_alert_days=schedule["default_alert_days"])
+    fresh = run_sharded(
+        due, probe, settings["workers"], settings["shard_size"],
+        settings["concurrency"], settings["per_host"],
+    )
+    return fresh, keys
+
+
+class RefreshScheduler:
+    """
+    Refresh in background dei certificati, dentro il ciclo di vita dell'app.
+
+    Ogni endpoint ha la propria scadenza, calcolata dall'ultimo risultato
+    con `next_check_delay` (o `check_interval` nella entry), più un jitter
+    casuale per non riscansionare tutto nello stesso istante. A ogni giro
+    vengono controllati solo gli endpoint scaduti e i risultati finiscono
+    nella cache condivisa, da cui leggono dashboard ed export senza mai
+    aspettare la rete. All'avvio le scadenze ripartono dall'ultimo stato
+    salvato nello store, se presente.
+
+    Il config viene ricaricato a caldo quando il file cambia: gli endpoint
+    aggiunti o modificati vengono controllati subito, quelli rimossi
+    escono da coda, cache e store; gli altri mantengono la loro scadenza.
+
+    Per endpoint restano in memoria solo la chiave, la scadenza e un
+    riferimento alla entry del config da cui proviene (condivisa da tutti
+    i suoi indirizzi e porte): il dict del target viene costruito solo
+    quando l'endpoint è da controllare.
+    """
+
+    def __init__(self, cache, config_path="app/config.json"):
+        self.cache = cache
+        self.config_path = config_path
+        self._heap = []          # (scadenza monotonic, seq, chiave)
+        self._entries = {}       # chiave -> (entry del config, hostname del fan-out o None)
+        self._current = {}       # chiave -> seq dell'unica voce valida nel heap
+        self._config = None
+        self._seq = 0
+        self._loop = None
+        self._wakeup = None
+
+    def _apply_settings(self, config):
+        self._config = config
+        self.settings = scan_settings(config)
+        self.schedule = schedule_settings(config)
+        self.default_alert_days = self.schedule["default_alert_days"]
+        configure_probes(probe_settings(config))
+
+    def _load(self):
+        config = load_config(self.config_path)
+        self._apply_settings(config)
+        self._entries = self._expand(config)
+
+        # Scadenze dall'ultimo stato salvato; gli endpoint mai visti subito
+        state = self.cache.store.latest_state() if self.cache.store is not None else {}
+        self._heap = []
+        self._current = {}
+        now, wall_now = time.monotonic(), time.time()
+        for key, (entry, _) in self._entries.items():
+            due = now
+            if key in state:
+                result, checked_at = state[key]
+                delay = next_check_delay(result, entry, self.schedule, wall_now)
+                due = now + max(0.0, checked_at + delay - wall_now)
+            self._push(key, due)
+
+    @staticmethod
+    def _expand(config):
+        """Chiave di ogni endpoint del config -> (entry del config, hostname), senza copiare le entry."""
+        return {(host, port): (entry, hostname)
+                for entry, host, port, hostname in iter_endpoints(config.entries())}
+
+    def _push(self, key, due):
+        # Una nuova scadenza sostituisce quella già in coda per la stessa chiave
+        self._seq += 1
+        self._current[key] = self._seq
+        heapq.heappush(self._heap, (due, self._seq, key))
+
+    def _prepare_reload(self):
+        """
+        (Thread) Se il config è cambiato ritorna (config, entry, chiavi da
+        controllare subito), altrimenti None. Espande solo le entry
+        aggiunte o modificate per trovare le chiavi urgenti.
+        """
+        config = load_config(self.config_path)
+        if config is self._config:
+            return None
+        diff = diff_configs(self._config, config)
+        entries = self._expand(config)
+        touched = [d.as_dict() for d in diff.added + diff.changed]
+        urgent = {(host, port) for _, host, port, _ in iter_endpoints(touched)}
+        return config, entries, urgent
+
+    async def reload(self):
+        """Applica un eventuale cambio del config; ritorna True se è cambiato."""
+        prepared = await asyncio.to_thread(self._prepare_reload)
+        if prepared is None:
+            return False
+        config, entries, urgent = prepared
+        self._apply_settings(config)
+        removed = self._entries.keys() - entries.keys()
+        self._entries = entries
+        for key in removed:
+            self._current.pop(key, None)
+
+        now = time.monotonic()
+        for key in entries:
+            if key in urgent or key not in self._current:
+                self._push(key, now)
+        if removed:
+            await asyncio.to_thread(self.cache.update, [], set(entries))
+        return True
+
+    def next_due(self, entry, result, now):
+        """Scadenza del prossimo controllo per una entry appena controllata."""
+        delay = next_check_delay(result, entry, self.schedule)
+        return now + delay + random.uniform(0, self.schedule["jitter"])
+
+    def trigger(self):
+        """Anticipa il controllo di tutti gli endpoint (thread-safe)."""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._trigger_now)
+
+    def _trigger_now(self):
+        now = time.monotonic()
+        self._heap = []
+        self._current = {}
+        for key in self._entries:
+            self._push(key, now)
+        self._wakeup.set()
+
+    def _pop_due(self, now):
+        """Chiavi degli endpoint scaduti, tolte dalla coda."""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self._heap)
+            if key in self._entries and self._current.get(key) == seq:
+                del self._current[key]
+                due.append(key)
+        return due
+
+    def _targets(self, keys):
+        """Target da probare per le chiavi date, costruiti man mano che lo scanner li chiede."""
+        for key in keys:
+            entry, hostname = self._entries[key]
+            yield make_target(entry, *key, hostname)
+
+    async def run_once(self):
+        """Controlla gli endpoint scaduti; ritorna quanti ne ha controllati."""
+        due = self._pop_due(time.monotonic())
+        if not due:
+            return 0
+
+        results = [None] * len(due)
+        try:
+            probe = partial(probe_entry, default_alert_days=self.default_alert_days)
+            if self.settings["workers"] > 1:
+                # Inventari grandi: shard su più processi, senza bloccare il loop
+                results = await asyncio.to_thread(
+                    run_sharded, self._targets(due), probe, self.settings["workers"],
+                    self.settings["shard_size"], self.settings["concurrency"],
+                    self.settings["per_host"],
+                )
+            else:
+                results = await scan_entries(
+                    self._targets(due), probe,
+                    concurrency=self.settings["concurrency"],
+                    per_host=self.settings["per_host"],
+                )
+            # SQLite, firme di stato e indice: fuori dal loop, come in `reload`
+            await asyncio.to_thread(self.cache.update, results, set(self._entries))
+        finally:
+            # Anche se il giro fallisce gli endpoint tornano in coda
+            now = time.monotonic()
+            for key, result in zip(due, results):
+                entry, _ = self._entries[key]
+                self._push(key, self.next_due(entry, result, now))
+
+        snapshot, _ = self.cache.get()
+        # Solo accodamento: email, retry e deduplicazione girano nel worker delle notifiche.
+        # Gli endpoint in alert arrivano già dall'indice, senza scorrere l'inventario
+        notify(snapshot.alerts(), self.config_path)
+        return len(due)
+
+    async def run(self):
+        """
+        Loop principale: dorme fino alla prossima scadenza, a un `trigger`
+        o al prossimo controllo del config (al massimo `RELOAD_CHECK` secondi).
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        await asyncio.to_thread(self._load)
+        self.cache.set_refresher(self.trigger)
+        try:
+            while True:
+                try:
+                    await self.reload()
+                    await self.run_once()
+                except Exception as e:
+                    print(f"❌ Errore nel refresh in background: {e}")
 
-print("📅 Avviato scheduler giornaliero SSL Monitor...")
+                timeout = RELOAD_CHECK
+                if self._heap:
+                    timeout = min(timeout, max(0.0, self._heap[0][0] - time.monotonic()))
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+        finally:
+            self.cache.set_refresher(None)
+            self._loop = None
 
-while True:
-    now = datetime.datetime.now()
-    # Esegui ogni giorno alle 08:00
-    if now.hour == 8 and now.minute == 0:
-        print("🔔 Avvio controllo giornaliero certificati SSL...")
-        results = check_domains()
-        notify(results)
-        print("✅ Controllo e notifica completati.")
 
-        # Evita di reinviare più volte nello stesso minuto
-        time.sleep(60)
+if __name__ == "__main__":
+    from .cache import ResultCache
 
-    # Controlla ogni 30 secondi
-    time.sleep(30)
+    print("📅 Avviato scheduler SSL Monitor...")
+    asyncio.run(RefreshScheduler(ResultCache()).run())
@@ -0,0 +1,163 @@
+import socket
+import struct
+
+STARTTLS_MODES = ("smtp", "imap", "pop3", "ldap", "postgres")
+
+BANNER_WAIT = 0.5        # secondi di attesa del banner in modalità "auto"
+MAX_LINE = 4096          # risposte più lunghe non sono di un servizio che conosciamo
+HELO_NAME = "ssl-monitor"
+
+# LDAP ExtendedRequest StartTLS (RFC 4511): messageID 1, OID 1.3.6.1.4.1.1466.20037
+LDAP_STARTTLS = bytes.fromhex("301d02010177188016") + b"1.3.6.1.4.1.1466.20037"
+# PostgreSQL SSLRequest: lunghezza 8 e codice 80877103
+POSTGRES_SSLREQUEST = struct.pack("!II", 8, 80877103)
+
+
+class StartTLSError(Exception):
+    """Il servizio non ha accettato l'upgrade a TLS."""
+
+
+def detect(banner):
+    """Modalità STARTTLS dal banner inviato dal server appena connessi (o None)."""
+    if banner.startswith(b"220"):
+        return "smtp"
+    if banner.startswith(b"* OK"):
+        return "imap"
+    if banner.startswith(b"+OK"):
+        return "pop3"
+    return None
+
+
+def read_banner(conn, wait=BANNER_WAIT):
+    """
+    Attende al massimo `wait` secondi che il server parli per primo.
+    Ritorna i byte ricevuti (b"" se tace, come fanno TLS, LDAP e PostgreSQL).
+    Timeout del socket e non select(): con molte probe i descrittori
+    superano facilmente FD_SETSIZE (1024).
+    """
+    timeout = conn.gettimeout()
+    conn.settimeout(wait)
+    try:
+        return conn.recv(MAX_LINE)
+    except socket.timeout:
+        return b""
+    finally:
+        conn.settimeout(timeout)
+
+
+class _Reader:
+    """Letture a righe dalla connessione, partendo dai byte già ricevuti."""
+
+    def __init__(self, conn, pending=b""):
+        self.conn = conn
+        self.pending = pending
+
+    def line(self):
+        while b"\n" not in self.pending:
+            if len(self.pending) > MAX_LINE:
+                raise StartTLSError("risposta troppo lunga")
+            data = self.conn.recv(MAX_LINE)
+            if not data:
+                raise StartTLSError("connessione chiusa dal server")
+            self.pending += data
+        line, self.pending = self.pending.split(b"\n", 1)
+        return line.rstrip(b"\r").decode("latin-1")
+
+    def smtp_reply(self):
+        """Risposta SMTP completa (anche multi-riga): (codice, righe)."""
+        lines = []
+        while True:
+            line = self.line()
+            lines.append(line[4:])
+            if len(line) < 4 or line[3] != "-":
+                return line[:3], lines
+
+    def exact(self, size):
+        while len(self.pending) < size:
+            data = self.conn.recv(MAX_LINE)
+            if not data:
+                raise StartTLSError("connessione chiusa dal server")
+            self.pending += data
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+def _expect(condition, what, reply):
+    if not condition:
+        raise StartTLSError(f"{what}: {reply!r}"[:200])
+
+
+def _smtp(conn, reader):
+    code, lines = reader.smtp_reply()
+    _expect(code == "220", "banner SMTP inatteso", lines)
+    conn.sendall(f"EHLO {HELO_NAME}\r\n".encode())
+    code, lines = reader.smtp_reply()
+    _expect(code == "250", "EHLO rifiutato", lines)
+    _expect(any(line.upper().startswith("STARTTLS") for line in lines), "STARTTLS non offerto", lines)
+    conn.sendall(b"STARTTLS\r\n")
+    code, lines = reader.smtp_reply()
+    _expect(code == "220", "STARTTLS rifiutato", lines)
+
+
+def _imap(conn, reader):
+    line = reader.line()
+    _expect(line.startswith("* OK"), "banner IMAP inatteso", line)
+    conn.sendall(b"a1 STARTTLS\r\n")
+    while True:
+        line = reader.line()
+        if line.startswith("a1 "):
+            _expect(line.startswith("a1 OK"), "STARTTLS rifiutato", line)
+            return
+
+
+def _pop3(conn, reader):
+    line = reader.line()
+    _expect(line.startswith("+OK"), "banner POP3 inatteso", line)
+    conn.sendall(b"STLS\r\n")
+    line = reader.line()
+    _expect(line.startswith("+OK"), "STLS rifiutato", line)
+
+
+def _ber_length(reader):
+    first = reader.exact(1)[0]
+    if first < 0x80:
+        return first
+    return int.from_bytes(reader.exact(first & 0x7F), "big")
+
+
+def _ldap(conn, reader):
+    conn.sendall(LDAP_STARTTLS)
+    _expect(reader.exact(1) == b"\x30", "risposta LDAP inattesa", reader.pending)
+    message = _ber_length(reader)
+    body = reader.exact(message)
+    # messageID (INTEGER) e poi ExtendedResponse [APPLICATION 24] con resultCode ENUMERATED
+    index = 2 + body[1]
+    _expect(body[index:index + 1] == b"\x78", "risposta LDAP inattesa", body[:16])
+    index += 2 if body[index + 1] < 0x80 else 2 + (body[index + 1] & 0x7F)
+    _expect(body[index] == 0x0A, "risposta LDAP inattesa", body[:16])
+    code = body[index + 2]
+    _expect(code == 0, "StartTLS LDAP rifiutato, resultCode", code)
+
+
+def _postgres(conn, reader):
+    conn.sendall(POSTGRES_SSLREQUEST)
+    answer = reader.exact(1)
+    _expect(answer == b"S", "SSL non abilitato sul server PostgreSQL", answer)
+
+
+UPGRADES = {"smtp": _smtp, "imap": _imap, "pop3": _pop3, "ldap": _ldap, "postgres": _postgres}
+
+
+def upgrade(conn, mode, banner=b""):
+    """
+    Porta la connessione TCP già aperta al punto in cui può iniziare
+    l'handshake TLS, con il dialogo in chiaro del protocollo `mode`.
+    `banner` sono i byte già letti (modalità "auto"). Dopo il comando di
+    upgrade il server non invia altro, quindi non restano byte in sospeso.
+    """
+    if mode not in UPGRADES:
+        raise ValueError(f"modalità STARTTLS sconosciuta: {mode}")
+    try:
+        UPGRADES[mode](conn, _Reader(conn, banner))
+    except (IndexError, UnicodeError) as e:
+        raise StartTLSError(f"risposta {mode} non valida: {e}") from None
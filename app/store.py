@@ -0,0 +1,185 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB_PATH = "/tmp/ssl_monitor.db"
+DEFAULT_RETENTION_DAYS = 90      # oltre questa età lo storico viene cancellato
+DEFAULT_COMPACT_AFTER_DAYS = 7   # oltre questa età si tiene una riga al giorno
+COMPACT_EVERY = 6 * 3600         # secondi tra due compattazioni automatiche
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    id         INTEGER PRIMARY KEY,
+    domain     TEXT    NOT NULL,
+    port       INTEGER,
+    service    TEXT,
+    scanned_at REAL    NOT NULL,
+    protocol   TEXT,
+    days_left  INTEGER,
+    expires    TEXT,
+    error      TEXT,
+    result     TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_probes_endpoint_time ON probes (domain, port, scanned_at);
+CREATE INDEX IF NOT EXISTS idx_probes_days_left ON probes (days_left);
+
+CREATE TABLE IF NOT EXISTS latest (
+    domain     TEXT    NOT NULL,
+    port       INTEGER,
+    scanned_at REAL    NOT NULL,
+    days_left  INTEGER,
+    result     TEXT    NOT NULL,
+    PRIMARY KEY (domain, port)
+);
+CREATE INDEX IF NOT EXISTS idx_latest_days_left ON latest (days_left);
+"""
+
+
+def store_settings(config):
+    """Legge la sezione "store" del config."""
+    store_conf = config.get("store", {})
+    return {
+        "path": store_conf.get("path", DEFAULT_DB_PATH),
+        "retention_days": store_conf.get("retention_days", DEFAULT_RETENTION_DAYS),
+        "compact_after_days": store_conf.get("compact_after_days", DEFAULT_COMPACT_AFTER_DAYS),
+    }
+
+
+class ResultStore:
+    """
+    Storico persistente (SQLite) di tutte le probe.
+
+    - `probes` contiene una riga per ogni probe, indicizzata per
+      (domain, port, scanned_at) e per days_left;
+    - `latest` contiene solo l'ultimo stato di ogni endpoint, così
+      dashboard ed export non devono aggregare lo storico.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, retention_days=DEFAULT_RETENTION_DAYS,
+                 compact_after_days=DEFAULT_COMPACT_AFTER_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self.compact_after_days = compact_after_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._last_compact = 0.0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**store_settings(config))
+
+    def record(self, results, scanned_at=None):
+        """Salva un gruppo di risultati con lo stesso timestamp."""
+        ts = (scanned_at or datetime.datetime.now()).timestamp()
+        probe_rows = []
+        latest_rows = []
+        for r in results:
+            payload = json.dumps(r, ensure_ascii=False)
+            probe_rows.append((
+                r["domain"], r.get("port"), r.get("service"), ts, r.get("protocol"),
+                r.get("days_left"), r.get("expires"), r.get("error"), payload,
+            ))
+            latest_rows.append((r["domain"], r.get("port"), ts, r.get("days_left"), payload))
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO probes (domain, port, service, scanned_at, protocol,"
+                " days_left, expires, error, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                probe_rows,
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO latest (domain, port, scanned_at, days_left, result)"
+                " VALUES (?, ?, ?, ?, ?)",
+                latest_rows,
+            )
+
+        if time.monotonic() - self._last_compact > COMPACT_EVERY:
+            self.compact()
+
+    def latest(self):
+        """Ritorna (risultati, scanned_at) dell'ultimo stato noto di ogni endpoint."""
+        with self._lock:
+            rows = self._conn.execute("SELECT result, scanned_at FROM latest").fetchall()
+        if not rows:
+            return [], None
+        results = [json.loads(result) for result, _ in rows]
+        scanned_at = datetime.datetime.fromtimestamp(max(ts for _, ts in rows))
+        return results, scanned_at
+
+    def latest_state(self):
+        """Ultimo stato per endpoint: (domain, port) -> (risultato, timestamp epoch)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT domain, port, result, scanned_at FROM latest").fetchall()
+        return {(domain, port): (json.loads(result), ts) for domain, port, result, ts in rows}
+
+    def history(self, domain, port, since=None, limit=100):
+        """
+        Storico di un endpoint, dal più recente.
+        Ogni elemento è il dict risultato più il campo "scanned_at" (ISO).
+        """
+        query = "SELECT result, scanned_at FROM probes WHERE domain = ? AND port = ?"
+        params = [domain, port]
+        if since is not None:
+            query += " AND scanned_at >= ?"
+            params.append(since.timestamp())
+        query += " ORDER BY scanned_at DESC LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        history = []
+        for result, ts in rows:
+            item = json.loads(result)
+            item["scanned_at"] = datetime.datetime.fromtimestamp(ts).isoformat(timespec="seconds")
+            history.append(item)
+        return history
+
+    def expiring(self, days):
+        """Ultimo stato degli endpoint con days_left <= `days` (usa l'indice)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT result FROM latest WHERE days_left <= ? ORDER BY days_left", (days,)
+            ).fetchall()
+        return [json.loads(result) for (result,) in rows]
+
+    def compact(self, now=None):
+        """
+        Retention e compattazione dello storico:
+        - cancella le righe più vecchie di `retention_days`;
+        - oltre `compact_after_days` tiene solo l'ultima probe del giorno
+          per ogni endpoint.
+        Ritorna il numero di righe cancellate.
+        """
+        now = now or time.time()
+        retention_limit = now - self.retention_days * 86400
+        compact_limit = now - self.compact_after_days * 86400
+
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM probes WHERE scanned_at < ?", (retention_limit,)
+            ).rowcount
+            deleted += self._conn.execute(
+                "DELETE FROM probes WHERE scanned_at < ? AND id NOT IN ("
+                " SELECT MAX(id) FROM probes WHERE scanned_at < ?"
+                " GROUP BY domain, port, CAST(scanned_at / 86400 AS INTEGER))",
+                (compact_limit, compact_limit),
+            ).rowcount
+        self._last_compact = time.monotonic()
+        return deleted
+
+    def forget(self, keep):
+        """Toglie da `latest` gli endpoint che non sono in `keep` (chiavi domain, port)."""
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT domain, port FROM latest").fetchall()
+            stale = [row for row in rows if tuple(row) not in keep]
+            self._conn.executemany("DELETE FROM latest WHERE domain = ? AND port = ?", stale)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
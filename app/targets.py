@@ -0,0 +1,110 @@
+import ipaddress
+
+from .resolver import DNS_CACHE
+
+
+def parse_ports(spec):
+    """
+    Espande una specifica di porte in una lista ordinata senza duplicati.
+
+    Accetta un intero (443), una lista ([443, 8443]) o una stringa con
+    porte e intervalli separati da virgola ("443,8000-8010").
+    """
+    if spec is None:
+        return [443]
+    if isinstance(spec, int):
+        return [spec]
+
+    items = spec if isinstance(spec, list) else str(spec).split(",")
+    ports = set()
+    for item in items:
+        if isinstance(item, int):
+            ports.add(item)
+            continue
+        item = item.strip()
+        if not item:
+            continue
+        if "-" in item:
+            start, end = (int(p) for p in item.split("-", 1))
+            if start > end:
+                raise ValueError(f"Intervallo di porte non valido: {item}")
+            ports.update(range(start, end + 1))
+        else:
+            ports.add(int(item))
+
+    for port in ports:
+        if not 0 < port < 65536:
+            raise ValueError(f"Porta non valida: {port}")
+    return sorted(ports)
+
+
+def resolve_all(hostname):
+    """Tutti gli indirizzi A/AAAA di `hostname` (via cache DNS), senza duplicati."""
+    return DNS_CACHE.addresses(hostname)
+
+
+def iter_hosts(entry, resolver=resolve_all):
+    """
+    Host da controllare per una entry del config:
+    - "url" in notazione CIDR ("10.54.98.0/24") → ogni indirizzo del blocco,
+      generato uno alla volta;
+    - "resolve_all": true → ogni indirizzo A/AAAA del nome;
+    - altrimenti il solo "url".
+    Produce coppie (indirizzo_o_host, hostname_originale_o_None).
+    """
+    url = entry.get("url")
+
+    if "/" in url:
+        network = ipaddress.ip_network(url, strict=False)
+        # hosts() esclude rete e broadcast; per /32 e /128 ritorna l'indirizzo
+        for address in network.hosts():
+            yield str(address), None
+        return
+
+    if entry.get("resolve_all"):
+        try:
+            addresses = resolver(url)
+        except OSError:
+            # DNS fallito: lascio il nome, la probe riporterà l'errore
+            addresses = []
+        if addresses:
+            for address in addresses:
+                yield address, url
+            return
+
+    yield url, None
+
+
+def iter_endpoints(entries, resolver=resolve_all):
+    """
+    Come `iter_targets`, ma senza copiare le entry: produce tuple
+    (entry, indirizzo, porta, hostname del fan-out o None), da trasformare
+    in target con `make_target` solo quando servono.
+    """
+    for entry in entries:
+        ports = parse_ports(entry.get("port", 443))
+        for host, hostname in iter_hosts(entry, resolver):
+            for port in ports:
+                yield entry, host, port, hostname
+
+
+def make_target(entry, host, port, hostname=None):
+    """Target concreto: copia della entry con "url" e "port" (e "sni" dal fan-out DNS)."""
+    target = dict(entry, url=host, port=port)
+    if hostname is not None:
+        target["sni"] = hostname
+    return target
+
+
+def iter_targets(entries, resolver=resolve_all):
+    """
+    Espande pigramente le entry del config in target concreti (una entry
+    per indirizzo e porta). Nessuna lista intermedia: una /16 con dieci
+    porte produce 655k target senza mai tenerli tutti in memoria.
+
+    Ogni target è una copia della entry con "url" e "port" concreti; se
+    l'indirizzo viene da un fan-out DNS, "sni" contiene il nome originale
+    da usare nell'handshake.
+    """
+    for endpoint in iter_endpoints(entries, resolver):
+        yield make_target(*endpoint)
@@ -0,0 +1,282 @@
+"""Utilità condivise dai benchmark: certificati di test e listener locali."""
+import datetime
+import os
+import socket
+import ssl
+import tempfile
+import threading
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+
+def make_cert(days=30, common_name="localhost", directory=None):
+    """Genera un certificato self-signed; ritorna (cert_path, key_path)."""
+    directory = directory or tempfile.mkdtemp(prefix="ssl-monitor-bench-")
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "SSL Monitor Bench"),
+        x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+    ])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=days))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(common_name)]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ))
+    return cert_path, key_path
+
+
+class TLSListener:
+    """
+    Listener TLS su loopback che gira in un thread e conta le connessioni accettate.
+    `delay` ritarda l'handshake per simulare endpoint lenti.
+    """
+
+    def __init__(self, cert_path, key_path, delay=0.0, host="127.0.0.1", legacy=False):
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(cert_path, key_path)
+        if legacy:
+            # Solo TLS1.0: il probe deve passare dal fallback legacy
+            self.context.set_ciphers("ALL:@SECLEVEL=0")
+            self.context.minimum_version = ssl.TLSVersion.TLSv1
+            self.context.maximum_version = ssl.TLSVersion.TLSv1
+        self.delay = delay
+        self.accepted = 0
+        self._lock = threading.Lock()
+        self._sock = socket.create_server((host, 0), backlog=512)
+        self.host = host
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.accepted += 1
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        try:
+            if self.delay:
+                threading.Event().wait(self.delay)
+            conn.settimeout(5)
+            tls = self.context.wrap_socket(conn, server_side=True)
+            try:
+                tls.recv(1)
+            finally:
+                tls.close()
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self._sock.close()
+
+
+class StartTLSListener(TLSListener):
+    """
+    Listener che passa a TLS in banda, come un servizio reale `mode`
+    (smtp, imap, pop3, ldap, postgres): dialogo in chiaro e poi handshake.
+    `offer=False` simula un servizio che non offre l'upgrade.
+    """
+
+    def __init__(self, cert_path, key_path, mode, host="127.0.0.1", offer=True):
+        self.mode = mode
+        self.offer = offer
+        super().__init__(cert_path, key_path, host=host)
+
+    def _dialogue(self, conn):
+        """Parte in chiaro; ritorna True se il client può iniziare l'handshake."""
+        reader = conn.makefile("rb")
+        if self.mode == "smtp":
+            conn.sendall(b"220 bench ESMTP\r\n")
+            reader.readline()
+            extensions = b"250-bench\r\n250-PIPELINING\r\n"
+            conn.sendall(extensions + (b"250 STARTTLS\r\n" if self.offer else b"250 8BITMIME\r\n"))
+            if not self.offer:
+                return False
+            reader.readline()
+            conn.sendall(b"220 Ready to start TLS\r\n")
+        elif self.mode == "imap":
+            conn.sendall(b"* OK [CAPABILITY IMAP4rev1 STARTTLS] bench\r\n")
+            tag = reader.readline().split(b" ", 1)[0]
+            conn.sendall(tag + (b" OK Begin TLS\r\n" if self.offer else b" BAD no TLS\r\n"))
+        elif self.mode == "pop3":
+            conn.sendall(b"+OK bench POP3\r\n")
+            reader.readline()
+            conn.sendall(b"+OK Begin TLS\r\n" if self.offer else b"-ERR no TLS\r\n")
+        elif self.mode == "ldap":
+            header = reader.read(2)
+            reader.read(header[1])
+            code = 0 if self.offer else 2
+            # ExtendedResponse: messageID 1, resultCode, matchedDN e diagnosticMessage vuoti
+            conn.sendall(bytes([0x30, 0x0c, 0x02, 0x01, 0x01, 0x78, 0x07, 0x0a, 0x01, code,
+                                0x04, 0x00, 0x04, 0x00]))
+        elif self.mode == "postgres":
+            reader.read(8)
+            conn.sendall(b"S" if self.offer else b"N")
+        return self.offer
+
+    def _handle(self, conn):
+        try:
+            conn.settimeout(5)
+            if not self._dialogue(conn):
+                return
+            tls = self.context.wrap_socket(conn, server_side=True)
+            try:
+                tls.recv(1)
+            finally:
+                tls.close()
+        except (OSError, ssl.SSLError):
+            pass
+        finally:
+            conn.close()
+
+
+class PlaintextListener:
+    """Servizio non TLS: risponde al ClientHello con una riga di testo."""
+
+    def __init__(self, host="127.0.0.1"):
+        self._sock = socket.create_server((host, 0), backlog=512)
+        self.host = host
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    @staticmethod
+    def _handle(conn):
+        try:
+            conn.settimeout(5)
+            conn.recv(1024)
+            conn.sendall(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n")
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self._sock.close()
+
+
+class BlackHoleListener:
+    """
+    Porta in ascolto che non accetta mai: il TCP si apre (finché c'è
+    posto nel backlog) ma l'handshake TLS non riceve risposta.
+    """
+
+    def __init__(self, host="127.0.0.1"):
+        self._sock = socket.create_server((host, 0), backlog=4096)
+        self.host = host
+        self.port = self._sock.getsockname()[1]
+
+    def close(self):
+        self._sock.close()
+
+
+def closed_port(host="127.0.0.1"):
+    """Una porta appena liberata: la connessione viene rifiutata."""
+    with socket.create_server((host, 0)) as sock:
+        return sock.getsockname()[1]
+
+
+def _fleet_main(count, delay, queue):
+    cert_path, key_path = make_cert()
+    listeners = [
+        TLSListener(cert_path, key_path, delay=delay, host=f"127.0.{i // 250}.{i % 250 + 1}")
+        for i in range(count)
+    ]
+    queue.put([(listener.host, listener.port) for listener in listeners])
+    threading.Event().wait()
+
+
+def start_fleet_process(count, delay=0.0):
+    """
+    Avvia `count` listener TLS in un processo separato (ognuno su un
+    indirizzo 127.0.x.y diverso, così contano come host distinti).
+    Ritorna (processo, lista di (host, porta)).
+    """
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_fleet_main, args=(count, delay, queue), daemon=True)
+    process.start()
+    return process, queue.get(timeout=60)
+
+
+# Tipi di endpoint della flotta mista: coprono tutti i rami di `fetch_tls_info`
+FLEET_KINDS = ("modern", "tls10", "plaintext", "slow", "blackhole", "refused", "smtp")
+
+
+def _mixed_fleet_main(mix, slow_delay, queue):
+    cert_path, key_path = make_cert()
+    targets, keep = [], []
+    index = 0
+    for kind in FLEET_KINDS:
+        for _ in range(mix.get(kind, 0)):
+            host = f"127.0.{index // 250}.{index % 250 + 1}"
+            index += 1
+            if kind == "refused":
+                targets.append((host, closed_port(host), kind))
+                continue
+            if kind == "modern":
+                listener = TLSListener(cert_path, key_path, host=host)
+            elif kind == "tls10":
+                listener = TLSListener(cert_path, key_path, host=host, legacy=True)
+            elif kind == "slow":
+                listener = TLSListener(cert_path, key_path, delay=slow_delay, host=host)
+            elif kind == "plaintext":
+                listener = PlaintextListener(host)
+            elif kind == "smtp":
+                listener = StartTLSListener(cert_path, key_path, "smtp", host=host)
+            else:
+                listener = BlackHoleListener(host)
+            keep.append(listener)
+            targets.append((host, listener.port, kind))
+    queue.put(targets)
+    threading.Event().wait()
+
+
+def start_mixed_fleet(mix, slow_delay=0.2):
+    """
+    Avvia in un processo separato una flotta mista di listener, con
+    `mix` = {tipo: quanti} sui tipi di `FLEET_KINDS`.
+    Ritorna (processo, lista di (host, porta, tipo)).
+    """
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_mixed_fleet_main, args=(mix, slow_delay, queue), daemon=True)
+    process.start()
+    return process, queue.get(timeout=60)
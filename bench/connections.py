@@ -0,0 +1,35 @@
+"""
+Conta le connessioni TCP aperte per ogni probe di `fetch_tls_info`.
+
+Uso: python -m bench.connections [--probes N]
+"""
+import argparse
+import time
+
+from app.checker import fetch_tls_info
+
+from .common import TLSListener, make_cert
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--probes", type=int, default=50)
+    args = parser.parse_args()
+
+    listener = TLSListener(*make_cert())
+    start = time.perf_counter()
+    for _ in range(args.probes):
+        data, state, err = fetch_tls_info(listener.host, listener.port)
+        if err is not None:
+            raise SystemExit(f"probe fallita: {state} {err}")
+    elapsed = time.perf_counter() - start
+    listener.close()
+
+    print(f"probe:                 {args.probes}")
+    print(f"connessioni accettate: {listener.accepted}")
+    print(f"connessioni per probe: {listener.accepted / args.probes:.2f}")
+    print(f"tempo medio per probe: {elapsed / args.probes * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
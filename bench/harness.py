@@ -0,0 +1,286 @@
+"""
+Benchmark e load test della scansione e degli export, con output JSON.
+
+Avvia una flotta mista di listener locali (TLS moderno, solo TLS1.0,
+servizio in chiaro, handshake lento, black hole, porta chiusa, SMTP con
+STARTTLS), genera inventari `config.json` delle dimensioni richieste e
+per ognuno misura, in un processo dedicato:
+
+- la scansione completa (`check_domains`): tempo, probe/s, percentili
+  di latenza per probe, stati ottenuti, CPU e picco di RSS;
+- gli endpoint di export (dashboard, /api/results, /export, /export_xlsx)
+  sui risultati ottenuti: tempo, CPU, byte prodotti e picco di memoria.
+
+Il risultato è un JSON confrontabile tra commit con `--compare`.
+
+Uso: python -m bench.harness [--sizes 100,1000,10000] [--output out.json]
+                             [--compare baseline.json]
+"""
+import argparse
+import datetime
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+from .common import FLEET_KINDS, start_mixed_fleet
+
+# Percentuali della flotta per tipo di endpoint
+DEFAULT_MIX = {"modern": 55, "smtp": 5, "tls10": 10, "plaintext": 10, "slow": 10, "blackhole": 5, "refused": 5}
+
+
+def write_inventory(directory, targets, endpoints, timeout, concurrency, workers):
+    """Config di benchmark: `endpoints` entry che ciclano sui target della flotta."""
+    domains = []
+    for i in range(endpoints):
+        host, port, kind = targets[i % len(targets)]
+        entry = {"url": host, "port": port, "service_name": f"{kind}-{i}", "alert_days": 15}
+        if kind == "smtp":
+            entry["starttls"] = "auto"
+        domains.append(entry)
+    config = {
+        "domains": domains,
+        "notify_before_days": 15,
+        "scan": {"concurrency": concurrency, "workers": workers, "background": False,
+                 "incremental": False},
+        # Gli stessi target ricorrono più volte: niente circuit breaker
+        "health": {"timeout_seconds": timeout, "failure_threshold": 10 ** 9},
+        # Store proprio per ogni dimensione: l'app in-process non tocca quello di produzione
+        "store": {"path": os.path.join(directory, f"bench-{endpoints}.db")},
+        "notification": {"email": {"enabled": False}},
+    }
+    path = os.path.join(directory, f"config-{endpoints}.json")
+    with open(path, "w") as f:
+        json.dump(config, f)
+    return path
+
+
+def timed_probe(probe, entry):
+    """Probe che riporta anche la propria durata (funzione di modulo: picklable)."""
+    start = time.perf_counter()
+    result = probe(entry)
+    result["_probe_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def percentiles(values, points=(50, 90, 95, 99)):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    summary = {f"p{p}": round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)], 2) for p in points}
+    summary["max"] = round(ordered[-1], 2)
+    summary["mean"] = round(sum(ordered) / len(ordered), 2)
+    return summary
+
+
+def _cpu():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + children.ru_utime, own.ru_stime + children.ru_stime
+
+
+def _peak_rss_mib():
+    # ru_maxrss è in KiB su Linux, in byte su macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return round(own / 2 ** 20, 1), round(children / 2 ** 20, 1)
+
+
+def measure_scan(config_path):
+    """Stessa pipeline di `check_domains`, con la durata di ogni probe."""
+    from app.checker import _scan_plan, sort_key
+    from app.scanner import run_sharded
+
+    entries, probe, settings = _scan_plan(config_path)
+    user0, sys0 = _cpu()
+    start = time.perf_counter()
+    results = run_sharded(
+        entries, partial(timed_probe, probe), settings["workers"], settings["shard_size"],
+        settings["concurrency"], settings["per_host"],
+    )
+    results.sort(key=sort_key)
+    wall = time.perf_counter() - start
+    user1, sys1 = _cpu()
+
+    latencies = [r.pop("_probe_ms") for r in results]
+    states = {}
+    for r in results:
+        states[r.get("protocol")] = states.get(r.get("protocol"), 0) + 1
+    rss, children_rss = _peak_rss_mib()
+    return results, {
+        "wall_s": round(wall, 3),
+        "probes_per_s": round(len(results) / wall, 1),
+        "latency_ms": percentiles(latencies),
+        "states": states,
+        "cpu_user_s": round(user1 - user0, 2),
+        "cpu_sys_s": round(sys1 - sys0, 2),
+        "peak_rss_mib": rss,
+        "peak_rss_workers_mib": children_rss,
+    }
+
+
+def measure_exports(results):
+    """Misura gli endpoint di export sui risultati in cache (app FastAPI in-process)."""
+    from fastapi.testclient import TestClient
+
+    from app import main
+
+    # Una chiave distinta per endpoint, anche se i target della flotta si ripetono
+    distinct = [dict(r, domain=f"{r['service']}.bench") for r in results]
+    main.result_cache.update(distinct)
+
+    client = TestClient(main.app)
+    requests = {
+        "dashboard": ("/", {}),
+        "dashboard_filtered": ("/?alert=0&page=2&page_size=20", {}),
+        "api_results": ("/api/results", {"Accept-Encoding": "identity"}),
+        "api_results_gzip": ("/api/results", {"Accept-Encoding": "gzip"}),
+        "api_results_br": ("/api/results", {"Accept-Encoding": "br"}),
+        "export_csv": ("/export", {}),
+        "export_xlsx": ("/export_xlsx", {}),
+    }
+    exports = {}
+    for name, (url, headers) in requests.items():
+        tracemalloc.start()
+        user0, sys0 = _cpu()
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        wall = time.perf_counter() - start
+        user1, sys1 = _cpu()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        response.raise_for_status()
+        exports[name] = {
+            "wall_s": round(wall, 3),
+            "cpu_s": round(user1 - user0 + sys1 - sys0, 2),
+            # Byte trasferiti: con gzip/br il client decomprime `content`
+            "bytes": response.num_bytes_downloaded,
+            "peak_alloc_mib": round(peak / 2 ** 20, 1),
+        }
+
+    # Seconda richiesta: deve essere servita dalla cache di rendering
+    start = time.perf_counter()
+    client.get("/")
+    exports["dashboard_cached"] = {"wall_s": round(time.perf_counter() - start, 3)}
+    etag = client.get("/api/results").headers["etag"]
+    start = time.perf_counter()
+    status = client.get("/api/results", headers={"If-None-Match": etag}).status_code
+    exports["api_results_304"] = {"wall_s": round(time.perf_counter() - start, 3), "status": status}
+    return exports
+
+
+def _run_size(config_path, with_exports, queue):
+    # Processo dedicato: RSS e CPU si riferiscono solo a questa dimensione
+    os.environ["SSL_MONITOR_CONFIG"] = config_path
+    try:
+        results, scan = measure_scan(config_path)
+        run = {"endpoints": len(results), "scan": scan}
+        if with_exports:
+            run["exports"] = measure_exports(results)
+        queue.put(run)
+    except BaseException as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+        raise
+
+
+def run_size(config_path, with_exports):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_size, args=(config_path, with_exports, queue))
+    process.start()
+    run = queue.get()
+    process.join()
+    return run
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """Stampa la variazione dei tempi rispetto a un report precedente."""
+    before = {run["endpoints"]: run for run in baseline.get("runs", [])}
+    print(f"confronto con {baseline.get('revision')} ({baseline.get('timestamp')})", file=sys.stderr)
+    for run in report["runs"]:
+        old = before.get(run.get("endpoints"))
+        if old is None or "scan" not in run:
+            continue
+        rows = [("scan", run["scan"]["wall_s"], old["scan"]["wall_s"])]
+        for name, values in run.get("exports", {}).items():
+            if name in old.get("exports", {}):
+                rows.append((name, values["wall_s"], old["exports"][name]["wall_s"]))
+        for name, new, prev in rows:
+            delta = (new - prev) / prev * 100 if prev else 0.0
+            print(f"{run['endpoints']:>7} {name:<20} {prev:>9.3f}s -> {new:>9.3f}s {delta:+7.1f}%",
+                  file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="dimensioni degli inventari, separate da virgola (fino a 50000)")
+    parser.add_argument("--listeners", type=int, default=200, help="listener della flotta")
+    parser.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()),
+                        help="percentuali per tipo: " + ", ".join(FLEET_KINDS))
+    parser.add_argument("--slow-delay", type=float, default=0.2, help="ritardo handshake lento (s)")
+    parser.add_argument("--timeout", type=float, default=1.0, help="timeout delle probe (s)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--no-exports", action="store_true", help="misura solo la scansione")
+    parser.add_argument("--output", help="file JSON di output (default: stdout)")
+    parser.add_argument("--compare", help="report JSON precedente da confrontare")
+    args = parser.parse_args()
+
+    weights = {k: float(v) for k, v in (item.split("=") for item in args.mix.split(","))}
+    total = sum(weights.values())
+    mix = {kind: max(1, round(args.listeners * w / total)) for kind, w in weights.items() if w > 0}
+
+    process, targets = start_mixed_fleet(mix, args.slow_delay)
+    directory = tempfile.mkdtemp(prefix="ssl-monitor-bench-")
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "fleet": mix,
+        "settings": {"timeout_s": args.timeout, "slow_delay_s": args.slow_delay,
+                     "concurrency": args.concurrency, "workers": args.workers},
+        "runs": [],
+    }
+    try:
+        for size in (int(s) for s in args.sizes.split(",")):
+            config_path = write_inventory(directory, targets, size, args.timeout,
+                                          args.concurrency, args.workers)
+            print(f"⏱️  {size} endpoint...", file=sys.stderr)
+            report["runs"].append(run_size(config_path, not args.no_exports))
+    finally:
+        process.terminate()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark di scalabilità della scansione multi-processo.
+
+Misura il throughput di `check_domains` con 1, 2, 4 e 8 worker contro
+una flotta di listener TLS locali.
+
+Uso: python -m bench.scaling [--endpoints N] [--listeners N] [--workers 1,2,4,8]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from app.checker import check_domains
+
+from .common import start_fleet_process
+
+
+def write_inventory(targets, endpoints):
+    config = {
+        "domains": [
+            {"url": host, "port": port, "service_name": f"bench{i}", "alert_days": 15}
+            for i, (host, port) in zip(range(endpoints), _cycle(targets))
+        ],
+        "notify_before_days": 15,
+    }
+    fd, path = tempfile.mkstemp(prefix="ssl-monitor-bench-", suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(config, f)
+    return path
+
+
+def _cycle(items):
+    while True:
+        yield from items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--endpoints", type=int, default=4000)
+    parser.add_argument("--listeners", type=int, default=200)
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--shard-size", type=int, default=256)
+    args = parser.parse_args()
+
+    process, targets = start_fleet_process(args.listeners)
+    config_path = write_inventory(targets, args.endpoints)
+    try:
+        print(f"{args.endpoints} endpoint su {args.listeners} listener, "
+              f"concurrency {args.concurrency}/worker, shard {args.shard_size}")
+        print(f"{'worker':>6} {'tempo':>10} {'probe/s':>10}")
+        for workers in (int(w) for w in args.workers.split(",")):
+            start = time.perf_counter()
+            results = check_domains(config_path, concurrency=args.concurrency,
+                                    workers=workers, shard_size=args.shard_size)
+            elapsed = time.perf_counter() - start
+            assert len(results) == args.endpoints
+            print(f"{workers:>6} {elapsed:>8.2f} s {len(results) / elapsed:>10.0f}")
+    finally:
+        os.remove(config_path)
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
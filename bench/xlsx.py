@@ -0,0 +1,81 @@
+"""
+Benchmark della generazione XLSX: tempo e picco di memoria.
+
+Confronta il motore write-only di `app.export_xlsx` con un workbook
+openpyxl classico che crea stili per ogni cella (l'approccio precedente).
+
+Uso: python -m bench.xlsx [--rows N]
+"""
+import argparse
+import io
+import time
+import tracemalloc
+
+import openpyxl
+from openpyxl.styles import Alignment, PatternFill
+
+from app.export_xlsx import HEADERS, generate_xlsx, row_color
+
+PROTOCOLS = ["tls_modern", "tls_legacy", "timeout", "refused", "no_tls"]
+
+
+def fake_results(rows):
+    results = []
+    for i in range(rows):
+        proto = PROTOCOLS[i % len(PROTOCOLS)]
+        if proto in ("timeout", "refused", "no_tls"):
+            results.append({"service": f"svc{i}", "domain": f"10.0.{i // 256 % 256}.{i % 256}",
+                            "port": 443, "protocol": proto, "error": "Timeout di connessione",
+                            "chain_incomplete": True})
+        else:
+            results.append({"service": f"svc{i}", "domain": f"host{i}.example.org", "port": 443,
+                            "protocol": proto, "expires": "2027-01-01", "days_left": i % 400,
+                            "issuer": "Example CA, Example Issuing CA 01",
+                            "san": [f"DNS:host{i}.example.org", f"DNS:www.host{i}.example.org"],
+                            "chain": "⚠ chain non validata", "chain_incomplete": True,
+                            "alert": i % 400 <= 15})
+    return results
+
+
+def classic_xlsx(results):
+    """Workbook normale con Fill/Alignment nuovi per ogni cella."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(HEADERS)
+    for r in results:
+        ws.append([r.get("service"), r.get("domain"), r.get("port"), r.get("protocol"),
+                   r.get("expires", ""), r.get("days_left", ""), r.get("issuer", ""),
+                   "; ".join(r.get("san") or []), r.get("chain", r.get("error"))])
+        for cell in ws[ws.max_row]:
+            cell.fill = PatternFill(start_color=row_color(r.get("protocol")), fill_type="solid")
+            cell.alignment = Alignment(wrap_text=True)
+    output = io.BytesIO()
+    wb.save(output)
+    return output
+
+
+def measure(label, fn, results):
+    tracemalloc.start()
+    start = time.perf_counter()
+    output = fn(results)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    size = len(output.getvalue()) if isinstance(output, io.BytesIO) else output.seek(0, 2)
+    print(f"{label:<12} {elapsed:8.2f} s {peak / 1024 / 1024:10.1f} MiB {size / 1024:10.0f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000)
+    args = parser.parse_args()
+
+    results = fake_results(args.rows)
+    print(f"{args.rows} righe")
+    print(f"{'motore':<12} {'tempo':>10} {'picco mem':>14} {'file':>14}")
+    measure("classico", classic_xlsx, results)
+    measure("write-only", generate_xlsx, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from bench.common import make_cert
+
+
+def pytest_configure(config):
+    # pytest reimposta i filtri a ogni test: stesso filtro a livello di modulo di app/chain.py
+    config.addinivalue_line(
+        "filterwarnings", "ignore::cryptography.utils.CryptographyDeprecationWarning:app.chain")
+
+
+@pytest.fixture(scope="session")
+def cert(tmp_path_factory):
+    """Certificato self-signed condiviso dai listener di test: (cert_path, key_path)."""
+    return make_cert(days=30, directory=str(tmp_path_factory.mktemp("cert")))
+
+
+@pytest.fixture
+def write_config(tmp_path):
+    """Scrive un config di test e ne ritorna il percorso."""
+    def write(domains, **sections):
+        sections.setdefault("store", {"path": str(tmp_path / "store.db")})
+        path = tmp_path / "config.json"
+        path.write_text(json.dumps({"domains": domains, **sections}))
+        return str(path)
+    return write
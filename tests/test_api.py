@@ -0,0 +1,40 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+from app.cache import ResultCache
+
+RESULT = {"domain": "example.test", "port": 443, "protocol": "TLSv1.3", "days_left": 10,
+          "alert_days": 30, "expiry_date": "2026-10-27", "service_name": "svc"}
+
+
+@pytest.fixture
+def scans(monkeypatch):
+    """Cache con TTL zero (sempre scaduta) e scansione che conta le chiamate."""
+    calls = []
+
+    def scan():
+        calls.append(1)
+        return [dict(RESULT)]
+
+    cache = ResultCache(ttl=0, scan=scan)
+    cache.get()
+    calls.clear()
+    monkeypatch.setattr(main, "result_cache", cache)
+    return calls
+
+
+@pytest.mark.parametrize("path", ["/api/latest", "/api/results", "/api/results/example.test:443",
+                                  "/api/expiring", "/metrics"])
+def test_polling_reads_the_cache_without_scanning(scans, path):
+    client = TestClient(main.app)
+    for _ in range(3):
+        assert client.get(path).status_code == 200
+    assert scans == []
+
+
+@pytest.mark.parametrize("path", ["/api/latest", "/api/results", "/api/expiring"])
+def test_explicit_refresh_scans(scans, path):
+    response = TestClient(main.app).get(path, params={"refresh": 1})
+    assert response.status_code == 200
+    assert scans == [1]
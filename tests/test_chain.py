@@ -0,0 +1,19 @@
+import threading
+
+from app.chain import ChainValidator
+
+
+def test_anchors_load_once_under_concurrency(monkeypatch):
+    validator = ChainValidator()
+    loads = []
+    load = validator._load_anchors
+    monkeypatch.setattr(validator, "_load_anchors", lambda trust: loads.append(trust) or load(trust))
+
+    threads = [threading.Thread(target=validator.anchors) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert loads == [(None, None)]
+    assert validator.anchors() is validator.anchors()
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from app.agent import scan_shard
+from app.chain import ChainValidator
+from app.collector import Collector, collector_settings
+from app.config import Config, ConfigError
+from bench.common import TLSListener, closed_port
+
+TOKEN = "s3cret"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _request(base, path, token=TOKEN):
+    headers = {"X-Agent-Token": token} if token else {}
+    request = urllib.request.Request(base + path, headers=headers)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def _wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        value = condition()
+        if value:
+            return value
+        assert time.monotonic() < deadline, "condizione non raggiunta"
+        time.sleep(0.2)
+
+
+class Deployment:
+    """Collector (uvicorn) e agent come processi separati su loopback."""
+
+    def __init__(self, config_path):
+        self.port = closed_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        self.env = dict(os.environ, SSL_MONITOR_CONFIG=config_path, PYTHONPATH=ROOT)
+        self.env.pop("SSL_MONITOR_AGENT_TOKEN", None)
+        self.processes = []
+        self.collector = self._spawn("-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+                                     "--port", str(self.port), "--log-level", "warning")
+        _wait_for(self._ready)
+
+    def _spawn(self, *args):
+        process = subprocess.Popen([sys.executable, *args], cwd=ROOT, env=self.env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.processes.append(process)
+        return process
+
+    def _ready(self):
+        try:
+            return _request(self.base, "/agent/status")
+        except OSError:
+            return None
+
+    def agent(self, name, *extra):
+        return self._spawn("-m", "app.agent", "--collector", self.base, "--name", name,
+                           "--token", TOKEN, "--batch", "1", *extra)
+
+    def status(self):
+        return _request(self.base, "/agent/status")
+
+    def results(self):
+        return _request(self.base, "/api/results", token=None)["results"]
+
+    def close(self):
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+@pytest.fixture
+def deploy(cert, write_config, tmp_path):
+    started = []
+
+    def start(listeners, **collector):
+        path = write_config(
+            [{"url": l.host, "port": l.port, "service_name": f"svc-{i}"}
+             for i, l in enumerate(listeners)],
+            collector={"enabled": True, "token": TOKEN, "shard_size": 2,
+                       "agent_timeout_seconds": 2, "heartbeat_seconds": 0.5,
+                       "poll_seconds": 0.5, **collector},
+            scan={"concurrency": 4, "interval_seconds": 3600},
+            health={"timeout_seconds": 5},
+            notification={"state_file": str(tmp_path / "notified.json"),
+                          "email": {"enabled": False}},
+        )
+        started.append(Deployment(path))
+        return started[-1]
+    yield start
+    for deployment in started:
+        deployment.close()
+
+
+@pytest.fixture
+def fleet(cert):
+    started = []
+
+    def start(count, delay=0.0):
+        started.extend(TLSListener(*cert, delay=delay, host=f"127.0.4.{i + 1}")
+                       for i in range(count))
+        return started[-count:]
+    yield start
+    for listener in started:
+        listener.close()
+
+
+def test_agents_scan_every_shard(deploy, fleet):
+    listeners = fleet(6)
+    deployment = deploy(listeners)
+    agents = [deployment.agent("a1", "--once"), deployment.agent("a2", "--once")]
+    for agent in agents:
+        assert agent.wait(60) == 0
+
+    results = deployment.results()
+    assert sorted(r["port"] for r in results) == sorted(l.port for l in listeners)
+    assert all("error" not in r and r["agent"] in ("a1", "a2") for r in results)
+    assert deployment.status()["shards"] == {"total": 3, "leased": 0, "due": 0}
+
+
+def test_shards_of_a_dead_agent_are_reassigned(deploy, fleet):
+    listeners = fleet(4, delay=1.5)
+    deployment = deploy(listeners, max_shards_per_agent=2)
+    doomed = deployment.agent("doomed")
+    _wait_for(lambda: any(a["name"] == "doomed" and a["shards"] for a in deployment.status()["agents"]))
+    doomed.send_signal(signal.SIGKILL)
+    doomed.wait(10)
+    # Dopo agent_timeout gli shard dell'agent morto tornano assegnabili
+    _wait_for(lambda: deployment.status()["shards"]["due"] == 2)
+
+    rescuer = deployment.agent("rescuer", "--once")
+    assert rescuer.wait(60) == 0
+    results = deployment.results()
+    assert sorted(r["port"] for r in results) == sorted(l.port for l in listeners)
+    assert "rescuer" in {r["agent"] for r in results}
+    assert [a["name"] for a in deployment.status()["agents"]] == ["rescuer"]
+
+
+def test_agent_requests_need_the_token(deploy, fleet):
+    deployment = deploy(fleet(1))
+    for token in (None, "wrong"):
+        with pytest.raises(urllib.error.HTTPError) as e:
+            _request(deployment.base, "/agent/status", token=token)
+        assert e.value.code == 401
+
+
+def test_csv_refresh_does_not_scan_locally(deploy, fleet):
+    listeners = fleet(2)
+    deployment = deploy(listeners)
+    with urllib.request.urlopen(deployment.base + "/export?refresh=1", timeout=10) as response:
+        assert response.status == 200
+    time.sleep(0.5)
+    assert sum(l.accepted for l in listeners) == 0
+
+
+def test_enabled_collector_requires_a_token(monkeypatch):
+    monkeypatch.delenv("SSL_MONITOR_AGENT_TOKEN", raising=False)
+    config = Config.parse("test", json.dumps({"domains": [], "collector": {"enabled": True}}))
+    with pytest.raises(ConfigError):
+        collector_settings(config)
+
+
+def test_agents_receive_the_probe_settings(cert, write_config, monkeypatch):
+    monkeypatch.delenv("SSL_MONITOR_AGENT_TOKEN", raising=False)
+    path = write_config([{"url": "127.0.0.1", "port": 443}],
+                        collector={"enabled": True, "token": TOKEN},
+                        dns={"ttl_seconds": 7}, health={"timeout_seconds": 3},
+                        chain={"ca_file": cert[0]}, capabilities={"enabled": True})
+    probes = Collector(cache=None, config_path=path).lease("a1")["settings"]["probes"]
+
+    assert probes["dns"]["ttl"] == 7
+    assert probes["health"]["timeout"] == 3
+    assert probes["capabilities"]["enabled"] and probes["capabilities"]["store_path"] is None
+    # Il trust store arriva come contenuto: il percorso esiste solo sul collector
+    assert probes["chain"]["ca_file"] is None
+    validator = ChainValidator()
+    validator.configure(**json.loads(json.dumps(probes["chain"])))
+    with open(cert[0]) as f:
+        assert probes["chain"]["ca_data"] == f.read()
+    assert len(validator.anchors()) == 1
+
+
+@pytest.fixture
+def collector(write_config, monkeypatch):
+    """Collector in-process con uno shard e un lease_timeout breve."""
+    monkeypatch.delenv("SSL_MONITOR_AGENT_TOKEN", raising=False)
+    path = write_config([{"url": "127.0.0.1", "port": 443}],
+                        collector={"enabled": True, "token": TOKEN, "agent_timeout_seconds": 60,
+                                   "heartbeat_seconds": 10, "lease_timeout_seconds": 300})
+    return Collector(cache=None, config_path=path)
+
+
+def test_abandoned_shard_expires_while_its_agent_heartbeats(collector):
+    assert [s["id"] for s in collector.lease("a", now=1000)["shards"]] == ["*/0"]
+    # Agent vivo (heartbeat regolari) ma nessun risultato per lo shard
+    for now in range(1010, 1300, 10):
+        assert collector.heartbeat("a", now=now) == ["*/0"]
+    assert collector.lease("b", now=1300)["shards"] == []
+
+    assert collector.heartbeat("a", now=1310) == []
+    assert [s["id"] for s in collector.lease("b", now=1310)["shards"]] == ["*/0"]
+
+
+def test_results_extend_the_lease(collector):
+    collector.lease("a", now=1000)
+    for now in range(1050, 1600, 50):
+        assert collector.receive("a", "*/0", [], now=now)
+    assert collector.heartbeat("a", now=1590) == ["*/0"]
+
+
+def test_heartbeat_releases_shards_the_agent_dropped(collector):
+    collector.lease("a", now=1000)
+    # Appena assegnato: l'agent potrebbe non averlo ancora avviato
+    assert collector.heartbeat("a", active=[], now=1005) == ["*/0"]
+    assert collector.heartbeat("a", active=["*/0"], now=1020) == ["*/0"]
+    assert collector.heartbeat("a", active=[], now=1030) == []
+    assert [s["id"] for s in collector.lease("b", now=1030)["shards"]] == ["*/0"]
+
+
+class _UnreachableCollector:
+    def __init__(self):
+        self.uploads = 0
+
+    def upload(self, shard_id, results, done=False):
+        self.uploads += 1
+        raise urllib.error.URLError("connection refused")
+
+
+def test_agent_drops_shard_when_collector_is_unreachable():
+    client = _UnreachableCollector()
+    shard = {"id": "*/0", "entries": [{"url": "127.0.0.1", "port": p} for p in (1, 2, 3)]}
+    settings = {"concurrency": 2, "per_host": 2}
+    sent = asyncio.run(scan_shard(client, shard, lambda e: {"domain": e["url"], "port": e["port"]},
+                                  settings, batch=1))
+    # Nessuna eccezione: lo shard viene lasciato al primo upload fallito
+    assert sent == 0 and client.uploads == 1
@@ -0,0 +1,18 @@
+import pytest
+
+from app.config import ConfigError, DomainEntry
+
+
+def test_known_keys_are_typed_fields():
+    entry = DomainEntry.from_dict({"url": "mail.test", "port": 25, "starttls": "smtp", "sni": "mx.test",
+                                   "zone": "dc1", "deep_scan": True, "owner": ["ops"]})
+    assert (entry.starttls, entry.sni, entry.zone, entry.deep_scan) == ("smtp", "mx.test", "dc1", True)
+    assert entry.extra == (("owner", '["ops"]'),)
+    assert entry.as_dict() == {"url": "mail.test", "port": 25, "starttls": "smtp", "sni": "mx.test",
+                               "zone": "dc1", "deep_scan": True, "owner": ["ops"]}
+
+
+@pytest.mark.parametrize("field, value", [("deep_scan", "yes"), ("zone", ""), ("sni", 42)])
+def test_invalid_typed_fields_are_rejected(field, value):
+    with pytest.raises(ConfigError, match=field):
+        DomainEntry.from_dict({"url": "mail.test", field: value})
@@ -0,0 +1,126 @@
+import email
+import threading
+import time
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app.notifier import NotificationQueue
+from bench.common import closed_port
+
+RECIPIENTS = ["ops@example.test", "sec@example.test"]
+
+
+class Mailbox:
+    """Handler aiosmtpd: conserva i messaggi e rifiuta temporaneamente i destinatari in `busy`."""
+
+    def __init__(self):
+        self.messages = []   # (destinatario, corpo)
+        self.busy = set()
+        self.received = threading.Event()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.busy:
+            return "451 4.7.1 Riprova più tardi"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        message = email.message_from_bytes(envelope.original_content)
+        body = message.get_payload(decode=True).decode()
+        for recipient in envelope.rcpt_tos:
+            self.messages.append((recipient, body))
+        self.received.set()
+        return "250 Message accepted for delivery"
+
+    def to(self, recipient):
+        return [body for rcpt, body in self.messages if rcpt == recipient]
+
+
+@pytest.fixture
+def smtp():
+    mailbox = Mailbox()
+    controller = Controller(mailbox, hostname="127.0.0.1", port=closed_port())
+    controller.start()
+    yield mailbox, controller.port
+    controller.stop()
+
+
+@pytest.fixture
+def notifier_config(tmp_path, write_config, smtp):
+    _, port = smtp
+
+    def write(retry_backoff=0.2):
+        return write_config([], notification={
+            "batch_seconds": 0,
+            "retry_backoff_seconds": retry_backoff,
+            "max_retries": 3,
+            "state_file": str(tmp_path / "notified.json"),
+            "email": {"enabled": True, "smtp_server": "127.0.0.1", "smtp_port": port,
+                      "from": "monitor@example.test", "to": RECIPIENTS},
+        })
+    return write
+
+
+@pytest.fixture
+def notifications():
+    queue = NotificationQueue()
+    yield queue
+    queue.close(timeout=5)
+
+
+def alert(domain, days_left=5):
+    return {"domain": domain, "port": 443, "alert": True, "days_left": days_left,
+            "expires": "2030-01-01", "issuer": "Test CA", "service": "web"}
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condizione non raggiunta"
+        time.sleep(0.02)
+
+
+def test_alerts_are_sent_once_per_recipient(smtp, notifier_config, notifications):
+    mailbox, _ = smtp
+    path = notifier_config()
+    notifications.submit([alert("a.test")], path)
+    notifications.join()
+    assert [len(mailbox.to(r)) for r in RECIPIENTS] == [1, 1]
+    assert "a.test" in mailbox.to(RECIPIENTS[0])[0]
+
+    # Stesso avviso: deduplicato; un endpoint nuovo parte subito
+    notifications.submit([alert("a.test"), alert("b.test")], path)
+    notifications.join()
+    assert [len(mailbox.to(r)) for r in RECIPIENTS] == [2, 2]
+    assert "b.test" in mailbox.to(RECIPIENTS[0])[1]
+
+
+def test_retry_reaches_only_the_missing_recipient(smtp, notifier_config, notifications):
+    mailbox, _ = smtp
+    mailbox.busy.add(RECIPIENTS[1])
+    path = notifier_config(retry_backoff=0.3)
+    notifications.submit([alert("a.test")], path)
+    notifications.join()
+    assert len(mailbox.to(RECIPIENTS[0])) == 1 and not mailbox.to(RECIPIENTS[1])
+
+    mailbox.busy.clear()
+    wait_for(lambda: mailbox.to(RECIPIENTS[1]))
+    time.sleep(0.5)
+    # Chi l'aveva già ricevuta non la riceve di nuovo
+    assert [len(mailbox.to(r)) for r in RECIPIENTS] == [1, 1]
+
+
+def test_pending_retry_does_not_hold_the_queue(smtp, notifier_config, notifications):
+    mailbox, _ = smtp
+    mailbox.busy.add(RECIPIENTS[1])
+    path = notifier_config(retry_backoff=60)
+    notifications.submit([alert("a.test")], path)
+    notifications.join()
+
+    start = time.monotonic()
+    notifications.submit([alert("a.test"), alert("b.test")], path)
+    notifications.join()
+    assert time.monotonic() - start < 5
+    assert len(mailbox.to(RECIPIENTS[0])) == 2
+    assert "b.test" in mailbox.to(RECIPIENTS[0])[1]
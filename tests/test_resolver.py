@@ -0,0 +1,88 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from app.checker import check_domains, fetch_tls_info
+from app.resolver import DNS_CACHE, DnsCache
+from bench.common import TLSListener, closed_port
+
+
+def _info(address):
+    return (socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (address, 0))
+
+
+class StubResolver:
+    """Resolver finto: nomi -> indirizzi, con un ritardo e il conteggio delle chiamate."""
+
+    def __init__(self, names, delay=0.0):
+        self.names = names
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, host):
+        with self._lock:
+            self.calls.append(host)
+        time.sleep(self.delay)
+        if host not in self.names:
+            raise socket.gaierror(socket.EAI_NONAME, f"{host} sconosciuto")
+        return [_info(address) for address in self.names[host]]
+
+
+@pytest.fixture
+def stub_dns(monkeypatch):
+    """Sostituisce il resolver della cache condivisa con uno `StubResolver`."""
+    def install(names, delay=0.0):
+        stub = StubResolver(names, delay)
+        monkeypatch.setattr(DNS_CACHE, "resolver", stub)
+        DNS_CACHE.clear()
+        return stub
+    yield install
+    DNS_CACHE.clear()
+
+
+def test_ports_of_one_host_share_a_resolution(cert, write_config, stub_dns):
+    listeners = [TLSListener(*cert) for _ in range(4)]
+    stub = stub_dns({"svc.test": ["127.0.0.1"]}, delay=0.2)
+    try:
+        path = write_config([{"url": "svc.test", "port": l.port} for l in listeners])
+        results = check_domains(path, concurrency=4, per_host=4)
+    finally:
+        for listener in listeners:
+            listener.close()
+
+    assert all("error" not in r for r in results)
+    assert stub.calls == ["svc.test"]
+
+
+def test_negative_answers_are_cached(stub_dns):
+    stub = stub_dns({})
+    for _ in range(3):
+        with pytest.raises(OSError):
+            DNS_CACHE.resolve("missing.test", 443)
+    assert stub.calls == ["missing.test"]
+
+
+def test_cache_hits_report_their_own_wait():
+    cache = DnsCache(resolver=StubResolver({"slow.test": ["127.0.0.1"]}, delay=0.2))
+    _, first_ms = cache.lookup("slow.test")
+    _, hit_ms = cache.lookup("slow.test")
+    assert first_ms >= 200
+    assert hit_ms < 50
+
+
+def test_unreachable_address_falls_back_to_the_next(cert, stub_dns):
+    listener = TLSListener(*cert)
+    # Il primo indirizzo rifiuta la connessione sulla porta (es. IPv6 non raggiungibile)
+    stub_dns({"dual.test": ["127.0.0.3", "127.0.0.1"]})
+    try:
+        data, state, error = fetch_tls_info("dual.test", listener.port)
+    finally:
+        listener.close()
+    assert error is None and data["protocol"] == "tls_modern"
+
+    stub_dns({"dead.test": ["127.0.0.3"]})
+    _, state, _ = fetch_tls_info("dead.test", closed_port())
+    assert state == "refused"
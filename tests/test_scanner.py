@@ -0,0 +1,80 @@
+import time
+
+from app.checker import check_domains
+from bench.common import TLSListener
+
+DELAY = 0.3
+
+
+def _fleet(cert, count, delay=DELAY):
+    # Un indirizzo 127.0.0.x per listener: host distinti per il limite per host
+    return [TLSListener(*cert, delay=delay, host=f"127.0.0.{i + 1}") for i in range(count)]
+
+
+def _timed_scan(config_path, **limits):
+    start = time.perf_counter()
+    results = check_domains(config_path, **limits)
+    return results, time.perf_counter() - start
+
+
+def test_concurrent_scan_is_faster_than_serial(cert, write_config):
+    listeners = _fleet(cert, 8)
+    try:
+        path = write_config([{"url": l.host, "port": l.port} for l in listeners])
+        serial, serial_time = _timed_scan(path, concurrency=1)
+        parallel, parallel_time = _timed_scan(path, concurrency=8)
+    finally:
+        for listener in listeners:
+            listener.close()
+
+    assert all("error" not in r for r in serial + parallel)
+    assert serial_time >= 8 * DELAY
+    # Otto handshake lenti sovrapposti: circa un solo ritardo invece di otto
+    assert parallel_time < serial_time / 3
+    assert sorted((r["domain"], r["port"]) for r in parallel) == \
+        sorted((r["domain"], r["port"]) for r in serial)
+
+
+def test_per_host_limit_serializes_one_host(cert, write_config):
+    listener = TLSListener(*cert, delay=DELAY)
+    try:
+        path = write_config([{"url": listener.host, "port": listener.port, "service_name": str(i)}
+                             for i in range(4)])
+        results, elapsed = _timed_scan(path, concurrency=8, per_host=1)
+    finally:
+        listener.close()
+
+    assert len(results) == 4 and all("error" not in r for r in results)
+    assert listener.accepted == 4
+    # Un solo handshake alla volta verso lo stesso host
+    assert elapsed >= 4 * DELAY
+
+
+def test_results_keep_expiry_order(cert, write_config):
+    listeners = _fleet(cert, 3, delay=0)
+    try:
+        path = write_config([{"url": l.host, "port": l.port} for l in listeners]
+                            + [{"url": "127.0.0.1", "port": 1}])
+        results, _ = _timed_scan(path, concurrency=4)
+    finally:
+        for listener in listeners:
+            listener.close()
+
+    # Prima i certificati, poi gli errori (porta chiusa)
+    assert [("error" in r) for r in results] == [False, False, False, True]
+
+
+def test_full_host_does_not_block_other_hosts(cert, write_config):
+    # Due host con sedici porte ciascuno, espansi host dopo host (come `targets`)
+    listeners = [TLSListener(*cert, delay=DELAY, host=f"127.0.1.{h + 1}")
+                 for h in range(2) for _ in range(16)]
+    try:
+        path = write_config([{"url": l.host, "port": l.port} for l in listeners])
+        results, elapsed = _timed_scan(path, concurrency=8, per_host=4)
+    finally:
+        for listener in listeners:
+            listener.close()
+
+    assert len(results) == 32 and all("error" not in r for r in results)
+    # 32 probe su 8 slot: 4 giri; con gli slot fermi sull'host pieno quasi il doppio
+    assert elapsed < 6 * DELAY
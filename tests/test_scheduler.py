@@ -0,0 +1,37 @@
+import time
+import types
+
+from app import scheduler
+from app.scheduler import RefreshScheduler, incremental_scan
+
+SWEEP = {"url": "127.0.0.0/29", "port": "1-3", "service_name": "sweep"}
+
+
+def test_refresh_scheduler_keeps_endpoints_compact(write_config):
+    refresher = RefreshScheduler(types.SimpleNamespace(store=None), write_config([SWEEP]))
+    refresher._load()
+
+    assert len(refresher._entries) == 6 * 3
+    # Un solo dict per entry del config, condiviso da tutti i suoi endpoint
+    assert len({id(entry) for entry, _ in refresher._entries.values()}) == 1
+
+    due = refresher._pop_due(time.monotonic())
+    targets = list(refresher._targets(due))
+    assert [(t["url"], t["port"]) for t in targets] == due
+    assert all(t["service_name"] == "sweep" for t in targets)
+
+
+def test_incremental_scan_expands_targets_lazily(write_config, monkeypatch):
+    seen = []
+
+    def fake_run_sharded(entries, probe, *settings):
+        assert not isinstance(entries, list)
+        seen.extend(entries)
+        return [{"domain": e["url"], "port": e["port"]} for e in seen]
+
+    monkeypatch.setattr(scheduler, "run_sharded", fake_run_sharded)
+    store = types.SimpleNamespace(latest_state=lambda: {})
+    fresh, keys = incremental_scan(write_config([SWEEP]), store)
+
+    assert len(fresh) == len(keys) == 6 * 3
+    assert keys == {(e["url"], e["port"]) for e in seen}
@@ -0,0 +1,65 @@
+import socket
+
+import pytest
+
+from app.checker import fetch_tls_info
+from app.starttls import STARTTLS_MODES, read_banner
+from bench.common import StartTLSListener
+
+# Modalità in cui il server parla per primo: "auto" le riconosce dal banner
+SERVER_FIRST = ("smtp", "imap", "pop3")
+
+
+@pytest.fixture
+def listener(cert):
+    started = []
+
+    def start(mode, offer=True):
+        started.append(StartTLSListener(*cert, mode, offer=offer))
+        return started[-1]
+    yield start
+    for item in started:
+        item.close()
+
+
+@pytest.mark.parametrize("mode", STARTTLS_MODES)
+def test_explicit_upgrade(listener, mode):
+    server = listener(mode)
+    data, state, error = fetch_tls_info(server.host, server.port, timeout=3, starttls=mode)
+    assert error is None, error
+    assert data["starttls"] == mode and data["protocol"] == "tls_modern"
+
+
+@pytest.mark.parametrize("mode", SERVER_FIRST)
+def test_auto_detects_mode_from_banner(listener, mode):
+    server = listener(mode)
+    data, _, error = fetch_tls_info(server.host, server.port, timeout=3, starttls="auto")
+    assert error is None, error
+    assert data["starttls"] == mode
+
+
+@pytest.mark.parametrize("mode", STARTTLS_MODES)
+def test_upgrade_refused_is_no_tls(listener, mode):
+    server = listener(mode, offer=False)
+    _, state, error = fetch_tls_info(server.host, server.port, timeout=3, starttls=mode)
+    assert state == "no_tls" and "STARTTLS" in error
+
+
+def test_read_banner_works_beyond_select_limit():
+    # Descrittori oltre FD_SETSIZE: select() solleverebbe ValueError
+    keep = []
+    try:
+        while True:
+            a, b = socket.socketpair()
+            keep += [a, b]
+            if b.fileno() >= 1100:
+                break
+    except OSError:
+        pytest.skip("limite di file aperti troppo basso")
+    try:
+        assert read_banner(b, 0.05) == b""
+        a.sendall(b"220 ready\r\n")
+        assert read_banner(b, 1) == b"220 ready\r\n"
+    finally:
+        for sock in keep:
+            sock.close()